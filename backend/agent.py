@@ -3,13 +3,35 @@ from torch import nn
 import torch.nn.functional as F
 import numpy as np
 import os
+import copy
 import json
 from datetime import datetime
 import threading
 import time
+import uuid
+import warnings
+from collections import OrderedDict
+from replay import ReplayBuffer
+from features import StateEncoder
+from checkpoint import CheckpointWriter
+from experience import ExperienceLog, FeedbackLog, DECISION
+from shared_weights import SharedWeights, bind_parameters
+from shadow import ShadowEvaluator
+import metrics
+
+# Deployment roles: a single process that serves and trains ("standalone"), inference-only
+# uvicorn workers ("worker") and the one process that trains for them ("trainer")
+ROLES = ("standalone", "worker", "trainer")
 
 COLORS = ['#000000', '#333333', '#666666']
 FONT_SIZES = [1.0, 1.2, 1.4, 1.6]
+# Served as ElementStyle.fontSize, in pixels (relative to a 16px root font)
+FONT_SIZES_PX = [round(size * 16) for size in FONT_SIZES]
+
+# Stage timings exported at /metrics
+POLICY_FORWARD = metrics.stage("policy_forward")
+ACTION_SAMPLING = metrics.stage("action_sampling")
+TRAIN_STEP = metrics.stage("train_step")
 
 class PolicyNetwork(nn.Module):
     def __init__(self, state_dim, action_dim):
@@ -25,67 +47,410 @@ class PolicyNetwork(nn.Module):
 
     def forward(self, x):
         return self.sequential(x)
-    
+
+
+def reinforce_step(policy, optimizer, states, actions, advantages, old_log_probs, max_importance_weight):
+    """
+    One off-policy REINFORCE gradient step. Samples are reweighted by their importance
+    ratio (clipped at max_importance_weight) against the policy that chose them.
+    Returns the loss.
+    """
+    optimizer.zero_grad()
+    logits = policy(states)
+    log_probs = F.log_softmax(logits, dim=-1).gather(1, actions.unsqueeze(1)).squeeze(1)
+    weights = (log_probs.detach() - old_log_probs).exp().clamp(max=max_importance_weight)
+    loss = -(weights * advantages * log_probs).mean()
+    loss.backward()
+    optimizer.step()
+    return loss.item()
+
+
 class RLAgent:
-    def __init__(self, model_path="model/agent_model.pt", save_interval=300):
+    def __init__(self, model_path="model/agent_model.pt", save_interval=300, keep_checkpoints=3,
+                 max_pending=10000, pending_ttl=600,
+                 replay_capacity=10000, batch_size=256, min_batch_size=16, train_interval=2.0,
+                 baseline_decay=0.99, max_importance_weight=2.0,
+                 torch_threads=None, frozen_inference=True, inference_refresh_interval=1.0,
+                 role="standalone", shared_weights_path="model/shared_weights.bin",
+                 experience_path="model/experience.log", weights_poll_interval=0.5,
+                 feedback_log_dir="model/feedback", watch_path=None, watch_interval=2.0):
+        if role not in ROLES:
+            raise ValueError(f"Unknown role {role!r}, expected one of {ROLES}")
+        self.role = role
+
+        # Pin torch's intra-op thread pool; with several uvicorn workers the default
+        # (one thread per core in every worker) oversubscribes the CPU
+        self.torch_threads = torch_threads
+        if torch_threads:
+            torch.set_num_threads(torch_threads)
+
         self.state_dim = 10  # e.g., gaze features, squint, DOM metadata
         self.action_dim = 3  # font-size index, color index, activationTime bucket
+        self.state_encoder = StateEncoder(self.state_dim)
         self.policy = PolicyNetwork(self.state_dim, self.action_dim)
         self.optimizer = torch.optim.Adam(self.policy.parameters(), lr=1e-3)
         
         self.model_path = model_path
         self.save_interval = save_interval  # Save every 5 minutes by default
-        self.last_save_time = time.time()
+        self.checkpoint_writer = CheckpointWriter(model_path, keep=keep_checkpoints)
+        self._saved_steps = None  # train_steps at the last save, to skip saving unchanged weights
+
+        # Decisions waiting for feedback: decision_id -> (created_at, state, action, log_prob, session_id)
+        # Ordered by creation so expired / overflowing entries are evicted from the front
+        self.max_pending = max_pending
+        self.pending_ttl = pending_ttl
+        self._pending = OrderedDict()
+        self._session_decisions = {}  # session_id -> latest decision_id
+        self._pending_lock = threading.Lock()
+
+        # Feedback is appended to the replay buffer and trained on in mini-batches by a
+        # background thread every train_interval seconds (or as soon as batch_size new
+        # samples arrive), so /feedback never runs the optimizer itself
+        self.replay = ReplayBuffer(replay_capacity, self.state_dim)
+        self.batch_size = batch_size
+        self.min_batch_size = min_batch_size
+        self.train_interval = train_interval
+        self.baseline_decay = baseline_decay
+        self.max_importance_weight = max_importance_weight
+        self.reward_baseline = None  # running mean of rewards
+        self.train_steps = 0
+        self._new_samples = 0
+        self._train_cond = threading.Condition()
+        self._policy_lock = threading.Lock()  # guards policy weights between training and snapshots
+
+        # Requests are served from a separate inference copy of the policy (frozen TorchScript
+        # if frozen_inference), refreshed after training steps at most every
+        # inference_refresh_interval seconds since freezing costs tens of milliseconds
+        self.frozen_inference = frozen_inference
+        self.inference_refresh_interval = inference_refresh_interval
+        self.inference_policy = None
+        self._inference_stale = False
+        self._last_inference_refresh = 0.0
+
+        # Multi-process mode: workers log decisions and rewards to the experience log and
+        # serve weights the trainer publishes through the shared weights file
+        self.shared_weights_path = shared_weights_path
+        self.weights_poll_interval = weights_poll_interval
+        self.shared_weights = None
+        self.weights_version = None
+        self.experience_log = ExperienceLog(experience_path, self.state_dim) if role != "standalone" else None
+        self.dropped_feedback = 0  # trainer: rewards whose decision was unknown or expired
+
+        # Every decision and reward is also kept in a persistent log for offline training
+        # (train_offline.py). The trainer's records all come from workers, which log them.
+        self.feedback_log = None
+        if feedback_log_dir and role != "trainer":
+            self.feedback_log = FeedbackLog(feedback_log_dir, self.state_dim)
         
+        # New checkpoints can be swapped in while serving (swap_model, or by dropping a file at
+        # watch_path), or scored against live traffic first without serving them (start_shadow)
+        self.watch_path = watch_path
+        self.watch_interval = watch_interval
+        self.shadow = None
+        self._swap_lock = threading.Lock()
+
         # Create model directory if it doesn't exist
         os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
         
         # Load existing model if available
         self.load_model()
+        if role == "trainer":
+            num_weights = sum(p.numel() for p in self.policy.parameters())
+            self.shared_weights = SharedWeights.create(shared_weights_path, num_weights)
+        self._refresh_inference_policy()
+
+        if role == "worker":
+            # Workers never train or save; they follow the trainer's published weights
+            self.weights_thread = threading.Thread(target=self._watch_shared_weights, daemon=True)
+            self.weights_thread.start()
+            return
         
         # Start background saving thread
         self.save_thread = threading.Thread(target=self._periodic_save, daemon=True)
         self.save_thread.start()
 
-    def select_action(self, state):
-        # Assume state is a flat list of floats
-        state_tensor = torch.tensor(state, dtype=torch.float32)
-        logits = self.policy(state_tensor)
-        probs = F.softmax(logits, dim=-1)
-
-        action = torch.multinomial(probs, num_samples=1).item()
-
-        # Decode action → config mutation
-        font_size = FONT_SIZES[action % len(FONT_SIZES)]
-        color = COLORS[(action // len(FONT_SIZES)) % len(COLORS)]
-        activation_time = round(torch.rand(1).item() * 0.7 + 0.3, 2)  # Random between 0.3 and 1.0
-
-        # Save for future training (simplified)
-        self.last_state = state_tensor
-        self.last_action = torch.tensor(action)
-        return {
-            "tag": "p",
-            "style": {
-                "font-size": f"{font_size}em",
-                "color": color
-            },
-            "activationTime": activation_time
-        }
-
-    def update_policy(self, reward):
-        # Simple REINFORCE update
-        self.optimizer.zero_grad()
-        logits = self.policy(self.last_state)
-        log_prob = F.log_softmax(logits, dim=-1)[self.last_action]
-        loss = -log_prob * reward
-        loss.backward()
-        self.optimizer.step()
-        
-        # Check if we should save the model
-        current_time = time.time()
-        if current_time - self.last_save_time > self.save_interval:
-            self.save_model()
-            self.last_save_time = current_time
+        # Start background training thread
+        self.train_thread = threading.Thread(target=self._train_loop, daemon=True)
+        self.train_thread.start()
+
+        if role == "trainer":
+            self.experience_thread = threading.Thread(target=self._consume_experience, daemon=True)
+            self.experience_thread.start()
+
+        if watch_path:
+            self.watch_thread = threading.Thread(target=self._watch_checkpoint, daemon=True)
+            self.watch_thread.start()
+
+    def select_action(self, state, session_id=None, record=True):
+        return self.select_actions([state], [session_id], record)[0]
+
+    def select_actions(self, states, session_ids=None, record=True):
+        """
+        Choose configs for a batch of states with a single [N, state_dim] forward pass.
+        Returns one config dict per state, in order.
+        With record=False this is inference only: no decision is kept for feedback, logged for
+        offline training or shown to the shadow policy, and decisionId is None. Use it for configs
+        that are never handed to the client as RL decisions (e.g. the Gemini fallback)
+        """
+        # Assume each state is a flat list of floats
+        state_tensor = torch.as_tensor(np.asarray(states, dtype=np.float32)).reshape(-1, self.state_dim)
+        n = state_tensor.shape[0]
+        with torch.inference_mode():
+            start = metrics.now()
+            logits = self.inference_policy(state_tensor)
+            log_probs = F.log_softmax(logits, dim=-1)
+            POLICY_FORWARD.observe_since(start)
+
+            # Inverse-CDF sampling: much cheaper than torch.multinomial for a few actions
+            start = metrics.now()
+            uniforms = torch.rand(n, 2)
+            cdf = log_probs.exp().cumsum(dim=-1)
+            actions = (cdf < uniforms[:, :1]).sum(dim=-1).clamp_(max=self.action_dim - 1)
+            chosen_log_probs = log_probs.gather(1, actions.unsqueeze(1)).squeeze(1).tolist()
+            activation_times = (uniforms[:, 1] * 0.7 + 0.3).tolist()  # Random between 0.3 and 1.0
+            ACTION_SAMPLING.observe_since(start)
+            shadow = self.shadow
+            if shadow is not None and record:
+                shadow.submit(state_tensor, log_probs, actions)
+            actions = actions.tolist()
+
+        # Decode actions → config mutations
+        font_indices = [action % len(FONT_SIZES) for action in actions]
+        color_indices = [(action // len(FONT_SIZES)) % len(COLORS) for action in actions]
+
+        # Remember the decisions so feedback can be credited to them later
+        session_ids = session_ids or [None] * n
+        records = None
+        if not record:
+            decision_ids = [None] * n
+        elif self.role == "worker":
+            decision_ids = [uuid.uuid4().hex for _ in range(n)]
+            records = self.experience_log.decisions(
+                decision_ids, session_ids, state_tensor.numpy(), actions, chosen_log_probs, time.time()
+            )
+            self.experience_log.append(records)
+        else:
+            decision_ids = self._record_decisions(state_tensor, actions, chosen_log_probs, session_ids)
+        if self.feedback_log is not None and record:
+            if records is None:
+                records = self.feedback_log.decisions(
+                    decision_ids, session_ids, state_tensor.numpy(), actions, chosen_log_probs, time.time()
+                )
+            self._log_feedback(records)
+        return [
+            {
+                "decisionId": decision_ids[i],
+                "tag": "p",
+                "style": {
+                    "fontSize": FONT_SIZES_PX[font_indices[i]],
+                    "color": COLORS[color_indices[i]]
+                },
+                "activationTime": round(activation_times[i], 2)
+            }
+            for i in range(n)
+        ]
+
+    def _refresh_inference_policy(self):
+        """
+        Rebuild the copy of the policy used to serve requests from the current weights.
+        The new copy is swapped in with a single assignment, so requests never see a
+        half-updated model. The trainer publishes to the shared weights file instead.
+        """
+        if self.role == "trainer":
+            with self._policy_lock:
+                flat_weights = nn.utils.parameters_to_vector(self.policy.parameters())
+            self.weights_version = self.shared_weights.publish(flat_weights)
+            self._inference_stale = False
+            self._last_inference_refresh = time.time()
+            return
+
+        with self._policy_lock:
+            policy = copy.deepcopy(self.policy)
+        self.inference_policy = self._inference_copy(policy)
+        self._inference_stale = False
+        self._last_inference_refresh = time.time()
+
+    def _inference_copy(self, policy):
+        """Prepare a policy (which must not be trained afterwards) for serving"""
+        policy.eval()
+        for param in policy.parameters():
+            param.requires_grad_(False)
+        if self.frozen_inference:
+            try:
+                with warnings.catch_warnings():
+                    # TorchScript is deprecated in recent torch releases but still the fastest eager-free path
+                    warnings.simplefilter("ignore", FutureWarning)
+                    policy = torch.jit.freeze(torch.jit.script(policy))
+            except Exception as e:
+                print(f"Failed to freeze inference policy, serving eager copy: {e}")
+        return policy
+
+    def _maybe_refresh_inference_policy(self):
+        if self._inference_stale and time.time() - self._last_inference_refresh >= self.inference_refresh_interval:
+            self._refresh_inference_policy()
+
+    def _watch_shared_weights(self):
+        """Worker thread: rebind the serving policy whenever the trainer publishes new weights"""
+        while True:
+            try:
+                if self.shared_weights is None:
+                    self.shared_weights = SharedWeights.open(self.shared_weights_path)
+                if self.shared_weights is not None and self.shared_weights.version() != self.weights_version:
+                    version, flat_weights = self.shared_weights.read()
+                    policy = PolicyNetwork(self.state_dim, self.action_dim).eval()
+                    self.inference_policy = bind_parameters(policy, flat_weights)
+                    self.weights_version = version
+            except Exception as e:
+                print(f"Failed to load shared weights: {e}")
+            time.sleep(self.weights_poll_interval)
+
+    def _consume_experience(self):
+        """Trainer thread: turn decision / reward records logged by the workers into training samples"""
+        while True:
+            try:
+                records = self.experience_log.read_new()
+                # In log order, so each reward finds the decisions logged before it (and not later ones
+                # of the same session); runs of consecutive decisions are still recorded in one call
+                kinds = records["kind"]
+                boundaries = np.flatnonzero(kinds[1:] != kinds[:-1]) + 1
+                for run in np.split(records, boundaries) if len(records) else ():
+                    if run[0]["kind"] == DECISION:
+                        self._record_decisions(
+                            torch.from_numpy(run["state"].copy()),
+                            run["action"].tolist(),
+                            run["log_prob"].tolist(),
+                            [key or None for key in run["session"].tolist()],
+                            decision_ids=[d.decode() for d in run["decision_id"].tolist()],
+                        )
+                        continue
+                    for record in run:
+                        try:
+                            self.update_policy(
+                                float(record["reward"]),
+                                decision_id=record["decision_id"].decode() or None,
+                                session_id=int(record["session"]) or None,
+                            )
+                        except KeyError:
+                            self.dropped_feedback += 1
+                self.experience_log.commit()
+                self.experience_log.compact()
+            except Exception as e:
+                print(f"Failed to read experience log: {e}")
+            time.sleep(0.1)
+
+    def _record_decisions(self, state_tensor, actions, log_probs, session_ids, decision_ids=None):
+        if decision_ids is None:
+            decision_ids = [uuid.uuid4().hex for _ in actions]
+        now = time.time()
+        with self._pending_lock:
+            self._evict_pending(now, reserve=len(actions))
+            for i, decision_id in enumerate(decision_ids):
+                self._pending[decision_id] = (now, state_tensor[i], actions[i], log_probs[i], session_ids[i])
+                if session_ids[i] is not None:
+                    self._session_decisions[session_ids[i]] = decision_id
+        return decision_ids
+
+    def _evict_pending(self, now, reserve=0):
+        """Drop expired decisions and make room for `reserve` new ones (caller holds the lock)"""
+        while self._pending:
+            decision_id, (created_at, *_rest, session_id) = next(iter(self._pending.items()))
+            if created_at + self.pending_ttl >= now and len(self._pending) + reserve <= self.max_pending:
+                break
+            self._pending.popitem(last=False)
+            if session_id is not None and self._session_decisions.get(session_id) == decision_id:
+                del self._session_decisions[session_id]
+
+    def _pop_decision(self, decision_id=None, session_id=None):
+        """
+        Find and remove the pending decision feedback refers to: by decision_id,
+        else the latest decision of session_id, else (legacy clients) the most recent one
+        """
+        with self._pending_lock:
+            self._evict_pending(time.time())
+            if decision_id is None and session_id is not None:
+                decision_id = self._session_decisions.get(session_id)
+                if decision_id is None:
+                    raise KeyError(f"No pending decision for session {session_id}")
+            if decision_id is None:
+                if not self._pending:
+                    raise KeyError("No pending decision to credit")
+                decision_id = next(reversed(self._pending))
+
+            record = self._pending.pop(decision_id, None)
+            if record is None:
+                raise KeyError(f"Unknown or expired decision {decision_id}")
+            session_id = record[4]
+            if session_id is not None and self._session_decisions.get(session_id) == decision_id:
+                del self._session_decisions[session_id]
+            return record
+
+    def _log_feedback(self, records):
+        try:
+            self.feedback_log.append(records)
+        except OSError as e:
+            print(f"Failed to write feedback log: {e}")
+
+    def update_policy(self, reward, decision_id=None, session_id=None):
+        """Queue the reward for the referenced decision; training happens in the background"""
+        if self.feedback_log is not None:
+            self._log_feedback(self.feedback_log.reward(reward, decision_id, session_id, time.time()))
+        if self.role == "worker":
+            # The trainer matches the reward to its decision
+            self.experience_log.append(self.experience_log.reward(reward, decision_id, session_id, time.time()))
+            return
+
+        _created_at, state_tensor, action, log_prob, _session_id = self._pop_decision(decision_id, session_id)
+        self.replay.add(state_tensor, action, reward, log_prob)
+
+        with self._train_cond:
+            self._new_samples += 1
+            if self._new_samples >= self.batch_size:
+                self._train_cond.notify()
+
+    def train_step(self):
+        """
+        One REINFORCE update on a mini-batch sampled from the replay buffer.
+        Rewards are centred on a running baseline and normalized; samples are
+        reweighted by their (clipped) importance ratio since they were collected
+        by older versions of the policy.
+        """
+        if len(self.replay) == 0:
+            return None
+        start = metrics.now()
+        states, actions, rewards, old_log_probs = self.replay.sample(self.batch_size)
+
+        batch_mean = rewards.mean().item()
+        if self.reward_baseline is None:
+            self.reward_baseline = batch_mean
+        advantages = rewards - self.reward_baseline
+        if len(advantages) > 1:
+            advantages = advantages / (advantages.std() + 1e-8)
+        self.reward_baseline = self.baseline_decay * self.reward_baseline + (1 - self.baseline_decay) * batch_mean
+
+        with self._policy_lock:
+            loss = reinforce_step(self.policy, self.optimizer, states, actions, advantages, old_log_probs,
+                                  self.max_importance_weight)
+            self.train_steps += 1
+        TRAIN_STEP.observe_since(start)
+        self._inference_stale = True
+        self._maybe_refresh_inference_policy()
+        return loss
+
+    def _train_loop(self):
+        """Background thread function to train on queued feedback"""
+        while True:
+            with self._train_cond:
+                self._train_cond.wait_for(lambda: self._new_samples >= self.batch_size, timeout=self.train_interval)
+                ready = self._new_samples >= self.min_batch_size
+                if ready:
+                    self._new_samples = 0
+            if ready:
+                try:
+                    self.train_step()
+                except Exception as e:
+                    print(f"Training step failed: {e}")
+            # Pick up steps whose refresh was deferred by the rate limit
+            self._maybe_refresh_inference_policy()
 
     def load_model(self):
         """Load the model and optimizer state from file if it exists"""
@@ -94,26 +459,125 @@ class RLAgent:
                 checkpoint = torch.load(self.model_path, map_location='cpu')
                 self.policy.load_state_dict(checkpoint['model_state_dict'])
                 self.optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+                self.train_steps = checkpoint.get('train_steps', 0)
+                self._saved_steps = self.train_steps
                 print(f"Model loaded from {self.model_path}")
             except Exception as e:
                 print(f"Failed to load model: {e}")
         else:
             print(f"No existing model found at {self.model_path}, starting fresh")
 
-    def save_model(self):
-        """Save the model and optimizer state to file"""
-        try:
+    def _load_checkpoint(self, path):
+        """Load a checkpoint and check it fits this agent. Returns (checkpoint, policy)."""
+        checkpoint = torch.load(path, map_location='cpu', weights_only=True)
+        for key, expected in (('state_dim', self.state_dim), ('action_dim', self.action_dim)):
+            if checkpoint.get(key, expected) != expected:
+                raise ValueError(f"Checkpoint {path} has {key}={checkpoint[key]}, expected {expected}")
+        policy = PolicyNetwork(self.state_dim, self.action_dim)
+        policy.load_state_dict(checkpoint['model_state_dict'])
+        return checkpoint, policy
+
+    def swap_model(self, path):
+        """
+        Load the checkpoint at path and start serving it, without dropping requests:
+        requests in flight finish on the old inference copy, later ones use the new one.
+        Training continues from the loaded weights. Raises on an invalid checkpoint.
+        """
+        if self.role == "worker":
+            raise RuntimeError("Workers serve the trainer's weights; swap the model on the trainer")
+        with self._swap_lock:
+            checkpoint, policy = self._load_checkpoint(path)
+            optimizer = torch.optim.Adam(self.policy.parameters(), lr=1e-3)
+            with self._policy_lock:
+                self.policy.load_state_dict(policy.state_dict())
+                try:
+                    optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+                except (KeyError, ValueError):
+                    pass  # start the optimizer fresh
+                self.optimizer = optimizer
+                self.train_steps = checkpoint.get('train_steps', 0)
+                self._saved_steps = None  # persist the swapped-in weights on the next save
+            self._refresh_inference_policy()
+        print(f"Now serving model from {path}")
+        return {"path": path, "train_steps": self.train_steps, "timestamp": checkpoint.get('timestamp')}
+
+    def start_shadow(self, path):
+        """Score the checkpoint at path against live traffic without serving it (see shadow.py)"""
+        with self._swap_lock:
+            _checkpoint, policy = self._load_checkpoint(path)
+            previous, self.shadow = self.shadow, ShadowEvaluator(self._inference_copy(policy), path)
+        if previous is not None:
+            previous.close()
+        return self.shadow.stats()
+
+    def stop_shadow(self):
+        """Stop shadow evaluation; returns its final stats, or None if none was running"""
+        shadow, self.shadow = self.shadow, None
+        if shadow is None:
+            return None
+        shadow.close()
+        return shadow.stats()
+
+    def promote_shadow(self):
+        """Serve the model currently in shadow evaluation"""
+        if self.shadow is None:
+            raise RuntimeError("No shadow model to promote")
+        result = self.swap_model(self.shadow.path)
+        self.stop_shadow()
+        return result
+
+    def _watch_checkpoint(self):
+        """
+        Swap in the checkpoint at watch_path whenever it is replaced. A change is acted on
+        once it has been stable for one poll, so a file still being written is not loaded.
+        """
+        def signature():
+            try:
+                stat = os.stat(self.watch_path)
+                return stat.st_mtime_ns, stat.st_size, stat.st_ino
+            except FileNotFoundError:
+                return None
+
+        seen = changed = signature()
+        while True:
+            time.sleep(self.watch_interval)
+            current = signature()
+            if current is None or current == seen:
+                continue
+            if current != changed:
+                changed = current
+                continue
+            seen = current
+            try:
+                self.swap_model(self.watch_path)
+            except Exception as e:
+                print(f"Failed to load model from {self.watch_path}: {e}")
+
+    def save_model(self, wait=False):
+        """
+        Snapshot the model and optimizer state and hand it to the background checkpoint
+        writer. Skipped if no training step happened since the last save. With wait=True,
+        block until the checkpoint is on disk (e.g. on shutdown).
+        Returns False if the save was skipped.
+        """
+        if self.role == "worker":
+            return False  # the trainer owns the checkpoint
+        with self._policy_lock:
+            if self._saved_steps == self.train_steps and os.path.exists(self.model_path):
+                return False
             checkpoint = {
-                'model_state_dict': self.policy.state_dict(),
-                'optimizer_state_dict': self.optimizer.state_dict(),
+                'model_state_dict': {k: v.detach().clone() for k, v in self.policy.state_dict().items()},
+                'optimizer_state_dict': copy.deepcopy(self.optimizer.state_dict()),
                 'timestamp': datetime.now().isoformat(),
+                'train_steps': self.train_steps,
                 'state_dim': self.state_dim,
                 'action_dim': self.action_dim
             }
-            torch.save(checkpoint, self.model_path)
-            print(f"Model saved to {self.model_path}")
-        except Exception as e:
-            print(f"Failed to save model: {e}")
+            self._saved_steps = self.train_steps
+        self.checkpoint_writer.submit(checkpoint)
+        if wait:
+            self.checkpoint_writer.flush()
+        return True
 
     def _periodic_save(self):
         """Background thread function to save model periodically"""
@@ -121,36 +585,13 @@ class RLAgent:
             time.sleep(self.save_interval)
             self.save_model()
 
-    def get_state_from_context(self, tag, user_info):
-        """Convert tag and user_info into a numerical state vector"""
-        state = [0.0] * self.state_dim
-        
-        # Tag encoding (simple hash-based)
-        tag_hash = hash(tag) % 100 / 100.0
-        state[0] = tag_hash
-        
-        # User info features
-        if user_info:
-            # Extract numerical features from user_info
-            age = user_info.get('age', 25) / 100.0  # Normalize age
-            state[1] = age
-            
-            # Vision condition encoding
-            vision_conditions = user_info.get('vision_conditions', [])
-            if 'myopia' in vision_conditions:
-                state[2] = 1.0
-            if 'astigmatism' in vision_conditions:
-                state[3] = 1.0
-            if 'presbyopia' in vision_conditions:
-                state[4] = 1.0
-                
-            # Reading preferences
-            reading_prefs = user_info.get('reading_preferences', {})
-            state[5] = reading_prefs.get('prefers_large_text', 0.5)
-            state[6] = reading_prefs.get('prefers_high_contrast', 0.5)
-            
-        # Fill remaining dimensions with random features for now
-        for i in range(7, self.state_dim):
-            state[i] = np.random.random()
-            
-        return state
\ No newline at end of file
+    def get_state_from_context(self, tag, user_info, gaze_features=None):
+        """
+        Convert tag and user_info into a numerical state vector (see features.StateEncoder).
+        gaze_features (see gaze.GazeFeatureStore) fill the remaining dimensions; zeros if there are none.
+        """
+        return self.state_encoder.encode(tag, user_info, gaze_features)
+
+    def get_states_from_context(self, tags, user_infos, gaze_features=None):
+        """Batched get_state_from_context: an [N, state_dim] array"""
+        return self.state_encoder.encode_batch(tags, user_infos, gaze_features)
@@ -0,0 +1,64 @@
+import asyncio
+from typing import Any, Callable, List
+
+
+class MicroBatcher:
+    """
+    Collects concurrent single requests for up to max_wait seconds (or until
+    max_batch_size are queued) and runs them through batch_fn in one call.
+
+    batch_fn takes a list of items and returns a list of results in the same order.
+    It runs on the event loop, so it should be fast (e.g. one batched forward pass).
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 64, max_wait: float = 0.002):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._items = []
+        self._futures = []
+        self._flush_handle = None
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item: Any) -> Any:
+        """Queue one item and wait for its result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._items.append(item)
+        self._futures.append(future)
+
+        if len(self._items) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        items, futures = self._items, self._futures
+        self._items, self._futures = [], []
+        if not items:
+            return
+
+        self.batches += 1
+        self.items += len(items)
+        try:
+            results = self.batch_fn(items)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+        }
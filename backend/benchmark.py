@@ -0,0 +1,335 @@
+"""
+Offline benchmark suite for the backend.
+
+Runs without network access or a Gemini API key: Gemini is replaced by a local
+stand-in with configurable latency, and the FastAPI app is driven in-process.
+
+Usage:
+    python benchmark.py                          # component + end-to-end benchmarks
+    python benchmark.py --only components
+    python benchmark.py --only e2e --clients 64 --llm-latency 1.0
+    python benchmark.py --only cold_start         # import time vs. IMPORT_TIME_BUDGET
+    python benchmark.py --save                   # write bench_results/<git sha>.json
+    python benchmark.py --compare bench_results/<sha>.json
+
+Reports throughput, p50/p95/p99 latency and allocations per operation.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BACKEND_DIR, "bench_results")
+
+USER_INFO = {
+    "age": 67,
+    "vision_conditions": ["presbyopia"],
+    "reading_preferences": {"prefers_large_text": 0.9, "prefers_high_contrast": 0.7},
+    "accessibility_needs": {"visual": ["low vision"], "motor": [], "cognitive": []},
+    "preferences": {"font_size": "large", "contrast": "high", "colors": [], "interaction_speed": "slow"},
+    "feedback_history": [],
+}
+CONFIG = {
+    "div": {"activationTime": 1, "style": {"scale": 1.2, "color": "#000000", "textColor": "#FFFFFF"}},
+    "p": {"activationTime": 0.5, "style": {"fontSize": 16, "color": "#000000", "textColor": "#FFFFFF"}},
+}
+LLM_RESPONSE = "```json\n" + json.dumps(CONFIG, indent=2) + "\n```"
+
+# Seconds `import main` may take: a new worker should answer /health well within a second,
+# with torch, the RL agent and the Gemini client loading afterwards
+IMPORT_TIME_BUDGET = 1.0
+
+COLD_START_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import main
+imported = time.perf_counter()
+main.load_rl_agent()
+main.gemini.get_model()
+ready = time.perf_counter()
+print(json.dumps({"import_s": imported - start, "ready_s": ready - start}))
+"""
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGeminiModel:
+    """Local stand-in for genai.GenerativeModel with a fixed response latency"""
+
+    def __init__(self, latency=0.5, response_text=LLM_RESPONSE):
+        self.latency = latency
+        self.response_text = response_text
+        self.calls = 0
+
+    async def generate_content_async(self, prompt, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return FakeResponse(self.response_text)
+
+    def generate_content(self, prompt, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        return FakeResponse(self.response_text)
+
+
+def load_backend(llm_latency):
+    """Import main.py against the fake Gemini model, with model files in a temp directory"""
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    os.environ["GEMINI_TRACE"] = "0"
+    os.chdir(tempfile.mkdtemp(prefix="websight-bench-"))
+    sys.path.insert(0, BACKEND_DIR)
+
+    import gemini
+    gemini.model = FakeGeminiModel(llm_latency)
+    import main
+    main.load_rl_agent()
+    return main, gemini
+
+
+def summarize(latencies_ns, elapsed_s, allocated_bytes=None, count=None):
+    latencies_us = np.asarray(latencies_ns, dtype=np.float64) / 1000
+    count = count if count is not None else len(latencies_us)
+    result = {
+        "count": count,
+        "throughput_per_s": count / elapsed_s if elapsed_s else 0.0,
+        "mean_us": float(latencies_us.mean()),
+        "p50_us": float(np.percentile(latencies_us, 50)),
+        "p95_us": float(np.percentile(latencies_us, 95)),
+        "p99_us": float(np.percentile(latencies_us, 99)),
+    }
+    if allocated_bytes is not None:
+        result["alloc_bytes_per_op"] = allocated_bytes / count
+    return result
+
+
+def bench(fn, iterations, warmup=50):
+    """Time fn() per call, then measure allocations over a second, traced run"""
+    for _ in range(warmup):
+        fn()
+
+    latencies = np.empty(iterations, dtype=np.int64)
+    start = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter_ns()
+        fn()
+        latencies[i] = time.perf_counter_ns() - t0
+    elapsed = time.perf_counter() - start
+
+    traced = max(1, iterations // 10)
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    for _ in range(traced):
+        fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return summarize(latencies, elapsed, allocated_bytes=(peak - before) * iterations / traced, count=iterations)
+
+
+def run_components(main, gemini, iterations):
+    agent = main.load_rl_agent()
+    state = agent.get_state_from_context("p", USER_INFO)
+    states = [state] * 64
+    span = gemini.metrics.stage("benchmark")
+    element_response = "```json\n" + json.dumps(CONFIG["p"], indent=2) + "\n```"
+    decision = agent.select_action(state)
+
+    def feedback():
+        decision = agent.select_action(state)
+        agent.update_policy(1.0, decision_id=decision["decisionId"])
+
+    # Fill the replay buffer so train_step has something to sample
+    for _ in range(agent.batch_size):
+        feedback()
+
+    # A full config index for "p": one close profile among CONFIG_INDEX_SIZE others
+    index = gemini.ConfigIndex(max_per_tag=gemini.CONFIG_INDEX_SIZE)
+    rng = np.random.default_rng(0)
+    for i in range(gemini.CONFIG_INDEX_SIZE - 1):
+        needs = {**USER_INFO["accessibility_needs"], "visual": [f"need {rng.integers(1000)}"]}
+        index.add({**USER_INFO, "age": int(rng.integers(10, 90)), "accessibility_needs": needs}, CONFIG)
+    index.add(USER_INFO, CONFIG)
+
+    cases = {
+        "get_state_from_context": lambda: agent.get_state_from_context("p", USER_INFO),
+        "get_states_from_context_x64": lambda: agent.get_states_from_context(["p"] * 64, [USER_INFO] * 64),
+        "select_action": lambda: agent.select_action(state),
+        "select_actions_x64": lambda: agent.select_actions(states),
+        "select_action+update_policy": feedback,
+        "train_step": agent.train_step,
+        "config_index_lookup": lambda: index.lookup("p", USER_INFO),
+        "config_index_lookup_config": lambda: index.lookup_config(USER_INFO, CONFIG),
+        "parse_config": lambda: gemini.GeminiService._parse_config(LLM_RESPONSE, CONFIG, "benchmark"),
+        "parse_element": lambda: gemini.GeminiService._parse_element(element_response, "benchmark"),
+        "metrics_span": lambda: span.observe_since(gemini.metrics.now()),
+        "rl_config_response": lambda: main.FastJSONResponse(main.rl_config_response(decision)),
+    }
+    results = {}
+    for name, fn in cases.items():
+        n = iterations // 10 if name == "train_step" else iterations
+        results[name] = bench(fn, n)
+        print_result(name, results[name])
+    return results
+
+
+async def run_e2e(main, clients, requests_per_client):
+    import httpx
+
+    transport = httpx.ASGITransport(app=main.app)
+    latencies = {}
+
+    # One LLM-backed request per 10 requests, the rest hit the cheap endpoints
+    def request_for(i):
+        if i % 10 == 0:
+            return "POST /update_whole_config", ("POST", "/update_whole_config",
+                                                 {"userInfo": {**USER_INFO, "n": i}, "config": CONFIG})
+        if i % 2 == 0:
+            return "GET /health", ("GET", "/health", None)
+        return "POST /rl_config", ("POST", "/rl_config", {"tag": "p", "userInfo": USER_INFO})
+
+    async def client(client_id, http):
+        for i in range(requests_per_client):
+            name, (method, path, body) = request_for(client_id * requests_per_client + i)
+            t0 = time.perf_counter_ns()
+            response = await http.request(method, path, json=body)
+            latencies.setdefault(name, []).append(time.perf_counter_ns() - t0)
+            if response.status_code != 200:
+                raise RuntimeError(f"{name} returned {response.status_code}")
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as http:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(c, http) for c in range(clients)))
+        elapsed = time.perf_counter() - start
+        timed = {name: list(values) for name, values in latencies.items()}
+
+        # Allocations are measured on a separate, shorter run since tracing skews latency
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        traced_clients = max(1, clients // 4)
+        await asyncio.gather(*(client(c, http) for c in range(traced_clients)))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    results = {name: summarize(values, elapsed) for name, values in sorted(timed.items())}
+    results["all"] = summarize([x for values in timed.values() for x in values], elapsed)
+    results["all"]["alloc_bytes_per_op"] = peak / (traced_clients * requests_per_client)
+    for name, result in results.items():
+        print_result(name, result)
+    return results
+
+
+def run_cold_start(runs):
+    """Time `import main`, and until the RL agent and Gemini client are loaded, in fresh interpreters"""
+    env = {**os.environ, "GEMINI_API_KEY": os.environ.get("GEMINI_API_KEY", "benchmark"), "GEMINI_TRACE": "0"}
+    samples = []
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, "-c", COLD_START_SCRIPT, BACKEND_DIR],
+            cwd=tempfile.mkdtemp(prefix="websight-bench-"), env=env, stderr=subprocess.DEVNULL,
+        )
+        samples.append(json.loads(output.decode().strip().splitlines()[-1]))
+    result = {key: float(np.median([sample[key] for sample in samples])) for key in ("import_s", "ready_s")}
+    result["import_budget_s"] = IMPORT_TIME_BUDGET
+    verdict = "within" if result["import_s"] <= IMPORT_TIME_BUDGET else "OVER"
+    print(f"  import main                      {result['import_s']:>8.3f}s  ({verdict} the {IMPORT_TIME_BUDGET}s budget)")
+    print(f"  services ready                   {result['ready_s']:>8.3f}s")
+    return result
+
+
+def print_result(name, result):
+    alloc = result.get("alloc_bytes_per_op")
+    alloc_text = f"  alloc {alloc / 1024:8.1f} KiB/op" if alloc is not None else ""
+    print(f"  {name:<32} {result['throughput_per_s']:>10.0f}/s  p50 {result['p50_us']:>10.1f}us"
+          f"  p95 {result['p95_us']:>10.1f}us  p99 {result['p99_us']:>10.1f}us{alloc_text}")
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results, baseline_path):
+    """Print p50/p99 changes relative to a saved baseline"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared to {baseline_path} ({baseline.get('revision')}):")
+    for section in ("components", "e2e"):
+        for name, result in results.get(section, {}).items():
+            old = baseline.get(section, {}).get(name)
+            if old is None:
+                continue
+            changes = []
+            for key in ("p50_us", "p99_us"):
+                delta = (result[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+                changes.append(f"{key} {delta:+6.1f}%")
+            print(f"  {section}/{name:<32} " + "  ".join(changes))
+    old, new = baseline.get("cold_start"), results.get("cold_start")
+    if old and new:
+        changes = [f"{key} {(new[key] - old[key]) / old[key] * 100:+6.1f}%" for key in ("import_s", "ready_s")]
+        print(f"  {'cold_start':<43} " + "  ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", choices=["components", "e2e", "cold_start"], help="run just one group of benchmarks")
+    parser.add_argument("--iterations", type=int, default=2000, help="iterations per component benchmark")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent end-to-end clients")
+    parser.add_argument("--requests", type=int, default=50, help="requests per end-to-end client")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="fake Gemini latency in seconds")
+    parser.add_argument("--cold-starts", type=int, default=3, help="fresh interpreters to time start-up in")
+    parser.add_argument("--save", action="store_true", help="save results to bench_results/<git sha>.json")
+    parser.add_argument("--compare", metavar="FILE", help="compare against a saved baseline")
+    args = parser.parse_args()
+
+    results = {
+        "revision": git_revision(),
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "args": vars(args),
+    }
+    if args.only in (None, "cold_start"):
+        print(f"Cold start (median of {args.cold_starts}):")
+        results["cold_start"] = run_cold_start(args.cold_starts)
+        if args.only is None:
+            print()
+    if args.only != "cold_start":
+        backend, gemini = load_backend(args.llm_latency)
+    if args.only in (None, "components"):
+        print("Component benchmarks:")
+        results["components"] = run_components(backend, gemini, args.iterations)
+    if args.only in (None, "e2e"):
+        print(f"\nEnd-to-end: {args.clients} clients x {args.requests} requests, "
+              f"fake Gemini latency {args.llm_latency}s:")
+        results["e2e"] = asyncio.run(run_e2e(backend, args.clients, args.requests))
+
+    if args.compare:
+        compare(results, args.compare)
+    if args.save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{results['revision']}.json")
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {path}")
+
+
+if __name__ == "__main__":
+    main()
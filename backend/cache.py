@@ -0,0 +1,151 @@
+import asyncio
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+def canonical_json(obj: Any) -> str:
+    """Serialize obj so that equal values always give the same string"""
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def make_key(*parts: Any) -> str:
+    """Stable content hash of the given parts, usable as a cache key"""
+    return hashlib.sha256(canonical_json(parts).encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    In-memory LRU cache with TTL for LLM results, optionally backed by an
+    SQLite file so entries survive restarts.
+
+    Only the memory tier is touched on the caller's thread: get() never reads
+    disk, get_async() reads it in a worker thread, and set() hands the disk write
+    to a background writer. Values are returned as stored, so callers must not mutate them.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600, disk_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = None
+        self._db_lock = threading.Lock()  # the connection is shared by the writer and disk reads
+        self._writes = queue.Queue()
+        if disk_path:
+            directory = os.path.dirname(disk_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM results WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the value cached in memory for key, or None on a miss. Never reads disk."""
+        value = self._get_memory(key)
+        if value is None:
+            with self._lock:
+                self.misses += 1
+        return value
+
+    async def get_async(self, key: str) -> Optional[Any]:
+        """Like get(), but a memory miss falls back to the disk tier, read in a worker thread"""
+        value = self._get_memory(key)
+        if value is not None or self._db is None:
+            if value is None:
+                with self._lock:
+                    self.misses += 1
+            return value
+        row = await asyncio.to_thread(self._get_disk, key)
+        with self._lock:
+            if row is not None and row[1] >= time.time():
+                value = json.loads(row[0])
+                self._store(key, value, row[1])
+                self.disk_hits += 1
+                return value
+            self.misses += 1
+            return None
+
+    def _get_memory(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at >= now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+        return None
+
+    def _get_disk(self, key: str):
+        with self._db_lock:
+            return self._db.execute("SELECT value, expires_at FROM results WHERE key = ?", (key,)).fetchone()
+
+    def set(self, key: str, value: Any):
+        """Store value under key in memory and, if enabled, queue it for the disk writer"""
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._store(key, value, expires_at)
+        if self._db is not None:
+            self._writes.put((key, value, expires_at))
+
+    def flush(self):
+        """Wait until every queued disk write has been committed"""
+        self._writes.join()
+
+    def _write_loop(self):
+        """Writer thread: commit queued entries to disk, everything queued so far in one transaction"""
+        while True:
+            batch = [self._writes.get()]
+            while True:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                rows = [(key, json.dumps(value), expires_at) for key, value, expires_at in batch]
+                with self._db_lock:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO results (key, value, expires_at) VALUES (?, ?, ?)", rows
+                    )
+                    self._db.commit()
+            except Exception as e:
+                print(f"Failed to write result cache entries: {e}")
+            finally:
+                for _ in batch:
+                    self._writes.task_done()
+
+    def _store(self, key: str, value: Any, expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,113 @@
+import os
+import re
+import shutil
+import threading
+from datetime import datetime
+
+import torch
+
+import metrics
+
+CHECKPOINT_WRITE = metrics.stage("checkpoint_write")
+
+# History checkpoints are `<name>-<timestamp>.pt`; rotation only ever deletes names of this form,
+# never other checkpoints in the directory (e.g. a candidate for /admin/load_model)
+HISTORY_TIMESTAMP = "%Y%m%d-%H%M%S-%f"
+HISTORY_TIMESTAMP_PATTERN = r"\d{8}-\d{6}-\d{6}"
+
+
+class CheckpointWriter:
+    """
+    Writes checkpoints on a background thread so callers never wait on disk I/O.
+
+    Each checkpoint is written to a temp file, fsynced and atomically renamed over
+    `path`, so a crash mid-write never leaves a corrupt checkpoint behind. The last
+    `keep` checkpoints are also kept next to it as `<name>-<timestamp>.pt`.
+    If several snapshots are submitted while a write is in progress only the latest
+    is written.
+    """
+
+    def __init__(self, path, keep=3):
+        self.path = path
+        self.keep = keep
+        self._pending = None
+        self._submitted = 0
+        self._written = 0
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, checkpoint):
+        """Queue a checkpoint dict (which must not be mutated afterwards) for writing"""
+        with self._cond:
+            self._pending = checkpoint
+            self._submitted += 1
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Wait until everything submitted so far is on disk. Returns False on timeout."""
+        with self._cond:
+            target = self._submitted
+            return self._cond.wait_for(lambda: self._written >= target, timeout=timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending is not None)
+                checkpoint, self._pending = self._pending, None
+                submitted = self._submitted
+            try:
+                with CHECKPOINT_WRITE.time():
+                    self._write(checkpoint)
+                print(f"Model saved to {self.path}")
+            except Exception as e:
+                print(f"Failed to save model: {e}")
+            with self._cond:
+                self._written = submitted
+                self._cond.notify_all()
+
+    def _write(self, checkpoint):
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp-{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            torch.save(checkpoint, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._fsync_dir(directory)
+
+        if self.keep > 0:
+            self._keep_history()
+
+    def _keep_history(self):
+        stem, ext = os.path.splitext(self.path)
+        history_path = f"{stem}-{datetime.now().strftime(HISTORY_TIMESTAMP)}{ext}"
+        try:
+            os.link(self.path, history_path)
+        except OSError:
+            shutil.copy2(self.path, history_path)
+
+        for old_path in self.history()[:-self.keep]:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+    def history(self):
+        """Paths of the history checkpoints written for self.path, oldest first"""
+        directory = os.path.dirname(self.path) or "."
+        stem, ext = os.path.splitext(os.path.basename(self.path))
+        pattern = re.compile(f"{re.escape(stem)}-{HISTORY_TIMESTAMP_PATTERN}{re.escape(ext)}")
+        return sorted(os.path.join(directory, name) for name in os.listdir(directory) if pattern.fullmatch(name))
+
+    @staticmethod
+    def _fsync_dir(directory):
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return  # e.g. Windows, where directories can't be opened
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
@@ -0,0 +1,255 @@
+"""
+Nearest-neighbour index of past Gemini configs.
+
+Users with similar needs get nearly identical styles back from Gemini, so every
+config element Gemini generates is kept under a vector of the profile it was made
+for. A later profile within max_distance of a stored one is served that element
+straight from memory, without an LLM call; only genuinely new profiles reach Gemini.
+
+Profile vectors are the RL state's user features (features.user_features). The
+style-relevant fields (profile_delta.STYLE_RELEVANT_FIELDS) are not part of the
+distance: they are compared exactly, through a signature stored with every entry, so
+a change to any one need or preference always misses the index, however large the
+rest of the profile is.
+Lookups are a brute-force NumPy search per tag, bounded by max_per_tag entries.
+"""
+
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+import metrics
+from features import USER_FEATURES, user_features
+from profile_delta import style_fields
+
+# Bump FEATURE_VERSION whenever the vector layout or the signature changes
+FEATURE_VERSION = 2
+VECTOR_DIM = USER_FEATURES
+
+INDEX_LOOKUP = metrics.stage("config_index_lookup")
+NEAREST_DISTANCE = metrics.Histogram(
+    "websight_config_index_distance", "Distance from a looked-up profile to its nearest indexed profile",
+    buckets=(0.0, 0.05, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5),
+)
+
+
+def profile_vector(user_info: Dict[str, Any]) -> np.ndarray:
+    """The float32 vector profiles are compared by"""
+    vector = np.zeros(VECTOR_DIM, dtype=np.float32)
+    try:
+        vector[:] = user_features(user_info or {})
+    except (TypeError, ValueError, AttributeError):
+        pass  # malformed numeric fields; the signature still tells profiles apart
+    return vector
+
+
+def profile_signature(user_info: Dict[str, Any]) -> int:
+    """Signed 64-bit hash of the normalized style-relevant fields; only equal signatures can match"""
+    text = json.dumps(style_fields(user_info), sort_keys=True, separators=(",", ":"), default=str)
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+class _TagIndex:
+    """Vectors, signatures and elements for one tag; full indexes overwrite their oldest entry"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.vectors = np.zeros((min(capacity, 64), VECTOR_DIM), dtype=np.float32)
+        self.norms = np.zeros(len(self.vectors), dtype=np.float32)
+        self.signatures = np.zeros(len(self.vectors), dtype=np.int64)
+        self.elements = []
+        self.next = 0  # slot the next new entry goes to once full
+
+    def nearest(self, vector: np.ndarray, signature: int) -> Tuple[float, int]:
+        """(distance, slot) of the closest stored vector with the same signature; distance is inf if none"""
+        count = len(self.elements)
+        distances = self.norms[:count] - 2 * (self.vectors[:count] @ vector) + vector @ vector
+        distances[self.signatures[:count] != signature] = np.inf
+        slot = int(np.argmin(distances))
+        return float(np.sqrt(max(distances[slot], 0.0))), slot
+
+    def add(self, vector: np.ndarray, signature: int, element: Dict[str, Any], same_profile_distance: float) -> int:
+        """Store element; a profile already present (within same_profile_distance) gets its element replaced"""
+        if self.elements:
+            distance, slot = self.nearest(vector, signature)
+            if distance <= same_profile_distance:
+                self.elements[slot] = element
+                return slot
+        count = len(self.elements)
+        if count < self.capacity:
+            if count == len(self.vectors):
+                size = min(self.capacity, 2 * count)
+                self.vectors = np.resize(self.vectors, (size, VECTOR_DIM))
+                self.norms = np.resize(self.norms, size)
+                self.signatures = np.resize(self.signatures, size)
+            slot = count
+            self.elements.append(element)
+        else:
+            slot = self.next
+            self.next = (self.next + 1) % self.capacity
+            self.elements[slot] = element
+        self.vectors[slot] = vector
+        self.norms[slot] = vector @ vector
+        self.signatures[slot] = signature
+        return slot
+
+
+class ConfigIndex:
+    """
+    Past config elements by tag and profile, served to profiles within max_distance that
+    have exactly the same style-relevant fields.
+
+    Optionally backed by an SQLite file (disk_path) so the index survives restarts;
+    entries written under another version (prompt or vector layout) are ignored.
+    add() only updates memory on the caller's thread; a background writer persists it.
+    Elements are returned as stored, so callers must not mutate them.
+    """
+
+    # Profiles this close are the same profile: adding replaces the stored element
+    SAME_PROFILE_DISTANCE = 1e-3
+
+    def __init__(self, max_distance: float = 0.2, max_per_tag: int = 2048, disk_path: Optional[str] = None,
+                 version: Any = 0, enabled: bool = True):
+        self.max_distance = max_distance
+        self.max_per_tag = max_per_tag
+        self.disk_path = disk_path
+        self.enabled = enabled
+        self.version = f"{FEATURE_VERSION}.{VECTOR_DIM}:{version}"
+        self._tags: Dict[str, _TagIndex] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self._db = None
+        self._writes = queue.Queue()
+        if disk_path and enabled:
+            directory = os.path.dirname(disk_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(config_index)")]
+            if columns and "signature" not in columns:
+                self._db.execute("DROP TABLE config_index")  # written before signatures; all stale anyway
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS config_index (tag TEXT NOT NULL, signature INTEGER NOT NULL, "
+                "vector BLOB NOT NULL, element TEXT NOT NULL, version TEXT NOT NULL, "
+                "PRIMARY KEY (tag, signature, vector))"
+            )
+            self._db.execute("DELETE FROM config_index WHERE version != ?", (self.version,))
+            # INSERT OR REPLACE gives rewritten entries a new rowid, so the newest max_per_tag per tag are kept
+            self._db.execute(
+                "DELETE FROM config_index WHERE rowid IN (SELECT rowid FROM (SELECT rowid, ROW_NUMBER() OVER "
+                "(PARTITION BY tag ORDER BY rowid DESC) AS n FROM config_index) WHERE n > ?)", (max_per_tag,)
+            )
+            self._db.commit()
+            rows = self._db.execute(
+                "SELECT tag, signature, vector, element FROM config_index ORDER BY rowid"
+            ).fetchall()
+            for tag, signature, vector, element in rows:
+                self._add(tag, np.frombuffer(vector, dtype=np.float32), signature, json.loads(element))
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+
+    def lookup(self, tag: str, user_info: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """The element stored for the nearest profile within max_distance, or None"""
+        if not self.enabled:
+            return None
+        with INDEX_LOOKUP.time():
+            vector, signature = profile_vector(user_info), profile_signature(user_info)
+            with self._lock:
+                element = self._lookup(tag, vector, signature)
+        return element
+
+    def lookup_config(self, user_info: Dict[str, Any], current_config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """A config for every tag of current_config from close profiles, or None unless all tags have one"""
+        if not self.enabled or not current_config:
+            return None
+        with INDEX_LOOKUP.time():
+            vector, signature = profile_vector(user_info), profile_signature(user_info)
+            config = {}
+            with self._lock:
+                for tag in current_config:
+                    element = self._lookup(tag, vector, signature)
+                    if element is None:
+                        return None
+                    config[tag] = element
+        return config
+
+    def _lookup(self, tag: str, vector: np.ndarray, signature: int) -> Optional[Dict[str, Any]]:
+        index = self._tags.get(tag)
+        if index is None:
+            self.misses += 1
+            return None
+        distance, slot = index.nearest(vector, signature)
+        if distance == np.inf:
+            self.misses += 1  # no entry with these needs and preferences
+            return None
+        NEAREST_DISTANCE.observe(distance)
+        if distance > self.max_distance:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return index.elements[slot]
+
+    def add(self, user_info: Dict[str, Any], config: Dict[str, Any]):
+        """Index the config elements ({tag: element}) Gemini generated for user_info"""
+        if not self.enabled or not config:
+            return
+        vector, signature = profile_vector(user_info), profile_signature(user_info)
+        with self._lock:
+            for tag, element in config.items():
+                self._add(tag, vector, signature, element)
+        if self._db is not None:
+            self._writes.put((vector, signature, config))
+
+    def flush(self):
+        """Wait until every queued disk write has been committed"""
+        self._writes.join()
+
+    def _write_loop(self):
+        """Writer thread: commit queued configs to disk, everything queued so far in one transaction"""
+        while True:
+            batch = [self._writes.get()]
+            while True:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO config_index (tag, signature, vector, element, version) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(tag, signature, vector.tobytes(), json.dumps(element), self.version)
+                     for vector, signature, config in batch for tag, element in config.items()],
+                )
+                self._db.commit()
+            except Exception as e:
+                print(f"Failed to write config index entries: {e}")
+            finally:
+                for _ in batch:
+                    self._writes.task_done()
+
+    def _add(self, tag: str, vector: np.ndarray, signature: int, element: Dict[str, Any]):
+        index = self._tags.get(tag)
+        if index is None:
+            index = self._tags[tag] = _TagIndex(self.max_per_tag)
+        index.add(vector, signature, element, self.SAME_PROFILE_DISTANCE)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "tags": len(self._tags),
+                "entries": sum(len(index.elements) for index in self._tags.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "max_distance": self.max_distance,
+            }
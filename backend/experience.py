@@ -0,0 +1,332 @@
+import glob
+import hashlib
+import os
+import threading
+from datetime import datetime
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process file locking
+    fcntl = None
+
+# Record kinds
+DECISION = 1
+REWARD = 2
+
+
+def record_dtype(state_dim):
+    """Fixed-width record layout shared by decision and reward records"""
+    return np.dtype([
+        ("kind", "u1"),
+        ("decision_id", "S32"),  # hex decision id, empty if the reward names none
+        ("session", "u8"),  # session_key() of the session id, 0 if none
+        ("time", "f8"),
+        ("state", "f4", (state_dim,)),
+        ("action", "i4"),
+        ("log_prob", "f4"),
+        ("reward", "f4"),
+    ])
+
+
+def session_key(session_id):
+    """Stable 64-bit key for a session id (0 means no session)"""
+    if session_id is None:
+        return 0
+    key = int.from_bytes(hashlib.blake2b(session_id.encode("utf-8"), digest_size=8).digest(), "little")
+    return key or 1
+
+
+class RecordLog:
+    """Builds fixed-width decision / reward records for a given state size"""
+
+    def __init__(self, state_dim):
+        self.state_dim = state_dim
+        self.dtype = record_dtype(state_dim)
+
+    def decisions(self, decision_ids, session_ids, states, actions, log_probs, now):
+        """Build decision records for a batch of served decisions"""
+        records = np.zeros(len(decision_ids), dtype=self.dtype)
+        records["kind"] = DECISION
+        records["decision_id"] = decision_ids
+        records["session"] = [session_key(s) for s in session_ids]
+        records["time"] = now
+        records["state"] = states
+        records["action"] = actions
+        records["log_prob"] = log_probs
+        return records
+
+    def reward(self, reward, decision_id, session_id, now):
+        """Build a reward record crediting decision_id (or the latest decision of session_id)"""
+        record = np.zeros(1, dtype=self.dtype)
+        record["kind"] = REWARD
+        record["decision_id"] = decision_id or ""
+        record["session"] = session_key(session_id)
+        record["time"] = now
+        record["reward"] = reward
+        return record
+
+
+class ExperienceLog(RecordLog):
+    """
+    Append-only file of fixed-width decision / reward records, used to ship
+    experience from inference workers to the trainer process.
+
+    Several processes may append at once: each append is a single write under an
+    exclusive lock. One reader (the trainer) tails the file with read_new(), saves
+    how far it got with commit() once the records are applied, and truncates the
+    file with compact() once everything has been consumed. The saved offset lives
+    in `<path>.offset`, so a restarted trainer resumes where it stopped instead of
+    applying every record again.
+
+    Appends are dropped once the file reaches max_file_bytes, which only happens
+    when no trainer is consuming it.
+    """
+
+    def __init__(self, path, state_dim, max_bytes=64 * 1024 * 1024, max_file_bytes=512 * 1024 * 1024):
+        super().__init__(state_dim)
+        self.path = path
+        self.offset_path = path + ".offset"
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        self._read_offset = self._load_offset()
+        self._committed_offset = self._read_offset
+        self.dropped = 0  # records not appended because the file was full
+        self._lock = threading.Lock()
+
+    def _load_offset(self):
+        """The offset the last reader committed, or 0 if there is none or it no longer fits the file"""
+        try:
+            with open(self.offset_path) as f:
+                offset = int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+        if offset < 0 or offset % self.dtype.itemsize or offset > os.fstat(self._fd).st_size:
+            return 0  # the file was truncated since, or written with another record layout
+        return offset
+
+    def _save_offset(self, offset):
+        tmp_path = f"{self.offset_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(offset))
+        os.replace(tmp_path, self.offset_path)
+        self._committed_offset = offset
+
+    def append(self, records):
+        data = records.tobytes()
+        with self._lock:
+            self._flock(True)
+            try:
+                if os.fstat(self._fd).st_size + len(data) > self.max_file_bytes:
+                    if not self.dropped:
+                        print(f"Experience log {self.path} is full, dropping records until the trainer consumes it")
+                    self.dropped += len(records)
+                    return
+                os.write(self._fd, data)
+            finally:
+                self._flock(False)
+
+    def read_new(self):
+        """Return the complete records appended since the last call"""
+        with self._lock:
+            size = os.fstat(self._fd).st_size
+            count = (size - self._read_offset) // self.dtype.itemsize
+            if count <= 0:
+                return np.zeros(0, dtype=self.dtype)
+            data = os.pread(self._fd, count * self.dtype.itemsize, self._read_offset)
+            self._read_offset += len(data)
+            return np.frombuffer(data, dtype=self.dtype)
+
+    def commit(self):
+        """Save how far read_new() has got; call once the records it returned have been applied"""
+        with self._lock:
+            if self._read_offset != self._committed_offset:
+                self._save_offset(self._read_offset)
+
+    def compact(self):
+        """Truncate the file once it is large and fully consumed. Returns True if truncated."""
+        with self._lock:
+            if self._read_offset < self.max_bytes:
+                return False
+            self._flock(True)
+            try:
+                if os.fstat(self._fd).st_size != self._read_offset:
+                    return False  # a writer appended since the last read
+                # Offset first: a crash in between replays consumed records rather than skipping new ones
+                self._save_offset(0)
+                os.ftruncate(self._fd, 0)
+                self._read_offset = 0
+                return True
+            finally:
+                self._flock(False)
+
+    def _flock(self, lock):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX if lock else fcntl.LOCK_UN)
+
+
+SEGMENT_MAGIC = b"RLFBLOG1"
+SEGMENT_HEADER = 16  # magic, then state_dim as little-endian u8
+
+
+class FeedbackLog(RecordLog):
+    """
+    Persistent, append-only log of every decision and reward, for offline training
+    (see train_offline.py).
+
+    Records go to fixed-width segment files `feedback-<timestamp>-<pid>.log` in
+    `directory`; each process writes its own segments, so no cross-process locking
+    is needed. A segment is rotated once it reaches max_segment_bytes, and the oldest
+    segments are deleted once the directory holds more than max_total_bytes.
+    Segments can be memory-mapped as record arrays with read_segment().
+    """
+
+    def __init__(self, directory, state_dim, max_segment_bytes=64 * 1024 * 1024,
+                 max_total_bytes=4 * 1024 * 1024 * 1024):
+        super().__init__(state_dim)
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.max_total_bytes = max_total_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._fd = None
+        self._segment_bytes = 0
+        self._lock = threading.Lock()
+
+    def append(self, records):
+        data = records.tobytes()
+        with self._lock:
+            if self._fd is None or self._segment_bytes + len(data) > self.max_segment_bytes:
+                self._rotate()
+            os.write(self._fd, data)
+            self._segment_bytes += len(data)
+
+    def _rotate(self):
+        if self._fd is not None:
+            os.close(self._fd)
+        name = f"feedback-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{os.getpid()}.log"
+        self._fd = os.open(os.path.join(self.directory, name), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        os.write(self._fd, SEGMENT_MAGIC + self.state_dim.to_bytes(8, "little"))
+        self._segment_bytes = SEGMENT_HEADER
+        self._prune()
+
+    def _prune(self):
+        segments = list_segments(self.directory)
+        sizes = [os.path.getsize(path) for path in segments]
+        total = sum(sizes)
+        for path, size in zip(segments[:-1], sizes):
+            if total <= self.max_total_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+def list_segments(directory):
+    """Feedback log segments in directory, oldest first"""
+    return sorted(glob.glob(os.path.join(glob.escape(directory), "feedback-*.log")))
+
+
+def read_segment(path, state_dim):
+    """Memory-map the complete records of a feedback log segment (read-only)"""
+    with open(path, "rb") as f:
+        header = f.read(SEGMENT_HEADER)
+    if len(header) < SEGMENT_HEADER or header[:8] != SEGMENT_MAGIC:
+        raise ValueError(f"{path} is not a feedback log segment")
+    segment_state_dim = int.from_bytes(header[8:], "little")
+    if segment_state_dim != state_dim:
+        raise ValueError(f"{path} has state_dim {segment_state_dim}, expected {state_dim}")
+    dtype = record_dtype(state_dim)
+    count = (os.path.getsize(path) - SEGMENT_HEADER) // dtype.itemsize  # ignore a torn last record
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=SEGMENT_HEADER, shape=(count,))
+
+
+def rewarded_decisions(directory, state_dim):
+    """
+    Join the rewards in a feedback log to the decisions they credit, the way the
+    online agent does: by decision id, else the session's latest earlier decision,
+    else (legacy clients) the latest earlier decision overall. Each decision is
+    credited by its first reward only.
+
+    Only the scalar columns of all records are held in memory; states are gathered
+    segment by segment for the matched decisions.
+    Returns (states, actions, rewards, log_probs) arrays in decision order.
+    """
+    segments = [read_segment(path, state_dim) for path in list_segments(directory)]
+    empty = (np.zeros((0, state_dim), np.float32), np.zeros(0, np.int64), np.zeros(0, np.float32),
+             np.zeros(0, np.float32))
+    if not segments or not sum(len(segment) for segment in segments):
+        return empty
+
+    def column(name):
+        return np.concatenate([np.asarray(segment[name]) for segment in segments])
+
+    kind, decision_ids, sessions, times = column("kind"), column("decision_id"), column("session"), column("time")
+    segment_index = np.concatenate([np.full(len(segment), i) for i, segment in enumerate(segments)])
+    row_index = np.concatenate([np.arange(len(segment)) for segment in segments])
+
+    decisions = np.flatnonzero(kind == DECISION)
+    rewards = np.flatnonzero(kind == REWARD)
+    rewards = rewards[np.argsort(times[rewards], kind="stable")]
+    if not len(decisions) or not len(rewards):
+        return empty
+    credited = np.full(len(rewards), -1)
+
+    # 1. By decision id
+    by_id = decisions[np.argsort(decision_ids[decisions])]
+    has_id = decision_ids[rewards] != b""
+    position = np.searchsorted(decision_ids[by_id], decision_ids[rewards]).clip(max=len(by_id) - 1)
+    found = has_id & (decision_ids[by_id[position]] == decision_ids[rewards])
+    credited[found] = by_id[position[found]]
+
+    # 2. Latest earlier decision of the same session: search on a (session, time rank) composite key
+    by_session = ~has_id & (sessions[rewards] != 0)
+    if by_session.any():
+        time_rank = np.empty(len(times), dtype=np.int64)
+        time_rank[np.argsort(times, kind="stable")] = np.arange(len(times))
+        _, session_rank = np.unique(sessions, return_inverse=True)
+        keys = session_rank.astype(np.int64) * len(times) + time_rank
+        ordered = decisions[np.argsort(keys[decisions])]
+        position = np.searchsorted(keys[ordered], keys[rewards[by_session]]) - 1
+        valid = position >= 0
+        candidates = ordered[position.clip(min=0)]
+        valid &= sessions[candidates] == sessions[rewards[by_session]]
+        credited[np.flatnonzero(by_session)[valid]] = candidates[valid]
+
+    # 3. Legacy: latest earlier decision overall
+    legacy = ~has_id & (sessions[rewards] == 0)
+    if legacy.any():
+        ordered = decisions[np.argsort(times[decisions], kind="stable")]
+        position = np.searchsorted(times[ordered], times[rewards[legacy]], side="right") - 1
+        valid = position >= 0
+        credited[np.flatnonzero(legacy)[valid]] = ordered[position[valid]]
+
+    matched = credited >= 0
+    credited, reward_rows = credited[matched], rewards[matched]
+    credited, first = np.unique(credited, return_index=True)
+    reward_rows = reward_rows[first]
+
+    states = np.empty((len(credited), state_dim), dtype=np.float32)
+    actions = np.empty(len(credited), dtype=np.int64)
+    log_probs = np.empty(len(credited), dtype=np.float32)
+    for i, segment in enumerate(segments):
+        mask = segment_index[credited] == i
+        if mask.any():
+            rows = segment[row_index[credited[mask]]]
+            states[mask] = rows["state"]
+            actions[mask] = rows["action"]
+            log_probs[mask] = rows["log_prob"]
+    return states, actions, column("reward")[reward_rows], log_probs
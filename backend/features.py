@@ -0,0 +1,128 @@
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+# Known HTML tags get fixed, evenly spaced codes in [0, KNOWN_TAG_RANGE); anything else is
+# hashed (crc32, stable across processes and restarts) into [KNOWN_TAG_RANGE, 1).
+# Append new tags to the end: reordering changes the codes the saved policy was trained on.
+TAG_VOCABULARY = (
+    "div", "p", "span", "a", "img", "button", "input", "label", "form", "select",
+    "textarea", "ul", "ol", "li", "table", "tr", "td", "th", "h1", "h2",
+    "h3", "h4", "h5", "h6", "header", "footer", "nav", "main", "section", "article",
+    "aside", "strong", "em", "b", "i", "code", "pre", "blockquote", "figure", "figcaption",
+    "video", "audio", "canvas", "svg", "iframe", "dl", "dt", "dd", "small", "body",
+)
+KNOWN_TAG_RANGE = 0.9
+TAG_CODES = {tag: i / len(TAG_VOCABULARY) * KNOWN_TAG_RANGE for i, tag in enumerate(TAG_VOCABULARY)}
+
+USER_FEATURES = 6  # state dims 1-6
+MAX_CACHED_TAGS = 1024
+VISION_CONDITIONS = ("myopia", "astigmatism", "presbyopia")
+
+
+def encode_tag(tag: str) -> float:
+    """Stable scalar code for an HTML tag"""
+    tag = tag.lower()
+    code = TAG_CODES.get(tag)
+    if code is None:
+        code = KNOWN_TAG_RANGE + (zlib.crc32(tag.encode()) % 10000) / 10000 * (1 - KNOWN_TAG_RANGE)
+    return code
+
+
+def user_features(user_info: dict) -> np.ndarray:
+    """Age, vision conditions and reading preferences, as state dims 1-6"""
+    features = np.zeros(USER_FEATURES, dtype=np.float32)
+    if not user_info:
+        return features
+    features[0] = user_info.get("age", 25) / 100.0
+    vision_conditions = user_info.get("vision_conditions", [])
+    for i, condition in enumerate(VISION_CONDITIONS):
+        if condition in vision_conditions:
+            features[1 + i] = 1.0
+    reading_prefs = user_info.get("reading_preferences", {})
+    features[4] = reading_prefs.get("prefers_large_text", 0.5)
+    features[5] = reading_prefs.get("prefers_high_contrast", 0.5)
+    return features
+
+
+def _profile_key(user_info: dict):
+    """Hashable key over just the profile fields that user_features reads"""
+    if not user_info:
+        return None
+    reading_prefs = user_info.get("reading_preferences", {})
+    return (
+        user_info.get("age", 25),
+        tuple(user_info.get("vision_conditions", ())),
+        reading_prefs.get("prefers_large_text", 0.5),
+        reading_prefs.get("prefers_high_contrast", 0.5),
+    )
+
+
+class StateEncoder:
+    """
+    Builds RL state vectors: [tag code, user features (6), dynamic features (gaze)].
+
+    Tag codes and user feature vectors are cached (the latter per profile, LRU), so
+    per request only the dynamic features are new and the vector is assembled by
+    array slicing rather than element by element.
+    """
+
+    def __init__(self, state_dim: int, max_profiles: int = 4096):
+        self.state_dim = state_dim
+        self.dynamic_dim = state_dim - 1 - USER_FEATURES
+        self.max_profiles = max_profiles
+        self._tag_codes = dict(TAG_CODES)
+        self._profiles = OrderedDict()
+
+    def tag_code(self, tag: str) -> float:
+        code = self._tag_codes.get(tag)
+        if code is None:
+            code = encode_tag(tag)
+            if len(self._tag_codes) < MAX_CACHED_TAGS:
+                self._tag_codes[tag] = code
+        return code
+
+    def user_vector(self, user_info: dict) -> np.ndarray:
+        key = _profile_key(user_info)
+        try:
+            vector = self._profiles.get(key)
+        except TypeError:  # unhashable values where numbers are expected
+            return user_features(user_info)
+        if vector is None:
+            vector = user_features(user_info)
+            vector.setflags(write=False)
+            self._profiles[key] = vector
+            if len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+        else:
+            self._profiles.move_to_end(key)
+        return vector
+
+    def encode(self, tag: str, user_info: dict, dynamic=None) -> np.ndarray:
+        state = np.zeros(self.state_dim, dtype=np.float32)
+        state[0] = self.tag_code(tag)
+        state[1:1 + USER_FEATURES] = self.user_vector(user_info)
+        if dynamic is not None:
+            state[1 + USER_FEATURES:] = dynamic[:self.dynamic_dim]
+        return state
+
+    def encode_batch(self, tags, user_infos, dynamic=None) -> np.ndarray:
+        """[N, state_dim] states; dynamic is an optional [N, dynamic_dim] array or list of vectors"""
+        states = np.zeros((len(tags), self.state_dim), dtype=np.float32)
+        if not len(tags):
+            return states
+        states[:, 0] = np.fromiter(map(self.tag_code, tags), dtype=np.float32, count=len(tags))
+        # Batch items usually share one profile: look each distinct profile object up once
+        slots, profiles = {}, []
+        index = np.empty(len(tags), dtype=np.intp)
+        for i, user_info in enumerate(user_infos):
+            slot = slots.get(id(user_info))
+            if slot is None:
+                slot = slots[id(user_info)] = len(profiles)
+                profiles.append(self.user_vector(user_info))
+            index[i] = slot
+        states[:, 1:1 + USER_FEATURES] = np.stack(profiles)[index]
+        if dynamic is not None:
+            states[:, 1 + USER_FEATURES:] = np.asarray(dynamic, dtype=np.float32)[:, :self.dynamic_dim]
+        return states
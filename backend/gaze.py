@@ -0,0 +1,127 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+# Features exposed to the RL agent (state dims 7-9), each scaled to [0, 1]:
+#   fixation ratio   - share of recent time spent in fixations
+#   dwell            - mean fixation duration, relative to MAX_DWELL seconds
+#   saccade rate     - saccades per second, relative to MAX_SACCADE_RATE
+NUM_FEATURES = 3
+MAX_DWELL = 1.0
+MAX_SACCADE_RATE = 10.0
+DEFAULT_FEATURES = np.zeros(NUM_FEATURES, dtype=np.float32)
+
+
+def gaze_features(t: np.ndarray, x: np.ndarray, y: np.ndarray, velocity_threshold: float) -> np.ndarray:
+    """
+    Fixation / dwell / saccade features for a chronological window of gaze samples,
+    classified by velocity threshold (I-VT). t is in seconds, x/y in viewport units.
+    """
+    dt = np.diff(t)
+    valid = dt > 0
+    if valid.sum() < 2:
+        return DEFAULT_FEATURES
+    dt = dt[valid]
+    velocity = np.hypot(np.diff(x)[valid], np.diff(y)[valid]) / dt
+    fixating = velocity < velocity_threshold
+
+    total_time = dt.sum()
+    fixation_ratio = dt[fixating].sum() / total_time
+
+    # Fixation runs: boundaries where the mask flips, durations from cumulative time
+    edges = np.diff(np.concatenate(([0], fixating.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    elapsed = np.concatenate(([0.0], np.cumsum(dt)))
+    dwell = (elapsed[ends] - elapsed[starts]).mean() if len(starts) else 0.0
+
+    # Saccade onsets: fixation -> movement transitions
+    saccades = np.count_nonzero(fixating[:-1] & ~fixating[1:])
+    saccade_rate = saccades / total_time
+
+    return np.array([
+        fixation_ratio,
+        min(dwell / MAX_DWELL, 1.0),
+        min(saccade_rate / MAX_SACCADE_RATE, 1.0),
+    ], dtype=np.float32)
+
+
+class _Session:
+    __slots__ = ("samples", "position", "size", "features", "updated_at")
+
+    def __init__(self, capacity):
+        self.samples = np.zeros((capacity, 3), dtype=np.float64)  # t, x, y
+        self.position = 0
+        self.size = 0
+        self.features = DEFAULT_FEATURES
+        self.updated_at = 0.0
+
+
+class GazeFeatureStore:
+    """
+    Per-session ring buffers of recent (t, x, y) gaze samples.
+
+    Features are recomputed with NumPy once per ingested batch, so reading them
+    (e.g. to build an RL state) is a dictionary lookup. Sessions idle for longer
+    than session_ttl, or beyond max_sessions, are evicted least-recently-updated first.
+    """
+
+    def __init__(self, capacity=256, max_sessions=10000, session_ttl=600, velocity_threshold=1.0):
+        self.capacity = capacity
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.velocity_threshold = velocity_threshold  # viewport units per second
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def ingest(self, session_id: str, t: np.ndarray, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Append a batch of samples (t in seconds) and return the session's updated features"""
+        batch = np.column_stack((t, x, y)).astype(np.float64, copy=False)[-self.capacity:]
+        batch = batch[np.isfinite(batch).all(axis=1)]
+        now = time.time()
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            self._evict(now)
+            if session is None:
+                session = _Session(self.capacity)
+            self._sessions[session_id] = session
+
+            # Write the batch into the ring, wrapping around at most once
+            n = len(batch)
+            first = min(n, self.capacity - session.position)
+            session.samples[session.position:session.position + first] = batch[:first]
+            session.samples[:n - first] = batch[first:]
+            session.position = (session.position + n) % self.capacity
+            session.size = min(session.size + n, self.capacity)
+
+            if session.size == self.capacity:
+                window = np.roll(session.samples, -session.position, axis=0)
+            else:
+                window = session.samples[:session.size]
+            window = window[np.argsort(window[:, 0], kind="stable")]
+            session.features = gaze_features(window[:, 0], window[:, 1], window[:, 2], self.velocity_threshold)
+            session.updated_at = now
+            return session.features
+
+    def features(self, session_id: Optional[str]) -> np.ndarray:
+        """Latest features for a session, or DEFAULT_FEATURES if there is no recent gaze data"""
+        if session_id is None:
+            return DEFAULT_FEATURES
+        session = self._sessions.get(session_id)
+        if session is None or session.updated_at + self.session_ttl < time.time():
+            return DEFAULT_FEATURES
+        return session.features
+
+    def _evict(self, now):
+        """Drop expired sessions, and the oldest ones while there is no room for one more"""
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if len(self._sessions) < self.max_sessions and oldest.updated_at + self.session_ttl >= now:
+                break
+            self._sessions.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"sessions": len(self._sessions)}
@@ -1,100 +1,260 @@
+import asyncio
 import json
-from time import time
-import google.generativeai as genai
 import os
-from typing import Dict, Any
+import threading
+from typing import Dict, Any, AsyncIterator, Callable, List, Optional
 from dotenv import load_dotenv
+from cache import ResultCache, make_key
+from config_index import ConfigIndex
+from tracing import TraceSink
+from singleflight import SingleFlight
+from resilience import CircuitBreaker, call_with_retries
+from scheduler import BULK, INTERACTIVE, PROFILE, FairScheduler, Superseded, Work
+from profile_delta import STYLE_RELEVANT_FIELDS
+import prompts
+import schema
+import metrics
 load_dotenv()
 
-# Configure Gemini AI
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-model = genai.GenerativeModel('gemini-2.5-flash')
+# The Gemini client is created by get_model() - at startup in the background, or on first use -
+# rather than at import: google.generativeai alone takes about a second to import
+model = None
+_model_lock = threading.Lock()
+
+def get_model():
+    global model
+    with _model_lock:
+        if model is None:
+            import google.generativeai as genai
+            genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+            model = genai.GenerativeModel('gemini-2.5-flash')
+    return model
+
+# Max number of Gemini calls in flight at once and per-call timeout (seconds)
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "30"))
+# Deadline for a single tag's config (generate_config): past it the user has moved on, so
+# the call is dropped from the queue rather than started
+GEMINI_INTERACTIVE_TIMEOUT = float(os.getenv("GEMINI_INTERACTIVE_TIMEOUT", "10"))
+
+# Transient failures (timeouts, 429, 5xx) are retried with jittered backoff within GEMINI_TIMEOUT.
+# After GEMINI_BREAKER_FAILURES consecutive failures calls fail fast to the fallback for
+# GEMINI_BREAKER_RESET seconds, then a single trial call checks whether Gemini is back
+GEMINI_RETRIES = int(os.getenv("GEMINI_RETRIES", "2"))
+GEMINI_RETRY_BASE_DELAY = float(os.getenv("GEMINI_RETRY_BASE_DELAY", "0.2"))
+GEMINI_RETRY_MAX_DELAY = float(os.getenv("GEMINI_RETRY_MAX_DELAY", "2"))
+GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "5"))
+GEMINI_BREAKER_RESET = float(os.getenv("GEMINI_BREAKER_RESET", "30"))
+
+# Last successfully generated config per profile, served when Gemini fails
+LAST_GOOD_CONFIG_SIZE = int(os.getenv("LAST_GOOD_CONFIG_SIZE", "4096"))
+LAST_GOOD_CONFIG_TTL = float(os.getenv("LAST_GOOD_CONFIG_TTL", "86400"))
+
+# Configs Gemini generated are indexed by profile vector (config_index.py) and served to later
+# profiles with the same needs and preferences within CONFIG_INDEX_MAX_DISTANCE without an LLM call. CONFIG_INDEX_PATH (e.g.
+# cache/config_index.sqlite) keeps the index across restarts; CONFIG_INDEX=0 turns it off
+CONFIG_INDEX = os.getenv("CONFIG_INDEX", "1") != "0"
+CONFIG_INDEX_MAX_DISTANCE = float(os.getenv("CONFIG_INDEX_MAX_DISTANCE", "0.2"))
+CONFIG_INDEX_SIZE = int(os.getenv("CONFIG_INDEX_SIZE", "2048"))  # profiles per tag
+CONFIG_INDEX_PATH = os.getenv("CONFIG_INDEX_PATH", "")
+
+# Bump whenever a prompt changes so cached results from the old prompt are not reused
+PROMPT_VERSION = 2
+
+# Result cache settings; set RESULT_CACHE_PATH (e.g. cache/gemini_results.sqlite) to keep
+# results across restarts, leave it empty to keep the cache in memory only
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1024"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "3600"))
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", "")
+
+# Prompt/response tracing: sampled, written in the background as rotating gzip JSONL
+# segments under GEMINI_TRACE_DIR. Set GEMINI_TRACE=0 to turn it off entirely (e.g. in production)
+GEMINI_TRACE = os.getenv("GEMINI_TRACE", "1") != "0"
+GEMINI_TRACE_SAMPLE_RATE = float(os.getenv("GEMINI_TRACE_SAMPLE_RATE", "1.0"))
+GEMINI_TRACE_DIR = os.getenv("GEMINI_TRACE_DIR", "./debug")
+GEMINI_TRACE_MAX_SEGMENT_MB = float(os.getenv("GEMINI_TRACE_MAX_SEGMENT_MB", "8"))
+GEMINI_TRACE_MAX_SEGMENTS = int(os.getenv("GEMINI_TRACE_MAX_SEGMENTS", "10"))
+
+# Stage timings exported at /metrics
+GEMINI_QUEUE_WAIT = metrics.stage("gemini_queue_wait")
+GEMINI_REQUEST = metrics.stage("gemini_request")
+JSON_PARSE = metrics.stage("json_parse")
 
 class GeminiService:
     """Service class for handling Gemini AI interactions"""
-    
-    @staticmethod
-    def _extract_json_from_response(response_text: str) -> str:
+
+    def __init__(self, max_concurrency: int = GEMINI_MAX_CONCURRENCY, timeout: float = GEMINI_TIMEOUT,
+                 cache: Optional[ResultCache] = None, trace: Optional[TraceSink] = None,
+                 retries: int = GEMINI_RETRIES, breaker: Optional[CircuitBreaker] = None,
+                 fallback_config: Optional[Callable[[str, Dict[str, Any]], Dict[str, Any]]] = None,
+                 config_index: Optional[ConfigIndex] = None):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.breaker = breaker if breaker is not None else CircuitBreaker(
+            failure_threshold=GEMINI_BREAKER_FAILURES, reset_timeout=GEMINI_BREAKER_RESET
+        )
+        # fallback_config(tag, user_info) builds a config element locally (e.g. from the RL agent)
+        # for generate_config when Gemini fails and there is no last-good config for the tag
+        self.fallback_config = fallback_config
+        self.last_good = ResultCache(max_entries=LAST_GOOD_CONFIG_SIZE, ttl=LAST_GOOD_CONFIG_TTL)
+        # Admits calls by priority class, then round-robin across users; see scheduler.py
+        self.scheduler = FairScheduler(max_concurrency)
+        self.cache = cache if cache is not None else ResultCache(
+            max_entries=RESULT_CACHE_SIZE,
+            ttl=RESULT_CACHE_TTL,
+            disk_path=RESULT_CACHE_PATH or None,
+        )
+        # Past configs by profile vector, answering close profiles without a Gemini call
+        self.config_index = config_index if config_index is not None else ConfigIndex(
+            max_distance=CONFIG_INDEX_MAX_DISTANCE,
+            max_per_tag=CONFIG_INDEX_SIZE,
+            disk_path=CONFIG_INDEX_PATH or None,
+            version=PROMPT_VERSION,
+            enabled=CONFIG_INDEX,
+        )
+        # Identical concurrent requests share one upstream call
+        self.single_flight = SingleFlight()
+        self.trace = trace if trace is not None else TraceSink(
+            directory=GEMINI_TRACE_DIR,
+            enabled=GEMINI_TRACE,
+            sample_rate=GEMINI_TRACE_SAMPLE_RATE,
+            max_segment_bytes=int(GEMINI_TRACE_MAX_SEGMENT_MB * 1024 * 1024),
+            max_segments=GEMINI_TRACE_MAX_SEGMENTS,
+        )
+
+    async def _generate(self, prompt: str, work: Work, timeout: Optional[float] = None) -> str:
         """
-        Extract JSON content from Gemini response, handling markdown code blocks
+        Run a Gemini generation without blocking the event loop.
+        At most max_concurrency calls run at once, admitted by the scheduler according to work;
+        time spent waiting for a slot and retries count towards the timeout. Cancelling the
+        caller cancels the upstream call. Raises CircuitOpenError right away while the
+        circuit breaker is open, Superseded if a newer request replaced this one, and
+        DeadlineExpired if no slot freed up in time (which the breaker does not count).
         """
-        response_text = response_text.strip()
-        if response_text.startswith("```json"):
-            # Find the start and end of the JSON content
-            start_index = response_text.find("```json") + 7
-            end_index = response_text.rfind("```")
-            if end_index > start_index:
-                response_text = response_text[start_index:end_index].strip()
-        elif response_text.startswith("```"):
-            # Handle generic code blocks
-            start_index = response_text.find("```") + 3
-            end_index = response_text.rfind("```")
-            if end_index > start_index:
-                response_text = response_text[start_index:end_index].strip()
-        return response_text
-    
+        timeout = self.timeout if timeout is None else timeout
+        deadline = asyncio.get_running_loop().time() + timeout
+        return await call_with_retries(
+            lambda: self._generate_unbounded(prompt, work, deadline), timeout, self.breaker,
+            retries=self.retries, base_delay=GEMINI_RETRY_BASE_DELAY, max_delay=GEMINI_RETRY_MAX_DELAY,
+        )
+
+    def _regeneration(self, user: Optional[str], supersede: bool, cache_keys: List[str]) -> Work:
+        """
+        Work for regenerating a user's config. With supersede, the user's queued regenerations
+        from earlier requests are dropped; only pass it when user is a real user id, never an
+        address that many users may share. A repeat of the regeneration under way (the same
+        cache_keys all in flight, e.g. from several tabs) shares it instead of dropping it
+        """
+        if user is None or not supersede:
+            return Work(user, BULK)
+        key = ("regenerate_config", user)
+        current = Work(user, BULK, key, self.scheduler.generation(key))
+        if current.generation and all(
+            self.single_flight.in_flight(GeminiService._flight_key(cache_key, current)) for cache_key in cache_keys
+        ):
+            return current
+        return Work(user, BULK, key, self.scheduler.supersede(key))
+
     @staticmethod
-    def generate_config(tag: str, user_info: Dict[str, Any]) -> Dict[str, Any]:
+    def _flight_key(cache_key: str, work: Work):
         """
-        Generate optimized configuration for a specific HTML tag using Gemini AI
+        Single-flight key: callers only share a call of the same generation, so a superseded
+        call can't take a newer caller down with it
         """
-        prompt = f"""
-        You are an accessibility expert assistant. Generate an optimal configuration for the HTML tag "{tag}" based on the following user information:
+        return cache_key if work.key is None else (cache_key, work.key, work.generation)
 
-        User Information: {json.dumps(user_info, indent=2)}
+    @staticmethod
+    def _profile_key(user_info: Dict[str, Any]) -> str:
+        """Key of the parts of a profile that affect styling, for the last-good config store"""
+        return make_key("last_good", {field: (user_info or {}).get(field) for field in STYLE_RELEVANT_FIELDS})
 
-        Please generate a JSON configuration that includes:
-        1. activationTime: A float value (0.1 to 2.0) representing how quickly the accessibility enhancement should activate
-        2. style: An object with styling properties that improve accessibility for this user
-        
-        Consider factors like:
-        - Visual impairments (if mentioned)
-        - Motor disabilities (if mentioned)
-        - Cognitive preferences (if mentioned)
-        - Previous feedback or preferences
-        
-        The style object can include properties like:
-        - fontSize (integer, in pixels)
-        - color (hex color string)
-        - backgroundColor (hex color string)
-        - scale (float, 1.0 = normal size)
-        - textColor (hex color string)
-        - borderRadius (string with CSS units)
-        - padding (string with CSS units)
-        - margin (string with CSS units)
-        
-        Return ONLY valid JSON in this exact format:
-        {{
-            "activationTime": number,
-            "style": {{
-                "fontSize": number,
-                "color": "#000000",
-                "backgroundColor": "#ffffff",
-                "scale": 1.2
-            }}
-        }}
-        For example for an average person, a config might look like:
-        {{
-            "activationTime": 0.8,
-            "style": {{
-                "fontSize": 18,
-                "color": "#000000",
-                "backgroundColor": "#ffffff",
-                "scale": 1.2
-            }}
-        }}
+    def _remember_good(self, user_info: Dict[str, Any], config: Dict[str, Any]):
+        key = GeminiService._profile_key(user_info)
+        self.last_good.set(key, {**(self.last_good.get(key) or {}), **config})
+        self.config_index.add(user_info, config)
+
+    def _last_good(self, user_info: Dict[str, Any]) -> Dict[str, Any]:
+        return self.last_good.get(GeminiService._profile_key(user_info)) or {}
+
+    async def _generate_unbounded(self, prompt: str, work: Work, deadline: float) -> str:
+        start = metrics.now()
+        await self.scheduler.acquire(work, deadline)
+        try:
+            GEMINI_QUEUE_WAIT.observe_since(start)
+            with GEMINI_REQUEST.time():
+                # Before the startup loader has finished, get_model() imports google.generativeai and
+                # blocks on _model_lock; neither may happen on the event loop
+                response = await (model or await asyncio.to_thread(get_model)).generate_content_async(prompt)
+        finally:
+            self.scheduler.release()
+        return response.text
+
+    @staticmethod
+    def _parse_json(response_text: str) -> Any:
+        """Parse the JSON value in a response, ignoring markdown code fences and prose around it"""
+        with JSON_PARSE.time():
+            return schema.loads(schema.extract_json(response_text))
+
+    @staticmethod
+    def _parse_element(response_text: str, operation: str) -> Dict[str, Any]:
+        """Parse a response and check it against the config element schema in one pass"""
+        with JSON_PARSE.time():
+            element = schema.check_element(schema.loads(schema.extract_json(response_text)), operation)
+        if element is None:
+            raise ValueError("Expected a JSON object")
+        return element
+
+    @staticmethod
+    def _parse_config(response_text: str, current_config: Dict[str, Any], operation: str):
+        """
+        Parse a response and check each of current_config's tags against the schema.
+        Returns (config, failed tags), failed tags keeping their current element.
         """
+        with JSON_PARSE.time():
+            return schema.check_config(schema.loads(schema.extract_json(response_text)), current_config, operation)
+
+    async def generate_config(self, tag: str, user_info: Dict[str, Any], user: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Generate optimized configuration for a specific HTML tag using Gemini AI, or take it
+        from the config index if a close enough profile was already served.
+        user (an id or client address) is who the call counts against for fair scheduling
+        """
+        # Key on what the prompt actually contains, so feedback beyond the budget doesn't miss the cache
+        user_info = prompts.budget_user_info(user_info)
+        cache_key = make_key("generate_config", PROMPT_VERSION, tag, user_info)
+        cached = await self.cache.get_async(cache_key)
+        if cached is None:
+            cached = self.config_index.lookup(tag, user_info)
+        if cached is not None:
+            return cached
+        return await self.single_flight.do(
+            cache_key, lambda: self._generate_config(tag, user_info, cache_key, Work(user, INTERACTIVE))
+        )
+
+    async def _generate_config(self, tag: str, user_info: Dict[str, Any], cache_key: str, work: Work) -> Dict[str, Any]:
+        prompt = prompts.GENERATE_CONFIG.render(tag=tag, user_info=prompts.compact_json(user_info))
         
         try:
-            response = model.generate_content(prompt)
+            response_text = await self._generate(prompt, work, GEMINI_INTERACTIVE_TIMEOUT)
+            self.trace.record("generate_config", prompt=prompt, response=response_text)
 
-            # Extract JSON from markdown code block if present
-            response_text = GeminiService._extract_json_from_response(response.text)
-
-            config_json = json.loads(response_text)
+            config_json = GeminiService._parse_element(response_text, "generate_config")
+            self.cache.set(cache_key, config_json)
+            self._remember_good(user_info, {tag: config_json})
             return config_json
             
         except (json.JSONDecodeError, Exception) as e:
+            metrics.fallback("generate_config", e)
+            self.trace.record("generate_config_error", tag=tag, error=repr(e))
+            last_good = self._last_good(user_info).get(tag)
+            if last_good is not None:
+                return last_good
+            if self.fallback_config is not None:
+                try:
+                    return self.fallback_config(tag, user_info)
+                except Exception as fallback_error:
+                    print(f"Fallback config failed: {fallback_error!r}")
             return {
                 "activationTime": 1.0,
                 "style": {
@@ -103,158 +263,152 @@ class GeminiService:
                 }
             }
     
-    @staticmethod
-    def update_user_profile(message: str, current_user_info: Dict[str, Any]) -> str:
+    async def update_user_profile(self, message: str, current_user_info: Dict[str, Any],
+                                  user: Optional[str] = None) -> Dict[str, Any]:
         """
-        Update user information using Gemini AI to extract insights and preferences
+        Update user information using Gemini AI to extract insights and preferences.
+        Messages are never superseded: each one may carry something the profile needs
         """
+        key = make_key("update_user_profile", PROMPT_VERSION, message, current_user_info)
+        return await self.single_flight.do(
+            key, lambda: self._update_user_profile(message, current_user_info, Work(user, PROFILE))
+        )
 
-        print("Updating user profile with message:", message)
-        print("Current user info:", json.dumps(current_user_info, indent=2))
-        
-        prompt = f"""
-        You are an accessibility expert assistant. Analyze the following user feedback/interaction and update the user's profile accordingly.
-        
-        New User Message/Feedback: {message}
-        Current User Information: {json.dumps(current_user_info, indent=2)}
-        
-        Based on this information, please:
-        1. Extract any accessibility preferences or needs
-        2. Identify any patterns in user behavior
-        3. Note any specific difficulties or positive feedback
-        4. Update the user profile with new insights
-        
-        Consider extracting information about:
-        - Visual impairments (color blindness, low vision, etc.)
-        - Motor disabilities (difficulty clicking, tremors, etc.)
-        - Cognitive preferences (reading speed, attention span, etc.)
-        - Device preferences
-        - Specific element types they struggle with
-        - Positive feedback about configurations that worked well
-        
-        Return ONLY valid JSON representing the updated user profile:
-        {{
-            "accessibility_needs": {{
-                "visual": ["any visual impairments or preferences"],
-                "motor": ["any motor difficulties or preferences"],
-                "cognitive": ["any cognitive preferences"]
-            }},
-            "preferences": {{
-                "font_size": "preferred size or null",
-                "contrast": "high/normal/low or null",
-                "colors": ["preferred colors"],
-                "interaction_speed": "slow/normal/fast"
-            }},
-            "feedback_history": [
-                {{
-                    "timestamp": "2025-08-02",
-                    "feedback": "summary of feedback",
-                    "sentiment": "positive/negative/neutral"
-                }}
-            ]
-        }}
-        """
+    async def _update_user_profile(self, message: str, current_user_info: Dict[str, Any], work: Work) -> Dict[str, Any]:
+        prompt = prompts.UPDATE_USER_PROFILE.render(
+            message=message, user_info=prompts.compact_json(prompts.budget_user_info(current_user_info))
+        )
         
         try:
-            print("Gemini prompt:", prompt)
             # Generate response from Gemini
-            response = model.generate_content(prompt)
-            response.resolve()
-            print("Gemini response:", response.text)
-
-            # Save response to debug file
-            debug_dir = "./debug"
-            os.makedirs(debug_dir, exist_ok=True)
-            with open(f"{debug_dir}/gemini_response_user_update_{time()}.txt", "w") as f:
-                f.write(f"Prompt:\n{prompt}\n\nResponse:\n{response.text}")
+            response_text = await self._generate(prompt, work)
+            self.trace.record("update_user_profile", prompt=prompt, response=response_text)
 
-            # Extract JSON from markdown code block if present
-            response_text = GeminiService._extract_json_from_response(response.text)
-
-            # Parse and return the updated user information
-            updated_info = json.loads(response_text)
+            # Extract JSON from markdown code block if present, parse and return the updated user information
+            updated_info = GeminiService._parse_json(response_text)
             return updated_info
             
         except (json.JSONDecodeError, Exception) as e:
-            print(f"Error updating user profile: {e}")
+            print(f"Error updating user profile: {e!r}")
+            metrics.fallback("update_user_profile", e)
+            self.trace.record("update_user_profile_error", message=message, error=repr(e))
             fallback_info = current_user_info.copy()
             fallback_info["last_feedback"] = str(message)
             fallback_info["timestamp"] = "2025-08-02"
             return fallback_info
 
-    @staticmethod
-    def update_whole_config(user_info: Dict[str, Any], current_config: Dict[str, Any]) -> Dict[str, Any]:
-        """
-        Update the entire configuration based on updated user information
+    async def update_whole_config(self, user_info: Dict[str, Any], current_config: Dict[str, Any],
+                                  user: Optional[str] = None, supersede: bool = False) -> Dict[str, Any]:
         """
-        
-        print("Updating whole config with user info:", json.dumps(user_info, indent=2))
-        print("Current config:", json.dumps(current_config, indent=2))
-        
-        prompt = f"""
-        You are an accessibility expert assistant. Based on the updated user information, please regenerate and optimize the entire configuration for all HTML elements.
-        
-        Updated User Information: {json.dumps(user_info, indent=2)}
-        Current Configuration: {json.dumps(current_config, indent=2)}
-        
-        Please analyze the user's accessibility needs and preferences and update the configuration for ALL elements accordingly. 
-        
-        Consider:
-        - Visual impairments and contrast needs
-        - Motor disabilities and interaction preferences  
-        - Cognitive preferences and timing needs
-        - Any feedback patterns or successful configurations
-        - Consistency across different element types
-        
-        Return ONLY valid JSON representing the complete updated configuration in the same structure as the current config.
-        Each element should have:
-        - activationTime: float (0.1 to 2.0)
-        - style: object with appropriate styling properties
-        
-        The configuration should maintain the same element tags as the current config but with optimized values.
-        
-        Example structure:
-        {{
-            "div": {{
-                "activationTime": 1.0,
-                "style": {{
-                    "scale": 1.2,
-                    "color": "#000000",
-                    "textColor": "#FFFFFF"
-                }}
-            }},
-            "p": {{
-                "activationTime": 0.5,
-                "style": {{
-                    "fontSize": 16,
-                    "color": "#000000",
-                    "textColor": "#FFFFFF"
-                }}
-            }}
-        }}
+        Update the entire configuration based on updated user information.
+        Served from the config index without a Gemini call if it has every tag for a close profile.
+        With supersede, the user's earlier config regenerations that are still queued are dropped
         """
+        user_info = prompts.budget_user_info(user_info)
+        cache_key = make_key("update_whole_config", PROMPT_VERSION, user_info, current_config)
+        work = self._regeneration(user, supersede, [cache_key])
+        cached = await self.cache.get_async(cache_key)
+        if cached is None:
+            cached = self.config_index.lookup_config(user_info, current_config)
+        if cached is not None:
+            return cached
+        return await self.single_flight.do(
+            GeminiService._flight_key(cache_key, work),
+            lambda: self._update_whole_config(user_info, current_config, cache_key, work),
+        )
+
+    @staticmethod
+    def _whole_config_prompt(user_info: Dict[str, Any], current_config: Dict[str, Any]) -> str:
+        return prompts.UPDATE_WHOLE_CONFIG.render(
+            user_info=prompts.compact_json(user_info), config=prompts.compact_json(current_config)
+        )
+
+    async def _update_whole_config(self, user_info: Dict[str, Any], current_config: Dict[str, Any],
+                                   cache_key: str, work: Work) -> Dict[str, Any]:
+        prompt = GeminiService._whole_config_prompt(user_info, current_config)
         
         try:
-            print("Gemini prompt for whole config:", prompt)
             # Generate response from Gemini
-            response = model.generate_content(prompt)
-            response.resolve()
-            print("Gemini response for whole config:", response.text)
-
-            # Save response to debug file
-            debug_dir = "./debug"
-            os.makedirs(debug_dir, exist_ok=True)
-            with open(f"{debug_dir}/gemini_response_whole_config_{time()}.txt", "w") as f:
-                f.write(f"Prompt:\n{prompt}\n\nResponse:\n{response.text}")
+            response_text = await self._generate(prompt, work)
+            self.trace.record("update_whole_config", prompt=prompt, response=response_text)
 
-            # Extract JSON from markdown code block if present
-            response_text = GeminiService._extract_json_from_response(response.text)
-
-            # Parse and return the updated configuration
-            updated_config = json.loads(response_text)
+            updated_config, failed = GeminiService._parse_config(response_text, current_config, "update_whole_config")
+            if current_config and len(failed) == len(current_config):
+                raise ValueError("No valid config elements in response")
+            if not failed:
+                self.cache.set(cache_key, updated_config)
+            self._remember_good(user_info, {tag: updated_config[tag] for tag in current_config if tag not in failed})
             return updated_config
-            
+
+        except Superseded:
+            raise
         except (json.JSONDecodeError, Exception) as e:
-            print(f"Error updating whole config: {e}")
-            # Return the current config as fallback
-            return current_config
+            print(f"Error updating whole config: {e!r}")
+            metrics.fallback("update_whole_config", e)
+            self.trace.record("update_whole_config_error", error=repr(e))
+            # Fall back to the last config generated for this profile, else keep the current one
+            last_good = self._last_good(user_info)
+            return {tag: last_good.get(tag, element) for tag, element in current_config.items()}
+
+    async def update_config_tags(self, user_info: Dict[str, Any], current_config: Dict[str, Any],
+                                 tags: List[str], chunk_size: int = 4,
+                                 user: Optional[str] = None, supersede: bool = False) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Regenerate only the given tags of the config, in parallel chunks of chunk_size tags.
+        Yields one result per chunk as soon as it parses:
+        {"config": {tag: element, ...}, "failed": [tags kept unchanged], "error": str or None}
+        Like update_whole_config, supersede drops the user's queued regenerations; this one
+        then raises Superseded if a newer one replaces it before it finished, in which case
+        results already yielded are out of date.
+        """
+        user_info = prompts.budget_user_info(user_info)
+        chunk_configs = [
+            {tag: current_config[tag] for tag in tags[i:i + chunk_size]} for i in range(0, len(tags), chunk_size)
+        ]
+        cache_keys = [make_key("update_whole_config", PROMPT_VERSION, user_info, chunk) for chunk in chunk_configs]
+        work = self._regeneration(user, supersede, cache_keys)
+        tasks = [
+            asyncio.ensure_future(self._update_config_chunk(user_info, chunk_config, cache_key, work))
+            for chunk_config, cache_key in zip(chunk_configs, cache_keys)
+        ]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                yield await next_result
+        finally:
+            for task in tasks:
+                task.cancel()
+        if not self.scheduler.is_current(work.key, work.generation):
+            raise Superseded()
+
+    async def _update_config_chunk(self, user_info: Dict[str, Any], chunk_config: Dict[str, Any],
+                                   cache_key: str, work: Work) -> Dict[str, Any]:
+        cached = await self.cache.get_async(cache_key)
+        if cached is None:
+            cached = self.config_index.lookup_config(user_info, chunk_config)
+        if cached is not None:
+            return {"config": cached, "failed": [], "error": None}
+        return await self.single_flight.do(
+            GeminiService._flight_key(cache_key, work),
+            lambda: self._generate_config_chunk(user_info, chunk_config, cache_key, work),
+        )
+
+    async def _generate_config_chunk(self, user_info: Dict[str, Any], chunk_config: Dict[str, Any],
+                                     cache_key: str, work: Work) -> Dict[str, Any]:
+        prompt = GeminiService._whole_config_prompt(user_info, chunk_config)
+        try:
+            response_text = await self._generate(prompt, work)
+            self.trace.record("update_config_chunk", prompt=prompt, response=response_text)
+            config, failed = GeminiService._parse_config(response_text, chunk_config, "update_config_chunk")
+        except Superseded:
+            raise
+        except Exception as e:
+            metrics.fallback("update_config_chunk", e)
+            self.trace.record("update_config_chunk_error", tags=list(chunk_config), error=repr(e))
+            last_good = self._last_good(user_info)
+            config = {tag: last_good.get(tag, element) for tag, element in chunk_config.items()}
+            return {"config": config, "failed": list(chunk_config), "error": repr(e)}
+
+        if not failed:
+            self.cache.set(cache_key, config)
+        self._remember_good(user_info, {tag: config[tag] for tag in chunk_config if tag not in failed})
+        return {"config": config, "failed": failed, "error": "Malformed elements in response" if failed else None}
@@ -1,11 +1,54 @@
+import asyncio
+import os
+import threading
+from contextlib import asynccontextmanager
+import numpy as np
 from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Awaitable, TypeVar
+import gemini
 from gemini import GeminiService
-from agent import RLAgent
+from batching import MicroBatcher
+from profile_delta import changed_fields, affected_tags
+from gaze import GazeFeatureStore
+from profile_store import PATCH_ATTEMPTS, ProfileStore, VersionConflict, diff_merge_patch, parse_etag
+from scheduler import PRIORITY_NAMES, Superseded
+import schema
+from schema import FastJSONResponse
+import metrics
+from metrics import MetricsMiddleware, TimedRoute
 
-app = FastAPI()
+T = TypeVar("T")
+
+# How often (seconds) to check whether the client of a pending LLM request went away
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# Gaze samples kept per session, and the velocity (viewport widths/heights per second) above which a sample counts as a saccade
+GAZE_WINDOW_SIZE = int(os.getenv("GAZE_WINDOW_SIZE", "256"))
+GAZE_VELOCITY_THRESHOLD = float(os.getenv("GAZE_VELOCITY_THRESHOLD", "1.0"))
+
+# Concurrent /rl_config requests arriving within this window are served by one batched forward pass
+RL_BATCH_MAX_SIZE = int(os.getenv("RL_BATCH_MAX_SIZE", "64"))
+RL_BATCH_MAX_WAIT = float(os.getenv("RL_BATCH_MAX_WAIT_MS", "2")) / 1000
+
+# Server-side user profiles and configs (SQLite, shared by all workers), so clients can send deltas
+PROFILE_STORE_PATH = os.getenv("PROFILE_STORE_PATH", "data/profiles.sqlite")
+
+STATE_BUILD = metrics.stage("state_build")
+GAZE_INGEST = metrics.stage("gaze_ingest")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load in the background: the server accepts requests (and answers /health) right away
+    startup = asyncio.ensure_future(load_services())
+    yield
+    startup.cancel()
+
+app = FastAPI(lifespan=lifespan)
+app.router.route_class = TimedRoute
+app.add_middleware(MetricsMiddleware)
 
 # Add CORS middleware
 app.add_middleware(
@@ -14,31 +57,140 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
-gemini_service = GeminiService()
-rl_agent = RLAgent()
-
-class ElementStyle(BaseModel):
-    fontSize: Optional[int] = None
-    color: Optional[str] = None
-    fontFamily: Optional[str] = None
-    fontWeight: Optional[str] = None
-    textDecoration: Optional[str] = None
-    backgroundSize: Optional[str] = None
-    border: Optional[str] = None
-    boxShadow: Optional[str] = None
-    padding: Optional[str] = None
-    margin: Optional[str] = None
-    textColor: Optional[str] = None
-    scale: Optional[float] = None
-    opacity: Optional[float] = None
-    backgroundColor: Optional[str] = None
-    borderRadius: Optional[str] = None
-
-class ConfigElement(BaseModel):
-    activationTime: float
-    style: ElementStyle
+def rl_fallback_config(tag: str, user_info: Dict[str, Any]) -> Dict[str, Any]:
+    """Config element chosen locally by the RL agent, for when Gemini is unavailable"""
+    if rl_agent is None:
+        raise RuntimeError("RL agent is still loading")
+    # Inference only: the client never sees a decisionId for this, so nothing could credit it
+    config = rl_agent.select_action(rl_agent.get_state_from_context(tag, user_info), record=False)
+    return {"activationTime": config["activationTime"], "style": config["style"]}
+
+gemini_service = GeminiService(fallback_config=rl_fallback_config)
+
+# Created by load_rl_agent(), in the background at startup or on first use: importing torch and
+# loading the checkpoint takes seconds, which would otherwise delay every worker's start
+rl_agent = None
+_rl_agent_lock = threading.Lock()
+startup_errors: Dict[str, str] = {}
+
+def load_rl_agent():
+    """Create the RL agent unless it exists. Blocks, so call it off the event loop"""
+    global rl_agent
+    with _rl_agent_lock:
+        if rl_agent is None:
+            from agent import RLAgent
+            # RL_ROLE=worker for `uvicorn --workers N` deployments, with `python trainer.py` running alongside
+            rl_agent = RLAgent(
+                role=os.getenv("RL_ROLE", "standalone"),
+                torch_threads=int(os.getenv("RL_TORCH_THREADS", "0")) or None,
+                watch_path=os.getenv("RL_MODEL_WATCH_PATH") or None,
+            )
+    return rl_agent
+
+async def get_rl_agent():
+    """The RL agent, waiting for it to load if startup hasn't got there yet"""
+    if rl_agent is not None:
+        return rl_agent
+    return await asyncio.to_thread(load_rl_agent)
+
+async def load_services():
+    """Load the RL agent and the Gemini client in threads; /ready reports when they are done"""
+    async def load(name, fn):
+        start = metrics.now()
+        try:
+            await asyncio.to_thread(fn)
+            print(f"Loaded {name} in {(metrics.now() - start) / 1e9:.2f}s")
+        except Exception as e:
+            print(f"Failed to load {name}: {e!r}")
+            startup_errors[name] = repr(e)
+
+    await asyncio.gather(load("rl_agent", load_rl_agent), load("gemini", gemini.get_model))
+
+rl_batcher = MicroBatcher(
+    lambda items: rl_agent.select_actions([state for state, _ in items], [session_id for _, session_id in items]),
+    max_batch_size=RL_BATCH_MAX_SIZE,
+    max_wait=RL_BATCH_MAX_WAIT,
+)
+
+gaze_store = GazeFeatureStore(capacity=GAZE_WINDOW_SIZE, velocity_threshold=GAZE_VELOCITY_THRESHOLD)
+profile_store = ProfileStore(PROFILE_STORE_PATH)
+
+# Counters and queue depths that already exist elsewhere, read when /metrics is scraped
+metrics.callback("websight_result_cache_lookups_total", "Gemini result cache lookups by outcome", lambda: {
+    (outcome,): gemini_service.cache.stats()[outcome] for outcome in ("hits", "disk_hits", "misses")
+}, ["outcome"], kind="counter")
+metrics.callback("websight_config_index_lookups_total", "Config index lookups by outcome (hits skip Gemini)", lambda: {
+    ("hits",): gemini_service.config_index.hits, ("misses",): gemini_service.config_index.misses,
+}, ["outcome"], kind="counter")
+metrics.callback("websight_single_flight_calls_total", "Gemini calls started vs. collapsed into one in flight", lambda: {
+    ("started",): gemini_service.single_flight.calls, ("collapsed",): gemini_service.single_flight.collapsed,
+}, ["outcome"], kind="counter")
+metrics.callback("websight_gemini_circuit_open", "1 while the Gemini circuit breaker is open or half-open", lambda: {
+    (): 0 if gemini_service.breaker.state == "closed" else 1
+})
+metrics.callback("websight_gemini_circuit_rejected_total", "Gemini calls failed fast by the circuit breaker", lambda: {
+    (): gemini_service.breaker.rejected
+}, kind="counter")
+def queue_depths():
+    depths = {
+        ("http_in_flight",): MetricsMiddleware.in_flight,
+        ("gemini_waiting",): gemini_service.scheduler.queued,
+        ("gemini_in_flight",): gemini_service.single_flight.stats()["in_flight"],
+        ("trace_sink",): gemini_service.trace.stats()["queued"],
+    }
+    if rl_agent is not None:
+        depths[("rl_pending_decisions",)] = len(rl_agent._pending)
+        depths[("rl_replay_buffer",)] = len(rl_agent.replay)
+        depths[("rl_shadow",)] = rl_agent.shadow.stats()["pending_batches"] if rl_agent.shadow is not None else 0
+    return depths
+
+metrics.callback("websight_queue_depth", "Items waiting or in flight per queue", queue_depths, ["queue"])
+metrics.callback("websight_gemini_scheduled_total", "Gemini calls given a slot by the scheduler, per priority class", lambda: {
+    (name,): started for name, started in zip(PRIORITY_NAMES, gemini_service.scheduler.started)
+}, ["priority"], kind="counter")
+metrics.callback("websight_gemini_dropped_total", "Queued Gemini calls dropped before they started", lambda: {
+    ("superseded",): gemini_service.scheduler.superseded, ("deadline",): gemini_service.scheduler.expired,
+}, ["reason"], kind="counter")
+metrics.callback("websight_rl_batches_total", "Batched RL forward passes for /rl_config", lambda: {
+    (): rl_batcher.batches
+}, kind="counter")
+metrics.callback("websight_rl_batch_items_total", "Requests served by batched RL forward passes", lambda: {
+    (): rl_batcher.items
+}, kind="counter")
+metrics.callback("websight_gaze_sessions", "Sessions with recent gaze data", lambda: {
+    (): gaze_store.stats()["sessions"]
+})
+
+class ClientDisconnected(Exception):
+    """Raised when the client goes away before its LLM request finished"""
+
+def client_id(raw_request: Request) -> Optional[str]:
+    """
+    Who a Gemini call counts against for fair scheduling when there is no user id: the client
+    address. Many users can share one (NAT, proxies), so it is never used to supersede work
+    """
+    return raw_request.client.host if raw_request.client else None
+
+async def run_until_disconnected(raw_request: Request, awaitable: Awaitable[T]) -> T:
+    """
+    Await an LLM-backed coroutine, cancelling it if the client disconnects
+    so the Gemini slot is released for requests that are still wanted
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await raw_request.is_disconnected():
+                task.cancel()
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
 
 class CreateConfigRequest(BaseModel):
     tag: str
@@ -51,17 +203,55 @@ class UpdateUserInfoRequest(BaseModel):
 class RLConfigRequest(BaseModel):
     tag: str
     userInfo: Optional[Dict[str, Any]] = None
+    session_id: Optional[str] = None
+
+class RLConfigBatchRequest(BaseModel):
+    items: List[RLConfigRequest]
 
 class FeedbackRequest(BaseModel):
     reward: float
+    decision_id: Optional[str] = None
     session_id: Optional[str] = None
 
+class GazeEventsRequest(BaseModel):
+    session_id: str
+    t: List[float]  # milliseconds
+    x: List[float]  # viewport fraction, 0..1
+    y: List[float]
+
+class LoadModelRequest(BaseModel):
+    path: str
+    shadow: bool = False
+
 class UpdateWholeConfigRequest(BaseModel):
     userInfo: Dict[str, Any]
     config: Dict[str, Any]
 
+class UpdateUserInfoAndConfigRequest(BaseModel):
+    message: str
+    userInfo: Dict[str, Any]
+    config: Dict[str, Any]
+
+class UserDocument(BaseModel):
+    userInfo: Dict[str, Any]
+    config: Dict[str, Any]
+
+class UserPatchRequest(BaseModel):
+    # JSON merge patches (RFC 7396) for the stored documents; omit to leave one unchanged
+    userInfo: Optional[Dict[str, Any]] = None
+    config: Optional[Dict[str, Any]] = None
+
+class UserMessageRequest(BaseModel):
+    message: str
+
+class StreamConfigRequest(BaseModel):
+    userInfo: Dict[str, Any]
+    config: Dict[str, Any]
+    previousUserInfo: Optional[Dict[str, Any]] = None
+    chunkSize: int = 4
+
 @app.post("/create_config")
-async def create_config(request: CreateConfigRequest):
+async def create_config(request: CreateConfigRequest, raw_request: Request):
     """
     Generate optimized configuration for a specific HTML tag using Gemini AI
     based on user knowledge and the HTML tag context
@@ -71,18 +261,17 @@ async def create_config(request: CreateConfigRequest):
         tag = request.tag
         userInfo = request.userInfo or {}
 
-        config_json = gemini_service.generate_config(tag, userInfo)
+        config_json = await run_until_disconnected(raw_request, gemini_service.generate_config(tag, userInfo, client_id(raw_request)))
         
-        return ConfigElement(
-            activationTime=config_json.get("activationTime", 1.0),
-            style=ElementStyle(**config_json.get("style", {}))
-        )
+        return FastJSONResponse(schema.element_response(config_json))
         
+    except ClientDisconnected:
+        return Response(status_code=499)
     except Exception as e:
         return {"error": str(e), "status": "failed"}
 
 @app.post("/update_user_info")
-async def update_user_info(request: UpdateUserInfoRequest):
+async def update_user_info(request: UpdateUserInfoRequest, raw_request: Request):
     """
     update user info
     """
@@ -91,15 +280,19 @@ async def update_user_info(request: UpdateUserInfoRequest):
         current_user_info = request.userInfo
         
         # Update user profile using Gemini service
-        updated_info = gemini_service.update_user_profile(message, current_user_info)
+        updated_info = await run_until_disconnected(
+            raw_request, gemini_service.update_user_profile(message, current_user_info, client_id(raw_request))
+        )
         
-        return updated_info
+        return FastJSONResponse(updated_info)
         
+    except ClientDisconnected:
+        return Response(status_code=499)
     except Exception as e:
         return {"error": str(e), "status": "failed"}
 
 @app.post("/update_whole_config")
-async def update_whole_config(request: UpdateWholeConfigRequest):
+async def update_whole_config(request: UpdateWholeConfigRequest, raw_request: Request):
     """
     Update the entire configuration based on updated user information
     """
@@ -108,10 +301,218 @@ async def update_whole_config(request: UpdateWholeConfigRequest):
         current_config = request.config
         
         # Update the entire configuration using Gemini service
-        updated_config = gemini_service.update_whole_config(user_info, current_config)
+        updated_config = await run_until_disconnected(
+            raw_request, gemini_service.update_whole_config(user_info, current_config, client_id(raw_request))
+        )
         
-        return updated_config
+        return FastJSONResponse(updated_config)
         
+    except ClientDisconnected:
+        return Response(status_code=499)
+    except Exception as e:
+        return {"error": str(e), "status": "failed"}
+
+@app.post("/update_user_info_and_config")
+async def update_user_info_and_config(request: UpdateUserInfoAndConfigRequest, raw_request: Request):
+    """
+    Update the user info from a message, then the whole configuration - but only if the
+    profile changed in a way that affects styling. Otherwise the current config is returned
+    as is and the second Gemini call is skipped.
+    """
+    try:
+        user = client_id(raw_request)
+
+        async def update():
+            updated_info = await gemini_service.update_user_profile(request.message, request.userInfo, user)
+            changed = changed_fields(request.userInfo, updated_info)
+            if not changed:
+                return {"userInfo": updated_info, "config": request.config, "configUpdated": False, "changedFields": []}
+            updated_config = await gemini_service.update_whole_config(updated_info, request.config, user)
+            return {"userInfo": updated_info, "config": updated_config, "configUpdated": True,
+                    "changedFields": sorted(changed)}
+
+        return FastJSONResponse(await run_until_disconnected(raw_request, update()))
+
+    except ClientDisconnected:
+        return Response(status_code=499)
+    except Exception as e:
+        return {"error": str(e), "status": "failed"}
+
+@app.post("/update_whole_config_stream")
+async def update_whole_config_stream(request: StreamConfigRequest, raw_request: Request):
+    """
+    Regenerate only the tags affected by the profile change, streaming NDJSON lines:
+    a "plan" line, an "update" line per chunk as it parses (plus "error" lines for tags
+    kept unchanged), then a "done" line with the merged config.
+    Without previousUserInfo every tag is regenerated.
+    """
+    user = client_id(raw_request)
+    user_info = request.userInfo
+    current_config = request.config
+    if request.previousUserInfo is None:
+        tags = list(current_config)
+    else:
+        tags = affected_tags(changed_fields(request.previousUserInfo, user_info), current_config)
+
+    async def events():
+        merged = dict(current_config)
+        yield schema.dumps({"type": "plan", "tags": tags, "unchanged": [t for t in current_config if t not in tags]}) + b"\n"
+        async for result in gemini_service.update_config_tags(user_info, current_config, tags,
+                                                              max(1, request.chunkSize), user):
+            updated = {tag: element for tag, element in result["config"].items() if tag not in result["failed"]}
+            merged.update(updated)
+            if updated:
+                yield schema.dumps({"type": "update", "config": updated}) + b"\n"
+            if result["failed"]:
+                yield schema.dumps({"type": "error", "tags": result["failed"], "error": result["error"]}) + b"\n"
+        yield schema.dumps({"type": "done", "config": merged}) + b"\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+def failed_response(error: str, status_code: int, headers: Optional[Dict[str, str]] = None, **extra) -> JSONResponse:
+    return JSONResponse({"error": error, **extra, "status": "failed"}, status_code=status_code, headers=headers)
+
+def conflict_response(e: VersionConflict) -> JSONResponse:
+    """404 if the profile doesn't exist (any more), else 412 with the current version"""
+    if e.current is None:
+        return failed_response("Unknown user", 404)
+    return failed_response(str(e), 412, headers={"ETag": e.current.etag}, version=e.current.version)
+
+@app.get("/users/{user_id}")
+async def get_user(user_id: str, raw_request: Request):
+    """
+    The stored profile and config, with the version as ETag (304 if it matches If-None-Match)
+    """
+    stored = await asyncio.to_thread(profile_store.get, user_id)
+    if stored is None:
+        return failed_response("Unknown user", 404)
+    if raw_request.headers.get("if-none-match") == stored.etag:
+        return Response(status_code=304, headers={"ETag": stored.etag})
+    return FastJSONResponse({"userInfo": stored.user_info, "config": stored.config, "version": stored.version},
+                        headers={"ETag": stored.etag})
+
+@app.put("/users/{user_id}")
+async def put_user(user_id: str, request: UserDocument, raw_request: Request):
+    """
+    Store a whole profile and config, e.g. to seed the server with what a client has locally.
+    Honors If-Match (only replace that version) and If-None-Match: * (only create).
+    """
+    try:
+        expected = parse_etag(raw_request.headers.get("if-match"))
+        if raw_request.headers.get("if-none-match", "").strip() == "*":
+            expected = 0
+        saved = await asyncio.to_thread(profile_store.put, user_id, request.userInfo, request.config, expected)
+        return FastJSONResponse({"status": "success", "version": saved.version}, headers={"ETag": saved.etag})
+
+    except VersionConflict as e:
+        return conflict_response(e)
+    except Exception as e:
+        return {"error": str(e), "status": "failed"}
+
+@app.patch("/users/{user_id}")
+async def patch_user(user_id: str, request: UserPatchRequest, raw_request: Request):
+    """
+    Apply JSON merge patches to the stored profile and/or config, optionally conditional on If-Match
+    """
+    try:
+        saved = await asyncio.to_thread(profile_store.patch, user_id, request.userInfo, request.config,
+                                        parse_etag(raw_request.headers.get("if-match")))
+        return FastJSONResponse({"status": "success", "version": saved.version}, headers={"ETag": saved.etag})
+
+    except VersionConflict as e:
+        return conflict_response(e)
+    except Exception as e:
+        return {"error": str(e), "status": "failed"}
+
+@app.delete("/users/{user_id}")
+async def delete_user(user_id: str):
+    if not await asyncio.to_thread(profile_store.delete, user_id):
+        return failed_response("Unknown user", 404)
+    return {"status": "success"}
+
+# Messages for one user are handled one at a time per worker, each starting from the profile
+# the previous one stored: user_id -> [lock, requests holding or waiting for it]
+_message_locks: Dict[str, list] = {}
+
+@asynccontextmanager
+async def message_lock(user_id: str):
+    entry = _message_locks.setdefault(user_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _message_locks[user_id]
+
+# Config tags still to regenerate per user: a message whose regeneration is superseded by a
+# newer one leaves its tags here, and the newer message regenerates them along with its own
+pending_tags: Dict[str, set] = {}
+
+@app.post("/users/{user_id}/message")
+async def user_message(user_id: str, request: UserMessageRequest, raw_request: Request):
+    """
+    Update the stored profile from a chat message and regenerate the config tags the change
+    affects. The profile update is stored before the config is regenerated, so a newer message
+    superseding the regeneration can't lose it. Only the delta comes back: a merge patch for
+    userInfo and the tags whose config changed. With If-Match, fails with 412 unless the client
+    is at the stored version; without it, the message is applied to whatever is stored.
+    """
+    try:
+        expected = parse_etag(raw_request.headers.get("if-match"))
+
+        async def update_profile():
+            async with message_lock(user_id):
+                for attempt in range(PATCH_ATTEMPTS):
+                    stored = await asyncio.to_thread(profile_store.get, user_id)
+                    if stored is None or (expected is not None and expected != stored.version):
+                        raise VersionConflict(stored)
+                    updated_info = await gemini_service.update_user_profile(request.message, stored.user_info, user_id)
+                    try:
+                        saved = await asyncio.to_thread(profile_store.put, user_id, updated_info, stored.config,
+                                                        stored.version)
+                        return stored, updated_info, saved
+                    except VersionConflict:
+                        # Another worker stored a message meanwhile: apply this one on top of it
+                        if expected is not None or attempt == PATCH_ATTEMPTS - 1:
+                            raise
+
+        async def update():
+            stored, updated_info, saved = await update_profile()
+            changed = changed_fields(stored.user_info, updated_info)
+            tags = pending_tags.setdefault(user_id, set())
+            if changed:
+                tags.update(affected_tags(changed, saved.config))
+            regenerate = [tag for tag in saved.config if tag in tags]
+            config = {}
+            try:
+                async for result in gemini_service.update_config_tags(updated_info, saved.config, regenerate,
+                                                                      user=user_id, supersede=True):
+                    config.update({tag: element for tag, element in result["config"].items()
+                                   if tag not in result["failed"]})
+            except Superseded:
+                return stored, changed, saved  # the newer message regenerates (and stores) these tags
+            tags.difference_update(regenerate)
+            if not tags and pending_tags.get(user_id) is tags:
+                del pending_tags[user_id]
+            if config:
+                saved = await asyncio.to_thread(profile_store.set_config_tags, user_id, config)
+            return stored, changed, saved
+
+        stored, changed, saved = await run_until_disconnected(raw_request, update())
+        return FastJSONResponse({
+            "status": "success",
+            "userInfo": diff_merge_patch(stored.user_info, saved.user_info),
+            "config": {tag: element for tag, element in saved.config.items() if stored.config.get(tag) != element},
+            "changedFields": sorted(changed),
+            "version": saved.version,
+        }, headers={"ETag": saved.etag})
+
+    except ClientDisconnected:
+        return Response(status_code=499)
+    except VersionConflict as e:
+        return conflict_response(e)
     except Exception as e:
         return {"error": str(e), "status": "failed"}
 
@@ -119,6 +520,49 @@ async def update_whole_config(request: UpdateWholeConfigRequest):
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness probe: 503 until the RL agent and the Gemini client have loaded.
+    /health only says the process is up and answers from the first moment
+    """
+    if rl_agent is not None and gemini.model is not None:
+        return {"status": "ready"}
+    return JSONResponse({"status": "starting", "errors": startup_errors}, status_code=503)
+
+@app.get("/cache_stats")
+async def cache_stats():
+    """
+    Hit/miss counters for the Gemini result cache, the config index and collapsed duplicate calls
+    """
+    return {**gemini_service.cache.stats(), "config_index": gemini_service.config_index.stats(),
+            "single_flight": gemini_service.single_flight.stats()}
+
+@app.get("/scheduler_stats")
+async def scheduler_stats():
+    """
+    Gemini calls running and queued per priority class, and queued calls dropped as superseded or past their deadline
+    """
+    return gemini_service.scheduler.stats()
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Stage timings, fallback / failure counters, cache hits and queue depths in the Prometheus text format
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/trace_stats")
+async def trace_stats():
+    """
+    Counters for the sampled Gemini prompt/response trace sink
+    """
+    return gemini_service.trace.stats()
+
+def rl_config_response(config: Dict[str, Any]) -> Dict[str, Any]:
+    """The agent's config as an RLConfigResponse, built directly (its output always matches the schema)"""
+    return schema.element_response(config, decisionId=config["decisionId"])
+
 @app.post("/rl_config")
 async def rl_config(request: RLConfigRequest):
     """
@@ -128,20 +572,80 @@ async def rl_config(request: RLConfigRequest):
         tag = request.tag
         userInfo = request.userInfo or {}
         
-        # Get state from context
-        state = rl_agent.get_state_from_context(tag, userInfo)
+        # Get state from context, including the session's latest gaze features
+        start = metrics.now()
+        agent = await get_rl_agent()
+        state = agent.get_state_from_context(tag, userInfo, gaze_store.features(request.session_id))
+        STATE_BUILD.observe_since(start)
         
-        # Get action from RL agent
-        config = rl_agent.select_action(state)
+        # Get action from RL agent, batched with other concurrent requests
+        config = await rl_batcher.submit((state, request.session_id))
         
-        return ConfigElement(
-            activationTime=config.get("activationTime", 1.0),
-            style=ElementStyle(**config.get("style", {}))
-        )
+        return FastJSONResponse(rl_config_response(config))
         
     except Exception as e:
         return {"error": str(e), "status": "failed"}
 
+@app.post("/rl_config_batch")
+async def rl_config_batch(request: RLConfigBatchRequest):
+    """
+    Generate configurations for many (tag, userInfo) pairs in one batched RL agent pass
+    """
+    try:
+        if not request.items:
+            return []
+        agent = await get_rl_agent()
+        with STATE_BUILD.time():
+            states = agent.get_states_from_context(
+                [item.tag for item in request.items],
+                [item.userInfo or {} for item in request.items],
+                [gaze_store.features(item.session_id) for item in request.items],
+            )
+        configs = agent.select_actions(states, [item.session_id for item in request.items])
+        return FastJSONResponse([rl_config_response(config) for config in configs])
+        
+    except Exception as e:
+        return {"error": str(e), "status": "failed"}
+
+@app.post("/gaze_events")
+async def gaze_events(raw_request: Request, session_id: Optional[str] = None):
+    """
+    Ingest a batch of gaze samples for a session, either as JSON columns
+    ({"session_id", "t", "x", "y"}) or as an application/octet-stream body of
+    little-endian float32 (t, x, y) triplets with ?session_id=.
+    t is in milliseconds, x and y are fractions of the viewport.
+    """
+    try:
+        if raw_request.headers.get("content-type", "").startswith("application/octet-stream"):
+            if not session_id:
+                return {"error": "session_id query parameter is required", "status": "failed"}
+            body = await raw_request.body()
+            if len(body) % 12:
+                return {"error": "Body must be a whole number of float32 (t, x, y) triplets", "status": "failed"}
+            samples = np.frombuffer(body, dtype="<f4").reshape(-1, 3)
+            t, x, y = samples[:, 0], samples[:, 1], samples[:, 2]
+        else:
+            request = GazeEventsRequest.model_validate_json(await raw_request.body())
+            if not len(request.t) == len(request.x) == len(request.y):
+                return {"error": "t, x and y must have the same length", "status": "failed"}
+            session_id = request.session_id
+            t, x, y = np.asarray(request.t), np.asarray(request.x), np.asarray(request.y)
+
+        with GAZE_INGEST.time():
+            features = gaze_store.ingest(session_id, t / 1000.0, x, y)
+        return {
+            "status": "success",
+            "samples": len(t),
+            "features": {
+                "fixationRatio": float(features[0]),
+                "dwell": float(features[1]),
+                "saccadeRate": float(features[2]),
+            },
+        }
+
+    except Exception as e:
+        return {"error": str(e), "status": "failed"}
+
 @app.post("/feedback")
 async def provide_feedback(request: FeedbackRequest):
     """
@@ -150,11 +654,14 @@ async def provide_feedback(request: FeedbackRequest):
     try:
         reward = request.reward
         
-        # Update the RL agent's policy with the reward
-        rl_agent.update_policy(reward)
+        # Update the RL agent's policy with the reward, crediting the decision it refers to
+        agent = await get_rl_agent()
+        agent.update_policy(reward, decision_id=request.decision_id, session_id=request.session_id)
         
-        return {"status": "success", "message": "Feedback received and model updated"}
+        return {"status": "success", "message": "Feedback received and queued for training"}
         
+    except KeyError as e:
+        return {"error": e.args[0], "status": "failed"}
     except Exception as e:
         return {"error": str(e), "status": "failed"}
 
@@ -164,12 +671,78 @@ async def save_model():
     Manually trigger model saving
     """
     try:
-        rl_agent.save_model()
+        agent = await get_rl_agent()
+        if agent.role == "worker":
+            return {"status": "success", "message": "Checkpoints are written by the trainer process"}
+
+        # Waits for the background writer, off the event loop
+        saved = await asyncio.to_thread(agent.save_model, wait=True)
+        if not saved:
+            return {"status": "success", "message": "Model unchanged since last save"}
         return {"status": "success", "message": "Model saved successfully"}
         
     except Exception as e:
         return {"error": str(e), "status": "failed"}
 
+def model_file(agent, path: str) -> str:
+    """Resolve a checkpoint path for the admin endpoints; only files in the model directory are allowed"""
+    model_dir = os.path.realpath(os.path.dirname(agent.model_path) or ".")
+    resolved = os.path.realpath(os.path.join(model_dir, path))
+    if os.path.commonpath([model_dir, resolved]) != model_dir:
+        raise ValueError(f"Checkpoints must be inside {model_dir}")
+    return resolved
+
+@app.post("/admin/load_model")
+async def admin_load_model(request: LoadModelRequest):
+    """
+    Load a checkpoint from the model directory in the background and either swap it in
+    for serving, or (shadow=true) score it against live traffic without serving it
+    """
+    try:
+        agent = await get_rl_agent()
+        path = model_file(agent, request.path)
+        if request.shadow:
+            stats = await asyncio.to_thread(agent.start_shadow, path)
+            return {"status": "success", "message": "Shadow evaluation started", "shadow": stats}
+        model = await asyncio.to_thread(agent.swap_model, path)
+        return {"status": "success", "message": "Model swapped", "model": model}
+
+    except Exception as e:
+        return {"error": str(e), "status": "failed"}
+
+@app.get("/admin/shadow_stats")
+async def admin_shadow_stats():
+    """
+    Agreement between the shadow candidate and the serving policy on live states
+    """
+    shadow = (await get_rl_agent()).shadow
+    if shadow is None:
+        return {"error": "No shadow evaluation running", "status": "failed"}
+    return shadow.stats()
+
+@app.post("/admin/promote_shadow")
+async def admin_promote_shadow():
+    """
+    Start serving the model that is in shadow evaluation
+    """
+    try:
+        agent = await get_rl_agent()
+        model = await asyncio.to_thread(agent.promote_shadow)
+        return {"status": "success", "message": "Shadow model promoted", "model": model}
+
+    except Exception as e:
+        return {"error": str(e), "status": "failed"}
+
+@app.post("/admin/stop_shadow")
+async def admin_stop_shadow():
+    """
+    Stop shadow evaluation, returning its final stats
+    """
+    stats = (await get_rl_agent()).stop_shadow()
+    if stats is None:
+        return {"error": "No shadow evaluation running", "status": "failed"}
+    return {"status": "success", "shadow": stats}
+
 if __name__ == "__main__":
     import uvicorn
     import signal
@@ -177,7 +750,8 @@ if __name__ == "__main__":
     
     def signal_handler(sig, frame):
         print("\nGracefully shutting down...")
-        rl_agent.save_model()
+        if rl_agent is not None:
+            rl_agent.save_model(wait=True)
         sys.exit(0)
     
     signal.signal(signal.SIGINT, signal_handler)
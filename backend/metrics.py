@@ -0,0 +1,318 @@
+"""
+Minimal Prometheus-style metrics: counters, histograms and callback gauges, rendered
+in the Prometheus text exposition format by render() (served at /metrics).
+
+Stage timings go to one histogram labelled by stage:
+
+    POLICY_FORWARD = stage("policy_forward")   # once, at import time
+    with POLICY_FORWARD.time():
+        ...
+
+or, on hot paths, without the context manager object:
+
+    start = now()
+    ...
+    POLICY_FORWARD.observe_since(start)
+
+The latter costs two perf_counter_ns() calls and a bisect, a few hundred
+nanoseconds on typical hardware. Updates are not locked, relying on the GIL instead; a thread
+switch in the middle of an update can very rarely lose one, which is acceptable
+for monitoring and keeps locks off the request path.
+"""
+
+import contextvars
+import functools
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, Tuple
+
+from fastapi.routing import APIRoute
+
+# Seconds; spans range from microseconds (state building) to tens of seconds (Gemini)
+DEFAULT_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+_registry = []
+now = time.perf_counter_ns
+
+
+def _format_labels(labelnames, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def labels(self, *values):
+        """The child metric for these label values (look it up once and keep it on hot paths)"""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def render(self, name, labelnames, values):
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(self.value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_start")
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = now()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe_since(self._start)
+        return False
+
+
+class _HistogramChild:
+    __slots__ = ("upper_bounds", "counts", "sum")
+
+    def __init__(self, buckets):
+        self.upper_bounds = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last bucket is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+
+    def observe_since(self, start_ns):
+        """Observe the seconds elapsed since start_ns, a now() timestamp"""
+        value = (now() - start_ns) / 1e9
+        self.counts[bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+
+    def time(self):
+        """Context manager that observes the duration of its block, in seconds"""
+        return _Timer(self)
+
+    def render(self, name, labelnames, values):
+        counts, total = list(self.counts), self.sum
+        lines, cumulative = [], 0
+        for bound, count in zip(self.upper_bounds + (float("inf"),), counts):
+            cumulative += count
+            labels = _format_labels(labelnames, values, f'le="{_format_value(bound)}"')
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = _format_labels(labelnames, values)
+        lines.append(f"{name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{name}_count{labels} {cumulative}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+
+class CallbackMetric(_Metric):
+    """
+    A gauge or counter read from existing state when /metrics is scraped, e.g. cache
+    hit counters or queue depths. fn returns {label values tuple: value}.
+    """
+
+    def __init__(self, name, documentation, fn: Callable[[], Dict[Tuple, float]], labelnames=(), kind="gauge"):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self._fn = fn
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            samples = self._fn()
+        except Exception as e:
+            print(f"Failed to collect metric {self.name}: {e!r}")
+            return lines
+        for values, value in sorted(samples.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}")
+        return lines
+
+
+def callback(name, documentation, fn, labelnames=(), kind="gauge") -> CallbackMetric:
+    """Register a metric whose samples fn() computes at scrape time"""
+    return CallbackMetric(name, documentation, fn, labelnames, kind)
+
+
+def render(metrics: Iterable[_Metric] = None) -> str:
+    lines = []
+    for metric in (_registry if metrics is None else metrics):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = Histogram(
+    "websight_stage_duration_seconds", "Time spent in each request / background stage", ["stage"]
+)
+FALLBACKS = Counter(
+    "websight_fallbacks_total", "Requests answered with a fallback after an error", ["operation", "reason"]
+)
+REQUEST_FAILURES = Counter(
+    "websight_request_failures_total", 'Requests answered with {"status": "failed"}', ["route"]
+)
+REQUEST_SECONDS = Histogram(
+    "websight_http_request_duration_seconds", "HTTP request latency, including streamed bodies",
+    ["method", "route", "status"]
+)
+
+
+def stage(name):
+    """The STAGE_SECONDS histogram for one stage"""
+    return STAGE_SECONDS.labels(name)
+
+
+def fallback(operation, error):
+    FALLBACKS.labels(operation, type(error).__name__).inc()
+
+
+REQUEST_VALIDATION = stage("request_validation")
+RESPONSE_SERIALIZATION = stage("response_serialization")
+_FAILED_SUFFIX = b'"status":"failed"}'
+
+# [endpoint start, endpoint end] of the request being handled, filled in by TimedRoute
+_endpoint_span = contextvars.ContextVar("endpoint_span", default=None)
+
+
+class TimedRoute(APIRoute):
+    """
+    FastAPI route that splits handling time into request parsing / pydantic validation
+    (before the endpoint runs) and response serialization (after it returns), and counts
+    responses that report {"status": "failed"} with a 200.
+    """
+
+    def __init__(self, path, endpoint, **kwargs):
+        @functools.wraps(endpoint)
+        async def timed_endpoint(*args, **kw):
+            span = _endpoint_span.get()
+            if span is not None:
+                span[0] = now()
+            try:
+                return await endpoint(*args, **kw)
+            finally:
+                if span is not None:
+                    span[1] = now()
+
+        super().__init__(path, timed_endpoint, **kwargs)
+        self._failures = REQUEST_FAILURES.labels(path)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            span = [0, 0]
+            token = _endpoint_span.set(span)
+            start = now()
+            try:
+                response = await handler(request)
+            finally:
+                _endpoint_span.reset(token)
+            if span[0]:
+                REQUEST_VALIDATION.observe((span[0] - start) / 1e9)
+                RESPONSE_SERIALIZATION.observe_since(span[1])
+            else:  # rejected by validation
+                REQUEST_VALIDATION.observe_since(start)
+            body = getattr(response, "body", None)
+            if body is not None and body.endswith(_FAILED_SUFFIX):
+                self._failures.inc()
+            return response
+
+        return timed_handler
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency per route and the number of requests in flight"""
+
+    in_flight = 0
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = now()
+        MetricsMiddleware.in_flight += 1
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            MetricsMiddleware.in_flight -= 1
+            route = scope.get("route")
+            REQUEST_SECONDS.labels(scope["method"], getattr(route, "path", "unmatched"), status[0]).observe_since(start)
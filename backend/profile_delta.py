@@ -0,0 +1,79 @@
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+# Profile sections that influence styling; everything else (e.g. feedback_history) does not
+STYLE_RELEVANT_FIELDS = ("accessibility_needs", "preferences")
+
+# Config properties each profile field can influence ("*" = any property)
+FIELD_PROPERTIES = {
+    "preferences.font_size": {"fontSize", "scale"},
+    "preferences.contrast": {"color", "textColor", "backgroundColor", "border", "boxShadow"},
+    "preferences.colors": {"color", "textColor", "backgroundColor"},
+    "preferences.interaction_speed": {"activationTime"},
+    "accessibility_needs.visual": {"*"},
+    "accessibility_needs.motor": {"activationTime", "scale", "padding", "margin"},
+    "accessibility_needs.cognitive": {"activationTime", "fontFamily", "fontWeight", "textDecoration"},
+}
+
+
+def _normalize(value: Any) -> Any:
+    """Treat empty values alike and ignore list order, so cosmetic rewrites don't count as changes"""
+    if value in (None, "", [], {}):
+        return None
+    if isinstance(value, str):
+        return value.strip().lower() or None
+    if isinstance(value, list):
+        return sorted((_normalize(v) for v in value), key=repr)
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items() if _normalize(v) is not None} or None
+    return value
+
+
+def style_fields(profile: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    The style-relevant sections of a profile, normalized: two profiles give equal
+    results exactly when changed_fields() finds no difference between them
+    """
+    profile = profile or {}
+    return {section: _normalize(profile.get(section)) for section in STYLE_RELEVANT_FIELDS}
+
+
+def changed_fields(old_profile: Optional[Dict[str, Any]], new_profile: Optional[Dict[str, Any]]) -> Set[str]:
+    """
+    Style-relevant fields ("section.field") that differ between two user profiles.
+    Returns an empty set if nothing that affects styling changed.
+    """
+    old_profile = old_profile or {}
+    new_profile = new_profile or {}
+    changed = set()
+    for section in STYLE_RELEVANT_FIELDS:
+        old_section = old_profile.get(section) or {}
+        new_section = new_profile.get(section) or {}
+        if not isinstance(old_section, dict) or not isinstance(new_section, dict):
+            if _normalize(old_section) != _normalize(new_section):
+                changed.add(section)
+            continue
+        for field in set(old_section) | set(new_section):
+            if _normalize(old_section.get(field)) != _normalize(new_section.get(field)):
+                changed.add(f"{section}.{field}")
+    return changed
+
+
+def affected_tags(changed: Iterable[str], config: Dict[str, Any]) -> List[str]:
+    """
+    Tags of config whose styling can be influenced by the changed profile fields.
+    Fields without a known mapping are assumed to affect every tag.
+    """
+    properties = set()
+    for field in changed:
+        properties |= FIELD_PROPERTIES.get(field, {"*"})
+    if not properties:
+        return []
+    if "*" in properties:
+        return list(config)
+
+    tags = []
+    for tag, element in config.items():
+        style = (element or {}).get("style") or {}
+        if not style or properties & (set(style) | {"activationTime"}):
+            tags.append(tag)
+    return tags
@@ -0,0 +1,190 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+# Unconditional patches racing with other writes are retried this many times in total
+PATCH_ATTEMPTS = 3
+
+
+class VersionConflict(Exception):
+    """Raised when a write's expected version is not the stored one (someone else wrote first)"""
+
+    def __init__(self, current: Optional["StoredProfile"]):
+        super().__init__("Profile was modified concurrently" if current is not None else "Profile does not exist")
+        self.current = current
+
+
+class StoredProfile(NamedTuple):
+    user_info: Dict[str, Any]
+    config: Dict[str, Any]
+    version: int
+
+    @property
+    def etag(self) -> str:
+        return etag(self.version)
+
+
+def etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def parse_etag(header: Optional[str]) -> Optional[int]:
+    """Version from an If-Match / If-None-Match header, None if absent or "*" """
+    if not header or header.strip() == "*":
+        return None
+    value = header.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        raise ValueError(f"Malformed ETag: {header}")
+
+
+def merge_patch(target: Any, patch: Any) -> Any:
+    """Apply an RFC 7396 JSON merge patch: objects merge recursively, null deletes a key, anything else replaces"""
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+def diff_merge_patch(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """The merge patch that turns old into new ({} if they are equal)"""
+    patch = {}
+    for key in old.keys() - new.keys():
+        patch[key] = None
+    for key, value in new.items():
+        previous = old.get(key)
+        if key in old and previous == value:
+            continue
+        if isinstance(previous, dict) and isinstance(value, dict) and value:
+            patch[key] = diff_merge_patch(previous, value)
+        else:
+            patch[key] = value
+    return patch
+
+
+class ProfileStore:
+    """
+    User profiles and configs keyed by user id, kept in SQLite so clients can send
+    deltas instead of whole documents.
+
+    Every write bumps the profile's version, which is exposed as its ETag. Writes can
+    pass the version they were based on (expected_version) and fail with
+    VersionConflict if another request - possibly in another worker process - wrote
+    in the meantime. The database runs in WAL mode so workers can share the file.
+    Calls can block for up to the busy timeout while another worker holds the write
+    lock, so async code runs them in a thread (asyncio.to_thread).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS profiles (user_id TEXT PRIMARY KEY, user_info TEXT NOT NULL, "
+            "config TEXT NOT NULL, version INTEGER NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def get(self, user_id: str) -> Optional[StoredProfile]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT user_info, config, version FROM profiles WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return StoredProfile(json.loads(row[0]), json.loads(row[1]), row[2])
+
+    def put(self, user_id: str, user_info: Dict[str, Any], config: Dict[str, Any],
+            expected_version: Optional[int] = None) -> StoredProfile:
+        """
+        Store user_info and config as the new version of the profile, creating it if needed.
+        With expected_version, only succeeds if that is the stored version (0: must not exist yet).
+        """
+        user_info_json = json.dumps(user_info, separators=(",", ":"))
+        config_json = json.dumps(config, separators=(",", ":"))
+        now = time.time()
+        with self._lock:
+            if expected_version is None:
+                row = self._db.execute(
+                    "INSERT INTO profiles (user_id, user_info, config, version, updated_at) VALUES (?, ?, ?, 1, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET user_info = excluded.user_info, config = excluded.config, "
+                    "version = version + 1, updated_at = excluded.updated_at RETURNING version",
+                    (user_id, user_info_json, config_json, now),
+                ).fetchone()
+            elif expected_version == 0:
+                row = self._db.execute(
+                    "INSERT INTO profiles (user_id, user_info, config, version, updated_at) VALUES (?, ?, ?, 1, ?) "
+                    "ON CONFLICT(user_id) DO NOTHING RETURNING version",
+                    (user_id, user_info_json, config_json, now),
+                ).fetchone()
+            else:
+                row = self._db.execute(
+                    "UPDATE profiles SET user_info = ?, config = ?, version = version + 1, updated_at = ? "
+                    "WHERE user_id = ? AND version = ? RETURNING version",
+                    (user_info_json, config_json, now, user_id, expected_version),
+                ).fetchone()
+            self._db.commit()
+        if row is None:
+            raise VersionConflict(self.get(user_id))
+        return StoredProfile(user_info, config, row[0])
+
+    def patch(self, user_id: str, user_info_patch: Any = None, config_patch: Any = None,
+              expected_version: Optional[int] = None) -> StoredProfile:
+        """
+        Apply JSON merge patches to the stored profile and/or config (a missing profile starts out empty).
+        Without expected_version, the patch is reapplied if a concurrent write gets in between.
+        """
+        def apply(base: StoredProfile):
+            user_info = merge_patch(base.user_info, user_info_patch) if user_info_patch is not None else base.user_info
+            config = merge_patch(base.config, config_patch) if config_patch is not None else base.config
+            if not isinstance(user_info, dict) or not isinstance(config, dict):
+                raise ValueError("userInfo and config must stay JSON objects")
+            return user_info, config
+
+        return self._update(user_id, apply, expected_version)
+
+    def set_config_tags(self, user_id: str, elements: Dict[str, Any]) -> StoredProfile:
+        """Replace the config elements of the given tags whole, reapplied if a concurrent write gets in between"""
+        return self._update(user_id, lambda base: (base.user_info, {**base.config, **elements}), None)
+
+    def _update(self, user_id: str, apply: Callable[[StoredProfile], Tuple[Dict[str, Any], Dict[str, Any]]],
+                expected_version: Optional[int]) -> StoredProfile:
+        for attempt in range(PATCH_ATTEMPTS):
+            current = self.get(user_id)
+            if current is None and expected_version:
+                raise VersionConflict(None)
+            base = current or StoredProfile({}, {}, 0)
+            user_info, config = apply(base)
+            try:
+                return self.put(user_id, user_info, config,
+                                base.version if expected_version is None else expected_version)
+            except VersionConflict:
+                if expected_version is not None or attempt == PATCH_ATTEMPTS - 1:
+                    raise
+
+    def delete(self, user_id: str) -> bool:
+        with self._lock:
+            deleted = self._db.execute("DELETE FROM profiles WHERE user_id = ?", (user_id,)).rowcount
+            self._db.commit()
+        return deleted > 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            (profiles,) = self._db.execute("SELECT COUNT(*) FROM profiles").fetchone()
+        return {"profiles": profiles, "path": self.path}
@@ -0,0 +1,228 @@
+"""
+Gemini prompt templates.
+
+Templates are parsed once at import time into literal parts and placeholders, so
+rendering a prompt is a single join. Payloads are serialized as compact JSON, and
+the user's feedback_history is cut to a token budget: the most recent entries are
+kept and older ones are summarized as counts, so prompts stop growing as a
+profile ages. Every rendered prompt's estimated size is exported at /metrics.
+"""
+
+import json
+import os
+import string
+import textwrap
+from collections import Counter
+from typing import Any, Dict, Tuple
+
+import metrics
+
+# Token budget for the feedback_history sent with the user profile, and the longest
+# single feedback text kept (characters); older entries beyond the budget are summarized
+PROMPT_HISTORY_TOKEN_BUDGET = int(os.getenv("PROMPT_HISTORY_TOKEN_BUDGET", "600"))
+PROMPT_FEEDBACK_MAX_CHARS = int(os.getenv("PROMPT_FEEDBACK_MAX_CHARS", "280"))
+
+# Rough characters per token for Gemini on English text and JSON; good enough for
+# budgeting and metrics without a tokenizer round trip
+CHARS_PER_TOKEN = 4
+
+PROMPT_TOKENS = metrics.Histogram(
+    "websight_prompt_tokens", "Estimated size of each Gemini prompt in tokens", ["operation"],
+    buckets=(100, 250, 500, 750, 1000, 1500, 2000, 3000, 5000, 10000, 20000),
+)
+FEEDBACK_DROPPED = metrics.Counter(
+    "websight_prompt_feedback_summarized_total", "feedback_history entries summarized to fit the token budget"
+)
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def compact_json(obj: Any) -> str:
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def _shorten(entry: Any) -> Any:
+    if isinstance(entry, dict) and isinstance(entry.get("feedback"), str) \
+            and len(entry["feedback"]) > PROMPT_FEEDBACK_MAX_CHARS:
+        return {**entry, "feedback": entry["feedback"][:PROMPT_FEEDBACK_MAX_CHARS - 3] + "..."}
+    return entry
+
+
+def budget_user_info(user_info: Dict[str, Any], token_budget: int = None) -> Dict[str, Any]:
+    """
+    The user profile as sent to Gemini: feedback_history keeps the newest entries that fit
+    in token_budget (PROMPT_HISTORY_TOKEN_BUDGET by default), each cut to
+    PROMPT_FEEDBACK_MAX_CHARS, and the older ones are replaced by an "earlier_feedback"
+    summary. Returns user_info itself if nothing had to be cut.
+    """
+    history = (user_info or {}).get("feedback_history")
+    if not isinstance(history, list) or not history:
+        return user_info
+    budget = (PROMPT_HISTORY_TOKEN_BUDGET if token_budget is None else token_budget) * CHARS_PER_TOKEN
+
+    kept, used = [], 0
+    for entry in reversed(history):
+        entry = _shorten(entry)
+        size = len(compact_json(entry)) + 1
+        if used + size > budget:
+            break
+        kept.append(entry)
+        used += size
+    if len(kept) == len(history) and all(a is b for a, b in zip(kept, reversed(history))):
+        return user_info
+
+    kept.reverse()
+    earlier = history[:len(history) - len(kept)]
+    compacted = {**user_info, "feedback_history": kept}
+    if earlier:
+        FEEDBACK_DROPPED.inc(len(earlier))
+        sentiments = Counter(
+            str(entry.get("sentiment", "unknown")) if isinstance(entry, dict) else "unknown" for entry in earlier
+        )
+        summary = {"entries": len(earlier), "sentiment": dict(sentiments)}
+        timestamps = [entry["timestamp"] for entry in earlier if isinstance(entry, dict) and "timestamp" in entry]
+        if timestamps:
+            summary["from"], summary["to"] = str(timestamps[0]), str(timestamps[-1])
+        previous = user_info.get("earlier_feedback")
+        if isinstance(previous, dict) and isinstance(previous.get("entries"), int):
+            # Summary from an earlier compaction that Gemini carried over into the profile
+            summary["entries"] += previous["entries"]
+            for sentiment, count in (previous.get("sentiment") or {}).items():
+                if isinstance(count, int):
+                    summary["sentiment"][sentiment] = summary["sentiment"].get(sentiment, 0) + count
+            summary["from"] = previous.get("from", summary.get("from"))
+        compacted["earlier_feedback"] = summary
+    return compacted
+
+
+class PromptTemplate:
+    """
+    A prompt with {name} placeholders ({{ and }} for literal braces), dedented and
+    parsed once. render(**values) substitutes already-serialized strings.
+    """
+
+    def __init__(self, operation: str, text: str):
+        self.operation = operation
+        parts, literal_run = [], ""
+        for literal, field, _, _ in string.Formatter().parse(textwrap.dedent(text).strip()):
+            literal_run += literal  # escaped braces split the literal text into several pieces
+            if field is not None:
+                parts += [literal_run, field]
+                literal_run = ""
+        parts.append(literal_run)
+        # Literals at even indices, placeholder names at odd ones
+        self._parts: Tuple[str, ...] = tuple(parts)
+        self.static_tokens = estimate_tokens("".join(parts[::2]))
+        self._tokens = PROMPT_TOKENS.labels(operation)
+
+    def render(self, **values: str) -> str:
+        parts = list(self._parts)
+        for i in range(1, len(parts), 2):
+            parts[i] = values[parts[i]]
+        prompt = "".join(parts)
+        self._tokens.observe(estimate_tokens(prompt))
+        return prompt
+
+
+GENERATE_CONFIG = PromptTemplate("generate_config", """
+    You are an accessibility expert assistant. Generate an optimal configuration for the HTML tag "{tag}" based on the following user information:
+
+    User Information: {user_info}
+
+    Please generate a JSON configuration that includes:
+    1. activationTime: A float value (0.1 to 2.0) representing how quickly the accessibility enhancement should activate
+    2. style: An object with styling properties that improve accessibility for this user
+
+    Consider factors like:
+    - Visual impairments (if mentioned)
+    - Motor disabilities (if mentioned)
+    - Cognitive preferences (if mentioned)
+    - Previous feedback or preferences
+
+    The style object can include properties like:
+    - fontSize (integer, in pixels)
+    - color (hex color string)
+    - backgroundColor (hex color string)
+    - scale (float, 1.0 = normal size)
+    - textColor (hex color string)
+    - borderRadius (string with CSS units)
+    - padding (string with CSS units)
+    - margin (string with CSS units)
+
+    Return ONLY valid JSON in this exact format:
+    {{"activationTime": number, "style": {{"fontSize": number, "color": "#000000", "backgroundColor": "#ffffff", "scale": 1.2}}}}
+    For example for an average person, a config might look like:
+    {{"activationTime": 0.8, "style": {{"fontSize": 18, "color": "#000000", "backgroundColor": "#ffffff", "scale": 1.2}}}}
+""")
+
+UPDATE_USER_PROFILE = PromptTemplate("update_user_profile", """
+    You are an accessibility expert assistant. Analyze the following user feedback/interaction and update the user's profile accordingly.
+
+    New User Message/Feedback: {message}
+    Current User Information: {user_info}
+
+    Based on this information, please:
+    1. Extract any accessibility preferences or needs
+    2. Identify any patterns in user behavior
+    3. Note any specific difficulties or positive feedback
+    4. Update the user profile with new insights
+
+    Consider extracting information about:
+    - Visual impairments (color blindness, low vision, etc.)
+    - Motor disabilities (difficulty clicking, tremors, etc.)
+    - Cognitive preferences (reading speed, attention span, etc.)
+    - Device preferences
+    - Specific element types they struggle with
+    - Positive feedback about configurations that worked well
+
+    If the current profile has an "earlier_feedback" summary of older feedback, copy it into the updated profile unchanged.
+
+    Return ONLY valid JSON representing the updated user profile:
+    {{
+      "accessibility_needs": {{
+        "visual": ["any visual impairments or preferences"],
+        "motor": ["any motor difficulties or preferences"],
+        "cognitive": ["any cognitive preferences"]
+      }},
+      "preferences": {{
+        "font_size": "preferred size or null",
+        "contrast": "high/normal/low or null",
+        "colors": ["preferred colors"],
+        "interaction_speed": "slow/normal/fast"
+      }},
+      "feedback_history": [
+        {{"timestamp": "2025-08-02", "feedback": "summary of feedback", "sentiment": "positive/negative/neutral"}}
+      ]
+    }}
+""")
+
+UPDATE_WHOLE_CONFIG = PromptTemplate("update_whole_config", """
+    You are an accessibility expert assistant. Based on the updated user information, please regenerate and optimize the entire configuration for all HTML elements.
+
+    Updated User Information: {user_info}
+    Current Configuration: {config}
+
+    Please analyze the user's accessibility needs and preferences and update the configuration for ALL elements accordingly.
+
+    Consider:
+    - Visual impairments and contrast needs
+    - Motor disabilities and interaction preferences
+    - Cognitive preferences and timing needs
+    - Any feedback patterns or successful configurations
+    - Consistency across different element types
+
+    Return ONLY valid JSON representing the complete updated configuration in the same structure as the current config.
+    Each element should have:
+    - activationTime: float (0.1 to 2.0)
+    - style: object with appropriate styling properties
+
+    The configuration should maintain the same element tags as the current config but with optimized values.
+
+    Example structure:
+    {{
+      "div": {{"activationTime": 1.0, "style": {{"scale": 1.2, "color": "#000000", "textColor": "#FFFFFF"}}}},
+      "p": {{"activationTime": 0.5, "style": {{"fontSize": 16, "color": "#000000", "textColor": "#FFFFFF"}}}}
+    }}
+""")
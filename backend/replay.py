@@ -0,0 +1,51 @@
+import threading
+import torch
+
+
+class ReplayBuffer:
+    """
+    Fixed-capacity ring buffer of (state, action, reward, log_prob) experiences.
+
+    Storage is preallocated as contiguous tensors, so adding an experience is an
+    O(1) row write and sampling a mini-batch is a single gather per field.
+    """
+
+    def __init__(self, capacity, state_dim):
+        self.capacity = capacity
+        self.state_dim = state_dim
+        self.states = torch.zeros((capacity, state_dim), dtype=torch.float32)
+        self.actions = torch.zeros(capacity, dtype=torch.long)
+        self.rewards = torch.zeros(capacity, dtype=torch.float32)
+        self.log_probs = torch.zeros(capacity, dtype=torch.float32)
+        self.position = 0  # next row to write
+        self.size = 0
+        self.total_added = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action, reward, log_prob):
+        """Append one experience, overwriting the oldest once the buffer is full"""
+        with self._lock:
+            i = self.position
+            self.states[i] = state
+            self.actions[i] = action
+            self.rewards[i] = reward
+            self.log_probs[i] = log_prob
+            self.position = (i + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+            self.total_added += 1
+
+    def sample(self, batch_size):
+        """Return (states, actions, rewards, log_probs) for a uniformly sampled mini-batch"""
+        with self._lock:
+            if self.size == 0:
+                raise ValueError("Cannot sample from an empty replay buffer")
+            indices = torch.randint(0, self.size, (min(batch_size, self.size),))
+            return (
+                self.states[indices],
+                self.actions[indices],
+                self.rewards[indices],
+                self.log_probs[indices],
+            )
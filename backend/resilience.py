@@ -0,0 +1,115 @@
+import asyncio
+import functools
+import random
+import time
+from typing import Any, Awaitable, Callable, Tuple, Type
+
+
+@functools.lru_cache(maxsize=None)
+def retryable_errors() -> Tuple[Type[BaseException], ...]:
+    """
+    Errors worth retrying: timeouts, rate limiting, 5xx and connection failures.
+    Anything else (bad request, auth, safety blocks) fails the same way on every attempt.
+    Looked up on first failure so importing this module doesn't import google.api_core.
+    """
+    from google.api_core import exceptions as google_exceptions
+    return asyncio.TimeoutError, ConnectionError, google_exceptions.TooManyRequests, google_exceptions.ServerError
+
+
+def _api_call_error() -> Type[BaseException]:
+    from google.api_core import exceptions as google_exceptions
+    return google_exceptions.GoogleAPICallError
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling upstream while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing upstream so callers can fall back immediately.
+
+    Opens after failure_threshold consecutive failures. While open, allow() is False
+    until reset_timeout seconds have passed; then a single trial call is let through
+    (half-open). Its success closes the breaker, its failure opens it again. If the
+    trial never reports back (e.g. it was cancelled), another one is let through
+    after a further reset_timeout.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.opened = 0  # times the breaker opened
+        self.rejected = 0  # calls refused while open
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self.opened_at = now
+            return True  # the trial call
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.state = self.CLOSED
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opened += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+async def call_with_retries(fn: Callable[[], Awaitable[Any]], timeout: float, breaker: CircuitBreaker,
+                            retries: int = 2, base_delay: float = 0.2, max_delay: float = 2.0) -> Any:
+    """
+    Call fn() until it succeeds, at most retries + 1 times, within an overall timeout.
+
+    Each attempt gets the time left until the deadline; between attempts we sleep
+    with full-jitter exponential backoff, and give up early if the backoff would not
+    leave time for another attempt. Retryable failures are reported to the breaker,
+    and no attempt is made while it is open (CircuitOpenError).
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    for attempt in range(retries + 1):
+        if not breaker.allow():
+            raise CircuitOpenError("Gemini circuit breaker is open")
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+        try:
+            result = await asyncio.wait_for(fn(), remaining)
+        except retryable_errors():
+            breaker.record_failure()
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            if attempt == retries or loop.time() + delay >= deadline:
+                raise
+            await asyncio.sleep(delay)
+            continue
+        except _api_call_error():
+            breaker.record_success()  # upstream is up, it just rejected this request
+            raise
+        breaker.record_success()
+        return result
@@ -0,0 +1,183 @@
+import asyncio
+from collections import OrderedDict, deque
+from typing import Any, Dict, Hashable, List, NamedTuple, Optional
+
+# Priority classes, served strictly in this order
+INTERACTIVE = 0  # a single tag's config, the user is looking at the page
+PROFILE = 1  # chat messages updating the profile
+BULK = 2  # whole-config regeneration
+PRIORITY_NAMES = ("interactive", "profile", "bulk")
+
+
+class Superseded(Exception):
+    """Raised for queued work dropped because a newer request for the same user and operation arrived"""
+
+    def __init__(self):
+        super().__init__("Superseded by a newer request")
+
+
+class DeadlineExpired(Exception):
+    """Raised for queued work whose deadline passed before a slot was free"""
+
+
+class Work(NamedTuple):
+    """Who an upstream call is for and how to schedule it"""
+    user: Optional[Hashable] = None  # fairness is per user; None shares one queue
+    priority: int = BULK
+    key: Optional[Hashable] = None  # supersede key, e.g. ("regenerate_config", user)
+    generation: int = 0  # from supersede(key)
+
+
+class _Job:
+    __slots__ = ("user", "priority", "deadline", "key", "generation", "future")
+
+    def __init__(self, user, priority, deadline, key, generation, future):
+        self.user = user
+        self.priority = priority
+        self.deadline = deadline
+        self.key = key
+        self.generation = generation
+        self.future = future
+
+
+class FairScheduler:
+    """
+    Admission control for upstream calls: at most max_concurrency run at once, and
+    waiting calls are started by priority class, then round-robin across users, so one
+    user queueing many calls only delays their own.
+
+    Work can carry a deadline (event loop time; it is dropped with DeadlineExpired if no
+    slot frees up before then, so callers can tell a queueing delay from a slow upstream) and a supersede key such as ("regenerate_config", user):
+    supersede(key) starts a new generation for the key, and queued work of older
+    generations is dropped with Superseded instead of running for a result nobody uses.
+    Work that already started is left to finish.
+
+    Not thread-safe; use from one event loop.
+    """
+
+    def __init__(self, max_concurrency: int, max_keys: int = 10000):
+        self.max_concurrency = max_concurrency
+        self.max_keys = max_keys
+        self.running = 0
+        self.queued = 0  # live jobs waiting for a slot
+        self._queues: List["OrderedDict[Hashable, deque]"] = [OrderedDict() for _ in PRIORITY_NAMES]
+        self._generations: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._jobs_by_key: Dict[Hashable, List[_Job]] = {}
+        self.started = [0] * len(PRIORITY_NAMES)
+        self.superseded = 0
+        self.expired = 0
+
+    def supersede(self, key: Hashable) -> int:
+        """Start a new generation of work for key, dropping queued work of older ones; returns the new generation"""
+        generation = self._generations.pop(key, 0) + 1
+        self._generations[key] = generation
+        while len(self._generations) > self.max_keys:
+            self._generations.popitem(last=False)
+        for job in self._jobs_by_key.pop(key, ()):
+            if not job.future.done():
+                self._drop(job, Superseded())
+                self.superseded += 1
+        return generation
+
+    def generation(self, key: Hashable) -> int:
+        """The current generation of work for key (0 if it was never superseded)"""
+        return self._generations.get(key, 0)
+
+    def is_current(self, key: Optional[Hashable], generation: int) -> bool:
+        return key is None or generation >= self._generations.get(key, 0)
+
+    async def acquire(self, work: Work, deadline: Optional[float] = None):
+        """Wait for a slot; every successful acquire() must be followed by one release()"""
+        user, priority, key, generation = work
+        if not self.is_current(key, generation):
+            self.superseded += 1
+            raise Superseded()
+        if self.running < self.max_concurrency and self.queued == 0:
+            self.running += 1
+            self.started[priority] += 1
+            return
+
+        loop = asyncio.get_running_loop()
+        job = _Job(user, priority, deadline, key, generation, loop.create_future())
+        self._queues[priority].setdefault(user, deque()).append(job)
+        self.queued += 1
+        if key is not None:
+            self._jobs_by_key.setdefault(key, []).append(job)
+        timer = loop.call_at(deadline, self._expire, job) if deadline is not None else None
+        try:
+            await job.future
+        except asyncio.CancelledError:
+            if not job.future.done() or job.future.cancelled():
+                self.queued -= 1  # still queued; _next_job skips it
+            elif job.future.exception() is None:
+                self.release()  # granted a slot just as we were cancelled
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            self._forget(job)
+
+    def release(self):
+        self.running -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        now = asyncio.get_running_loop().time()
+        while self.running < self.max_concurrency:
+            job = self._next_job()
+            if job is None:
+                return
+            if job.deadline is not None and job.deadline <= now:
+                self._expire(job)
+                continue
+            self.queued -= 1
+            self.running += 1
+            self.started[job.priority] += 1
+            job.future.set_result(None)
+
+    def _next_job(self) -> Optional[_Job]:
+        """Next live job: highest priority class first, then the user at the front of the round-robin"""
+        for queue in self._queues:
+            while queue:
+                user, jobs = next(iter(queue.items()))
+                job = jobs.popleft()
+                if jobs:
+                    queue.move_to_end(user)
+                else:
+                    del queue[user]
+                if not job.future.done():
+                    return job
+        return None
+
+    def _expire(self, job: _Job):
+        if not job.future.done():
+            self._drop(job, DeadlineExpired("Deadline passed while queued"))
+            self.expired += 1
+
+    def _drop(self, job: _Job, error: Exception):
+        self.queued -= 1
+        job.future.set_exception(error)
+
+    def _forget(self, job: _Job):
+        if job.key is None:
+            return
+        jobs = self._jobs_by_key.get(job.key)
+        if jobs is not None and job in jobs:
+            jobs.remove(job)
+            if not jobs:
+                del self._jobs_by_key[job.key]
+
+    def stats(self) -> Dict[str, Any]:
+        queued = [0] * len(PRIORITY_NAMES)
+        for priority, queue in enumerate(self._queues):
+            for jobs in queue.values():
+                queued[priority] += sum(not job.future.done() for job in jobs)
+        return {
+            "running": self.running,
+            "max_concurrency": self.max_concurrency,
+            "queued": dict(zip(PRIORITY_NAMES, queued)),
+            "queued_users": sum(len(queue) for queue in self._queues),
+            "started": dict(zip(PRIORITY_NAMES, self.started)),
+            "superseded": self.superseded,
+            "expired": self.expired,
+        }
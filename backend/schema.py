@@ -0,0 +1,191 @@
+"""
+Config element schema, single-pass parsing of LLM output against it, and fast JSON.
+
+Gemini's config JSON is extracted, parsed and checked against the ElementStyle schema
+in one call; malformed properties are dropped (and counted at /metrics as schema
+violations) instead of failing, or silently vanishing in a pydantic model later.
+Validated elements are plain dicts, serialized directly by FastJSONResponse, which
+uses orjson if it is installed and the standard library otherwise.
+"""
+
+import json
+import typing
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+import metrics
+
+try:
+    import orjson
+except ImportError:  # optional, only faster
+    orjson = None
+
+
+class ElementStyle(BaseModel):
+    fontSize: Optional[int] = None
+    color: Optional[str] = None
+    fontFamily: Optional[str] = None
+    fontWeight: Optional[str] = None
+    textDecoration: Optional[str] = None
+    backgroundSize: Optional[str] = None
+    border: Optional[str] = None
+    boxShadow: Optional[str] = None
+    padding: Optional[str] = None
+    margin: Optional[str] = None
+    textColor: Optional[str] = None
+    scale: Optional[float] = None
+    opacity: Optional[float] = None
+    backgroundColor: Optional[str] = None
+    borderRadius: Optional[str] = None
+
+class ConfigElement(BaseModel):
+    activationTime: float
+    style: ElementStyle
+
+class RLConfigResponse(ConfigElement):
+    decisionId: str
+
+
+def _field_type(annotation) -> type:
+    args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+    return args[0] if args else annotation
+
+
+# Precompiled from ElementStyle: property -> expected type
+STYLE_TYPES: Dict[str, type] = {name: _field_type(field.annotation) for name, field in ElementStyle.model_fields.items()}
+# Responses list every style property, null when unset, as the pydantic models did
+EMPTY_STYLE: Dict[str, None] = dict.fromkeys(STYLE_TYPES)
+ACTIVATION_TIME_RANGE = (0.1, 2.0)
+DEFAULT_ACTIVATION_TIME = 1.0
+
+SCHEMA_VIOLATIONS = metrics.Counter(
+    "websight_llm_schema_violations_total", "Gemini output that did not match the config schema and was repaired or dropped",
+    ["operation", "field"]
+)
+
+
+def loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    """Compact JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=str).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse for content that is already plain JSON data, skipping FastAPI's jsonable_encoder pass"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def extract_json(text: str) -> str:
+    """
+    The JSON value in an LLM response: from the first { or [ to the matching last } or ],
+    which drops markdown code fences and any prose around them in a single slice.
+    """
+    start = text.find("{")
+    array_start = text.find("[")
+    close = "}"
+    if array_start != -1 and (start == -1 or array_start < start):
+        start, close = array_start, "]"
+    if start == -1:
+        return text.strip()  # not JSON; let the parser report it
+    end = text.rfind(close)
+    return text[start:end + 1] if end > start else text[start:]
+
+
+def _check_style(style: Dict[str, Any], operation: str) -> Dict[str, Any]:
+    checked = {}
+    for name, value in style.items():
+        expected = STYLE_TYPES.get(name)
+        if expected is None:
+            SCHEMA_VIOLATIONS.labels(operation, "style.unknown_property").inc()
+        elif value is None:
+            continue
+        elif expected is str:
+            if isinstance(value, str):
+                checked[name] = value
+            else:
+                SCHEMA_VIOLATIONS.labels(operation, f"style.{name}").inc()
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            if expected is int and value != int(value):
+                SCHEMA_VIOLATIONS.labels(operation, f"style.{name}").inc()
+            checked[name] = int(round(value)) if expected is int else float(value)
+        else:
+            SCHEMA_VIOLATIONS.labels(operation, f"style.{name}").inc()
+            number = _parse_number(value)  # e.g. "18px" for fontSize
+            if number is not None:
+                checked[name] = int(round(number)) if expected is int else number
+    return checked
+
+
+def _parse_number(value: Any) -> Optional[float]:
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    if value.endswith("px"):
+        value = value[:-2]
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def check_element(element: Any, operation: str) -> Optional[Dict[str, Any]]:
+    """
+    A config element ({"activationTime", "style"}) with malformed properties dropped or
+    repaired, or None if element is not an object at all. Violations are counted per field.
+    """
+    if not isinstance(element, dict):
+        SCHEMA_VIOLATIONS.labels(operation, "element").inc()
+        return None
+    activation_time = element.get("activationTime")
+    if isinstance(activation_time, (int, float)) and not isinstance(activation_time, bool):
+        low, high = ACTIVATION_TIME_RANGE
+        if not low <= activation_time <= high:
+            SCHEMA_VIOLATIONS.labels(operation, "activationTime").inc()
+            activation_time = min(max(activation_time, low), high)
+    else:
+        SCHEMA_VIOLATIONS.labels(operation, "activationTime").inc()
+        activation_time = DEFAULT_ACTIVATION_TIME
+    style = element.get("style", {})
+    if not isinstance(style, dict):
+        SCHEMA_VIOLATIONS.labels(operation, "style").inc()
+        style = {}
+    return {"activationTime": float(activation_time), "style": _check_style(style, operation)}
+
+
+def check_config(parsed: Any, current_config: Dict[str, Any], operation: str) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Check a config for the tags of current_config. Tags whose element is missing or not an
+    object keep their current element and are returned as failed. Extra tags are dropped.
+    Raises ValueError if parsed is not an object of tags.
+    """
+    if not isinstance(parsed, dict):
+        SCHEMA_VIOLATIONS.labels(operation, "config").inc()
+        raise ValueError("Expected a JSON object of tags")
+    config, failed = {}, []
+    for tag, current in current_config.items():
+        element = check_element(parsed[tag], operation) if tag in parsed else None
+        if element is None:
+            if tag not in parsed:
+                SCHEMA_VIOLATIONS.labels(operation, "missing_tag").inc()
+            config[tag] = current
+            failed.append(tag)
+        else:
+            config[tag] = element
+    unexpected = sum(tag not in current_config for tag in parsed)
+    if unexpected:
+        SCHEMA_VIOLATIONS.labels(operation, "unexpected_tag").inc(unexpected)
+    return config, failed
+
+
+def element_response(element: Dict[str, Any], **extra) -> Dict[str, Any]:
+    """A config element as returned by the API: every style property present, unset ones null"""
+    return {"activationTime": element["activationTime"], "style": {**EMPTY_STYLE, **element["style"]}, **extra}
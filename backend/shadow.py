@@ -0,0 +1,89 @@
+import queue
+import threading
+import time
+
+import torch
+import torch.nn.functional as F
+
+
+class ShadowEvaluator:
+    """
+    Scores a candidate policy on the states the serving policy sees, off the
+    serving path.
+
+    select_actions hands each batch (states, serving log-probs, served actions) to
+    submit(), which only enqueues it; a background thread runs the candidate on the
+    batch and accumulates agreement statistics. When the queue is full, batches are
+    dropped rather than slowing requests down.
+    """
+
+    def __init__(self, policy, path, queue_size=256):
+        self.policy = policy
+        self.path = path
+        self.started_at = time.time()
+        self.samples = 0
+        self.batches = 0
+        self.dropped_batches = 0
+        self._greedy_agreement = 0.0
+        self._action_agreement = 0.0
+        self._kl_divergence = 0.0
+        self._candidate_actions = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, states, log_probs, actions):
+        """Queue a served batch for scoring; never blocks"""
+        try:
+            self._queue.put_nowait((states, log_probs, actions))
+        except queue.Full:
+            self.dropped_batches += 1
+
+    def close(self):
+        self._queue.put(None)
+
+    def _run(self):
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                return
+            try:
+                self._score(*batch)
+            except Exception as e:
+                print(f"Shadow evaluation failed: {e}")
+
+    def _score(self, states, log_probs, actions):
+        with torch.inference_mode():
+            candidate_log_probs = F.log_softmax(self.policy(states), dim=-1)
+            candidate_greedy = candidate_log_probs.argmax(dim=-1)
+            greedy = (candidate_greedy == log_probs.argmax(dim=-1)).sum().item()
+            # Probability the candidate would have sampled the action that was served
+            agreement = candidate_log_probs.gather(1, actions.unsqueeze(1)).exp().sum().item()
+            # KL(serving || candidate), summed over the batch
+            kl = (log_probs.exp() * (log_probs - candidate_log_probs)).sum().item()
+            counts = torch.bincount(candidate_greedy, minlength=candidate_log_probs.shape[1])
+
+        with self._lock:
+            self.samples += len(states)
+            self.batches += 1
+            self._greedy_agreement += greedy
+            self._action_agreement += agreement
+            self._kl_divergence += kl
+            self._candidate_actions = counts if self._candidate_actions is None else self._candidate_actions + counts
+
+    def stats(self) -> dict:
+        with self._lock:
+            n = max(self.samples, 1)
+            return {
+                "path": self.path,
+                "running_seconds": round(time.time() - self.started_at, 1),
+                "samples": self.samples,
+                "batches": self.batches,
+                "dropped_batches": self.dropped_batches,
+                "pending_batches": self._queue.qsize(),
+                "greedy_agreement": self._greedy_agreement / n,
+                "action_agreement": self._action_agreement / n,
+                "mean_kl_divergence": self._kl_divergence / n,
+                "candidate_greedy_actions": self._candidate_actions.tolist() if self._candidate_actions is not None else [],
+            }
@@ -0,0 +1,125 @@
+import mmap
+import os
+import struct
+import threading
+import time
+import warnings
+import numpy as np
+import torch
+
+MAGIC = 0x544C5752  # "RWLT"
+HEADER = struct.Struct("<QQQQ")  # magic, version, active slot, number of floats per slot
+DATA_OFFSET = 64
+
+# Minimum time between two publishes. A reader's slot is only rewritten by the publish after the
+# one that retired it, so this bounds how often a copy has to be retried, not just correctness
+MIN_PUBLISH_INTERVAL = 0.25
+# Times a reader retries a copy that a publish overlapped before giving up until its next poll
+READ_ATTEMPTS = 5
+
+
+class SharedWeights:
+    """
+    Policy weights shared between processes through a memory-mapped file.
+
+    The file holds two slots of flat float32 weights. The trainer writes new
+    weights into the inactive slot, then flips the active slot and bumps the
+    version. A slot is only written after a flip has retired it, so the version
+    works as a seqlock: readers copy the active slot and keep the copy only if
+    the version did not change meanwhile. Workers never point their parameters
+    into the file itself, which the trainer reuses two publishes later.
+    Publishes are spaced at least min_publish_interval apart.
+    """
+
+    def __init__(self, path, numel, mm, writable, min_publish_interval=MIN_PUBLISH_INTERVAL):
+        self.path = path
+        self.numel = numel
+        self._mm = mm
+        self._writable = writable
+        self.min_publish_interval = min_publish_interval
+        self._last_publish = 0.0
+        self._publish_lock = threading.Lock()  # training and model swaps publish from different threads
+        self.read_retries = 0
+
+    @classmethod
+    def create(cls, path, numel, min_publish_interval=MIN_PUBLISH_INTERVAL):
+        """Create (or reset) the shared weights file; used by the trainer"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        size = DATA_OFFSET + 2 * numel * 4
+        with open(path, "a+b") as f:
+            f.truncate(size)
+            mm = mmap.mmap(f.fileno(), size)
+        HEADER.pack_into(mm, 0, MAGIC, 0, 0, numel)
+        return cls(path, numel, mm, writable=True, min_publish_interval=min_publish_interval)
+
+    @classmethod
+    def open(cls, path):
+        """Map an existing shared weights file read-only, or return None if there is none yet"""
+        try:
+            with open(path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+        magic, _version, _slot, numel = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or len(mm) < DATA_OFFSET + 2 * numel * 4:
+            mm.close()
+            return None
+        return cls(path, numel, mm, writable=False)
+
+    def version(self):
+        return HEADER.unpack_from(self._mm, 0)[1]
+
+    def _slot(self, slot):
+        array = np.frombuffer(self._mm, dtype=np.float32, count=self.numel, offset=DATA_OFFSET + slot * self.numel * 4)
+        with warnings.catch_warnings():
+            # Readers map the file read-only; the tensor is never written through
+            warnings.simplefilter("ignore", UserWarning)
+            return torch.from_numpy(array)
+
+    def read(self):
+        """
+        Return (version, flat weights) for the active slot as a private copy.
+        Raises RuntimeError if every attempt overlapped a publish.
+        """
+        for _ in range(READ_ATTEMPTS):
+            _magic, version, slot, _numel = HEADER.unpack_from(self._mm, 0)
+            flat_weights = self._slot(slot).clone()
+            if self.version() == version:
+                return version, flat_weights
+            self.read_retries += 1
+        raise RuntimeError(f"Shared weights changed during {READ_ATTEMPTS} reads in a row")
+
+    def publish(self, flat_weights):
+        """
+        Write flat_weights to the inactive slot and make it active. Returns the new version.
+        Waits out the rest of min_publish_interval if the previous publish was more recent.
+        """
+        if not self._writable:
+            raise RuntimeError("Shared weights are mapped read-only")
+        if flat_weights.numel() != self.numel:
+            raise ValueError(f"Expected {self.numel} weights, got {flat_weights.numel()}")
+        with self._publish_lock:
+            wait = self._last_publish + self.min_publish_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            _magic, version, slot, _numel = HEADER.unpack_from(self._mm, 0)
+            inactive = 1 - slot
+            self._slot(inactive).copy_(flat_weights.detach().reshape(-1))
+            HEADER.pack_into(self._mm, 0, MAGIC, version + 1, inactive, self.numel)
+            self._last_publish = time.monotonic()
+            return version + 1
+
+
+def bind_parameters(module, flat_weights):
+    """Point the module's parameters at consecutive slices of flat_weights (no copy), e.g. a read() copy"""
+    offset = 0
+    for param in module.parameters():
+        n = param.numel()
+        param.data = flat_weights[offset:offset + n].view_as(param)
+        param.requires_grad_(False)
+        offset += n
+    if offset != flat_weights.numel():
+        raise ValueError(f"Module has {offset} weights, shared weights have {flat_weights.numel()}")
+    return module
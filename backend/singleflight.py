@@ -0,0 +1,58 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class _Call:
+    __slots__ = ("future", "waiters")
+
+    def __init__(self, future):
+        self.future = future
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one: the first caller runs
+    the work, later callers with the same key await the same result.
+
+    The shared call is shielded so that one caller being cancelled (e.g. its client
+    disconnected) does not cancel it for the others; it is cancelled only when no
+    callers are left waiting.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self.calls = 0
+        self.collapsed = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.future.add_done_callback(lambda _future: self._forget(key, call))
+            self.calls += 1
+        else:
+            self.collapsed += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.future)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.future.done():
+                call.future.cancel()
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "calls": self.calls,
+            "collapsed": self.collapsed,
+        }
@@ -0,0 +1,50 @@
+"""
+Tests for the Gemini result cache and its disk tier.
+
+Run with: python -m pytest test_cache.py
+"""
+
+import asyncio
+import threading
+
+from cache import ResultCache
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    cache = ResultCache(disk_path=path)
+    cache.set("key", {"p": 1})
+    cache.flush()
+
+    restarted = ResultCache(disk_path=path)
+    assert restarted.get("key") is None  # memory only
+    assert asyncio.run(restarted.get_async("key")) == {"p": 1}
+    assert restarted.get("key") == {"p": 1}  # promoted to memory
+    assert restarted.stats()["disk_hits"] == 1
+    assert asyncio.run(restarted.get_async("missing")) is None
+    assert restarted.stats()["misses"] == 2
+
+
+def test_set_does_not_wait_for_disk(tmp_path):
+    cache = ResultCache(disk_path=str(tmp_path / "results.sqlite"))
+    with cache._db_lock:  # a slow commit in progress
+        done = threading.Event()
+        threading.Thread(target=lambda: (cache.set("key", 1), done.set())).start()
+        assert done.wait(1)
+        assert cache.get("key") == 1
+    cache.flush()
+
+
+def test_disk_reads_happen_off_the_event_loop(tmp_path):
+    cache = ResultCache(disk_path=str(tmp_path / "results.sqlite"))
+
+    async def run():
+        lock = cache._db_lock
+        lock.acquire()
+        lookup = asyncio.ensure_future(cache.get_async("key"))
+        await asyncio.sleep(0.05)  # the loop keeps running while the read waits on disk
+        assert not lookup.done()
+        lock.release()
+        assert await lookup is None
+
+    asyncio.run(run())
@@ -0,0 +1,38 @@
+"""
+Tests for the background checkpoint writer and its history rotation.
+
+Run with: python -m pytest test_checkpoint.py
+"""
+
+import os
+
+import torch
+
+from checkpoint import CheckpointWriter
+
+
+def test_rotation_keeps_the_newest_history_only(tmp_path):
+    writer = CheckpointWriter(str(tmp_path / "agent_model.pt"), keep=2)
+    for step in range(4):
+        writer.submit({"train_steps": step})
+        assert writer.flush(timeout=10)
+
+    history = writer.history()
+    assert len(history) == 2
+    assert [torch.load(path)["train_steps"] for path in history] == [2, 3]
+    assert torch.load(writer.path)["train_steps"] == 3
+
+
+def test_rotation_leaves_other_checkpoints_alone(tmp_path):
+    others = ["agent_model-candidate.pt", "agent_model-2024.pt", "agent_model-20240101-000000-000000.pt.bak",
+              "other_model-20240101-000000-000000.pt"]
+    for name in others:
+        torch.save({"train_steps": -1}, str(tmp_path / name))
+
+    writer = CheckpointWriter(str(tmp_path / "agent_model.pt"), keep=1)
+    for step in range(3):
+        writer.submit({"train_steps": step})
+        assert writer.flush(timeout=10)
+
+    assert all(os.path.exists(tmp_path / name) for name in others)
+    assert len(writer.history()) == 1
@@ -0,0 +1,60 @@
+"""
+Tests for the nearest-neighbour config index.
+
+Run with: python -m pytest test_config_index.py
+"""
+
+import threading
+
+from config_index import ConfigIndex
+
+USER_INFO = {"accessibility_needs": {"visual": ["low vision"]}, "preferences": {"font_size": "large"}}
+ELEMENT = {"activationTime": 0.5, "style": {"fontSize": 24}}
+
+
+def test_disk_index_survives_a_restart(tmp_path):
+    path = str(tmp_path / "config_index.sqlite")
+    index = ConfigIndex(disk_path=path)
+    index.add(USER_INFO, {"p": ELEMENT})
+    index.flush()
+    assert ConfigIndex(disk_path=path).lookup("p", USER_INFO) == ELEMENT
+
+
+def test_add_does_not_wait_for_disk(tmp_path):
+    index = ConfigIndex(disk_path=str(tmp_path / "config_index.sqlite"))
+    db, committing = index._db, threading.Event()
+
+    class SlowDB:
+        def executemany(self, *args):
+            committing.wait(5)  # a slow disk
+            return db.executemany(*args)
+
+        def commit(self):
+            db.commit()
+
+    index._db = SlowDB()
+    index.add(USER_INFO, {"p": ELEMENT})
+    assert index.lookup("p", USER_INFO) == ELEMENT  # served from memory before the write lands
+    committing.set()
+    index.flush()
+
+
+def test_changing_one_preference_misses_the_index():
+    # A large profile: under the old hashed-token distance a one-field change moved it by less than 0.2
+    needs = {"visual": [f"need {i}" for i in range(20)], "motor": [f"motor {i}" for i in range(10)]}
+    preferences = {f"setting_{i}": f"value {i}" for i in range(14)}
+    profile = {"accessibility_needs": needs, "preferences": {**preferences, "font_size": "normal"}}
+    index = ConfigIndex()
+    index.add(profile, {"p": ELEMENT})
+
+    changed = {**profile, "preferences": {**preferences, "font_size": "large"}}
+    assert index.lookup("p", changed) is None
+    assert index.lookup_config(changed, {"p": {}}) is None
+    assert index.lookup("p", {**profile, "feedback_history": [{"feedback": "thanks"}]}) == ELEMENT
+
+
+def test_numeric_features_still_match_by_distance():
+    index = ConfigIndex(max_distance=0.2)
+    index.add({**USER_INFO, "age": 60}, {"p": ELEMENT})
+    assert index.lookup("p", {**USER_INFO, "age": 65}) == ELEMENT
+    assert index.lookup("p", {**USER_INFO, "age": 95}) is None
@@ -0,0 +1,140 @@
+"""
+Tests for the experience log shared by workers and the trainer.
+
+Run with: python -m pytest test_experience.py
+"""
+
+import os
+
+import numpy as np
+
+from experience import ExperienceLog, FeedbackLog, list_segments, read_segment, record_dtype, rewarded_decisions
+
+STATE_DIM = 4
+RECORD_SIZE = record_dtype(STATE_DIM).itemsize
+
+
+def rewards(log, count, start=0):
+    return np.concatenate([log.reward(float(start + i), f"d{start + i}", None, 0.0) for i in range(count)])
+
+
+def test_restarted_reader_resumes_after_committed_records(tmp_path):
+    path = str(tmp_path / "experience.log")
+    worker = ExperienceLog(path, STATE_DIM)
+    worker.append(rewards(worker, 20))
+
+    trainer = ExperienceLog(path, STATE_DIM)
+    assert len(trainer.read_new()) == 20
+    trainer.commit()
+
+    worker.append(rewards(worker, 3, start=20))
+    restarted = ExperienceLog(path, STATE_DIM)
+    assert restarted.read_new()["reward"].tolist() == [20.0, 21.0, 22.0]
+
+
+def test_uncommitted_records_are_read_again(tmp_path):
+    path = str(tmp_path / "experience.log")
+    log = ExperienceLog(path, STATE_DIM)
+    log.append(rewards(log, 5))
+    assert len(log.read_new()) == 5  # the trainer stopped before applying them
+    assert len(ExperienceLog(path, STATE_DIM).read_new()) == 5
+
+
+def test_compact_resets_the_saved_offset(tmp_path):
+    path = str(tmp_path / "experience.log")
+    log = ExperienceLog(path, STATE_DIM, max_bytes=1)
+    log.append(rewards(log, 5))
+    log.read_new()
+    log.commit()
+    assert log.compact()
+    assert os.path.getsize(path) == 0
+
+    log.append(rewards(log, 2, start=5))
+    assert ExperienceLog(path, STATE_DIM).read_new()["reward"].tolist() == [5.0, 6.0]
+
+
+def test_offset_past_the_end_of_the_file_is_ignored(tmp_path):
+    path = str(tmp_path / "experience.log")
+    log = ExperienceLog(path, STATE_DIM)
+    log.append(rewards(log, 5))
+    log.read_new()
+    log.commit()
+    os.truncate(path, 0)
+    log.append(rewards(log, 2))
+    assert len(ExperienceLog(path, STATE_DIM).read_new()) == 2
+
+
+def test_appends_stop_at_max_file_bytes(tmp_path):
+    path = str(tmp_path / "experience.log")
+    log = ExperienceLog(path, STATE_DIM, max_file_bytes=10 * RECORD_SIZE)
+    for _ in range(4):
+        log.append(rewards(log, 3))
+    assert os.path.getsize(path) == 9 * RECORD_SIZE
+    assert log.dropped == 3
+
+
+def feedback_log(tmp_path):
+    return FeedbackLog(str(tmp_path / "feedback"), STATE_DIM)
+
+
+def decide(log, decision_id, session_id, action, now):
+    """Log one decision whose state is filled with its action, so matches can be told apart"""
+    log.append(log.decisions([decision_id], [session_id], np.full((1, STATE_DIM), action, np.float32),
+                             [action], [-float(action)], now))
+
+
+def joined(log):
+    log.close()
+    states, actions, rewards, log_probs = rewarded_decisions(log.directory, STATE_DIM)
+    assert (states[:, 0] == actions).all() and (log_probs == -actions).all()
+    return dict(zip(actions.tolist(), rewards.tolist()))
+
+
+def test_rewards_credit_their_decision_id(tmp_path):
+    log = feedback_log(tmp_path)
+    decide(log, "d1", "s1", 1, now=1.0)
+    decide(log, "d2", "s1", 2, now=2.0)
+    log.append(log.reward(0.5, "d1", "s1", now=3.0))  # not the session's latest decision
+    log.append(log.reward(0.7, "unknown", None, now=4.0))
+    assert joined(log) == {1: 0.5}
+
+
+def test_rewards_without_an_id_credit_the_sessions_latest_earlier_decision(tmp_path):
+    log = feedback_log(tmp_path)
+    decide(log, "d1", "s1", 1, now=1.0)
+    decide(log, "d2", "s2", 2, now=2.0)
+    log.append(log.reward(0.5, None, "s1", now=3.0))
+    decide(log, "d3", "s1", 3, now=4.0)  # later than the reward: never credited by it
+    log.append(log.reward(0.8, None, "s3", now=5.0))  # a session with no decisions
+    assert joined(log) == {1: 0.5}
+
+
+def test_legacy_rewards_credit_the_latest_earlier_decision(tmp_path):
+    log = feedback_log(tmp_path)
+    decide(log, "d1", "s1", 1, now=1.0)
+    decide(log, "d2", "s2", 2, now=2.0)
+    log.append(log.reward(0.5, None, None, now=3.0))
+    decide(log, "d3", "s1", 3, now=4.0)
+    assert joined(log) == {2: 0.5}
+
+
+def test_only_the_first_reward_of_a_decision_counts(tmp_path):
+    log = feedback_log(tmp_path)
+    decide(log, "d1", "s1", 1, now=1.0)
+    log.append(log.reward(0.75, "d1", None, now=3.0))
+    log.append(log.reward(0.25, "d1", None, now=2.0))  # logged later, happened first
+    log.append(log.reward(0.125, None, "s1", now=4.0))
+    assert joined(log) == {1: 0.25}
+
+
+def test_a_torn_last_record_is_ignored(tmp_path):
+    log = feedback_log(tmp_path)
+    decide(log, "d1", "s1", 1, now=1.0)
+    decide(log, "d2", "s1", 2, now=2.0)
+    log.append(log.reward(0.5, "d1", None, now=3.0))
+    log.append(log.reward(0.6, "d2", None, now=4.0))
+    log.close()
+    segment = list_segments(log.directory)[-1]
+    os.truncate(segment, os.path.getsize(segment) - RECORD_SIZE // 2)  # crashed mid-write
+    assert len(read_segment(segment, STATE_DIM)) == 3
+    assert joined(log) == {1: 0.5}
@@ -7,6 +7,7 @@ import json
 import time
 
 BASE_URL = "http://localhost:8000"
+SESSION_ID = "test_session_1"
 
 def test_health():
     """Test the health endpoint"""
@@ -18,6 +19,7 @@ def test_rl_config():
     """Test the RL configuration endpoint"""
     payload = {
         "tag": "p",
+        "session_id": SESSION_ID,
         "userInfo": {
             "age": 25,
             "vision_conditions": ["myopia"],
@@ -30,18 +32,18 @@ def test_rl_config():
     
     response = requests.post(f"{BASE_URL}/rl_config", json=payload)
     print(f"RL config response: {response.json()}")
-    return response.status_code == 200
+    return response.status_code == 200 and "decisionId" in response.json()
 
 def test_feedback():
     """Test the feedback endpoint"""
     payload = {
         "reward": 0.8,
-        "session_id": "test_session_1"
+        "session_id": SESSION_ID
     }
     
     response = requests.post(f"{BASE_URL}/feedback", json=payload)
     print(f"Feedback response: {response.json()}")
-    return response.status_code == 200
+    return response.status_code == 200 and response.json().get("status") == "success"
 
 def test_save_model():
     """Test manual model saving"""
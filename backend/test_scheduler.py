@@ -0,0 +1,255 @@
+"""
+Tests for the Gemini scheduler together with single-flight, against a local stand-in for Gemini.
+
+Run with: python -m pytest test_scheduler.py
+"""
+
+import asyncio
+import json
+import os
+import time
+
+os.environ.setdefault("GEMINI_TRACE", "0")
+os.environ.setdefault("CONFIG_INDEX", "0")
+
+import pytest
+
+import gemini
+from scheduler import BULK, INTERACTIVE, PROFILE, DeadlineExpired, FairScheduler, Superseded, Work
+from singleflight import SingleFlight
+
+CONFIG = {"p": {"activationTime": 1.0, "style": {}}}
+
+
+class FakeModel:
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.calls = 0
+
+    async def generate_content_async(self, prompt, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return type("Response", (), {"text": json.dumps({"p": {"activationTime": 0.5, "style": {"fontSize": 18}}})})
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    model = FakeModel()
+    monkeypatch.setattr(gemini, "model", model)
+    return model
+
+
+async def hold(scheduler, work, log, name, deadline=None, seconds=0.01):
+    """Take a slot for seconds, logging the order slots were granted in"""
+    try:
+        await scheduler.acquire(work, deadline)
+    except (Superseded, DeadlineExpired) as e:
+        log.append((name, type(e).__name__))
+        return
+    try:
+        log.append(name)
+        await asyncio.sleep(seconds)
+    finally:
+        scheduler.release()
+
+
+def assert_idle(scheduler):
+    assert scheduler.running == 0
+    assert scheduler.queued == 0
+    assert scheduler.stats()["queued_users"] == 0
+
+
+def test_priority_then_round_robin():
+    async def run():
+        scheduler, log = FairScheduler(1), []
+        tasks = [asyncio.ensure_future(hold(scheduler, Work("a", BULK), log, "first"))]
+        await asyncio.sleep(0)
+        for name, work in [("a1", Work("a", BULK)), ("a2", Work("a", BULK)), ("b1", Work("b", BULK)),
+                           ("c-profile", Work("c", PROFILE)), ("d-interactive", Work("d", INTERACTIVE))]:
+            tasks.append(asyncio.ensure_future(hold(scheduler, work, log, name)))
+        await asyncio.gather(*tasks)
+        assert log == ["first", "d-interactive", "c-profile", "a1", "b1", "a2"]
+        assert_idle(scheduler)
+
+    asyncio.run(run())
+
+
+def test_supersede_drops_queued_work_only():
+    async def run():
+        scheduler, log = FairScheduler(1), []
+        key = ("regenerate_config", "alice")
+        running = asyncio.ensure_future(hold(scheduler, Work("alice", BULK, key, scheduler.supersede(key)), log, "running"))
+        await asyncio.sleep(0)
+        queued = asyncio.ensure_future(hold(scheduler, Work("alice", BULK, key, scheduler.generation(key)), log, "queued"))
+        await asyncio.sleep(0)
+        newer = asyncio.ensure_future(hold(scheduler, Work("alice", BULK, key, scheduler.supersede(key)), log, "newer"))
+        await asyncio.gather(running, queued, newer)
+        assert log == ["running", ("queued", "Superseded"), "newer"]
+        assert scheduler.superseded == 1
+        assert_idle(scheduler)
+
+    asyncio.run(run())
+
+
+def test_deadline_expires_queued_work_without_leaking_slots():
+    async def run():
+        scheduler, log = FairScheduler(1), []
+        loop = asyncio.get_running_loop()
+        blocker = asyncio.ensure_future(hold(scheduler, Work("a"), log, "blocker", seconds=0.1))
+        await asyncio.sleep(0)
+        late = asyncio.ensure_future(hold(scheduler, Work("b"), log, "late", deadline=loop.time() + 0.02))
+        await asyncio.sleep(0.05)
+        assert log == ["blocker", ("late", "DeadlineExpired")]  # dropped at its deadline, not when the slot freed
+        await asyncio.gather(blocker, late)
+        assert scheduler.expired == 1
+        assert_idle(scheduler)
+
+    asyncio.run(run())
+
+
+def test_cancellation_accounting():
+    async def run():
+        scheduler, log = FairScheduler(1), []
+        blocker = asyncio.ensure_future(hold(scheduler, Work("a"), log, "blocker"))
+        await asyncio.sleep(0)
+        cancelled = asyncio.ensure_future(hold(scheduler, Work("b"), log, "cancelled"))
+        await asyncio.sleep(0)
+        assert scheduler.queued == 1
+        cancelled.cancel()
+        await asyncio.gather(blocker, cancelled, return_exceptions=True)
+        assert "cancelled" not in log
+        assert_idle(scheduler)
+
+        # Granted a slot and cancelled before it got to run: the slot goes back
+        blocker = asyncio.ensure_future(hold(scheduler, Work("a"), log, "blocker2"))
+        await asyncio.sleep(0)
+        granted = asyncio.ensure_future(hold(scheduler, Work("b"), log, "granted"))
+        await asyncio.sleep(0)
+        await blocker
+        granted.cancel()
+        await asyncio.gather(granted, return_exceptions=True)
+        assert_idle(scheduler)
+
+    asyncio.run(run())
+
+
+def test_identical_regenerations_share_one_call(fake_model):
+    async def run():
+        service = gemini.GeminiService(max_concurrency=1)
+        blocker = asyncio.ensure_future(service.update_whole_config({"blocker": 1}, CONFIG, "bob"))
+        await asyncio.sleep(0.01)
+        first = asyncio.ensure_future(service.update_whole_config({"x": 1}, CONFIG, "alice", supersede=True))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(service.update_whole_config({"x": 1}, CONFIG, "alice", supersede=True))
+        results = await asyncio.gather(blocker, first, second, return_exceptions=True)
+        assert not any(isinstance(result, Exception) for result in results)
+        assert fake_model.calls == 2
+        assert service.single_flight.collapsed == 1
+        assert_idle(service.scheduler)
+
+    asyncio.run(run())
+
+
+def test_newer_regeneration_supersedes_queued_one(fake_model):
+    async def run():
+        service = gemini.GeminiService(max_concurrency=1)
+        blocker = asyncio.ensure_future(service.update_whole_config({"blocker": 1}, CONFIG, "bob"))
+        await asyncio.sleep(0.01)
+        older = asyncio.ensure_future(service.update_whole_config({"x": 1}, CONFIG, "alice", supersede=True))
+        await asyncio.sleep(0)
+        newer = asyncio.ensure_future(service.update_whole_config({"x": 2}, CONFIG, "alice", supersede=True))
+        results = await asyncio.gather(blocker, older, newer, return_exceptions=True)
+        assert isinstance(results[1], Superseded)
+        assert results[2]["p"]["style"] == {"fontSize": 18}
+        assert fake_model.calls == 2
+        assert_idle(service.scheduler)
+
+    asyncio.run(run())
+
+
+def test_requests_by_address_never_supersede(fake_model):
+    async def run():
+        service = gemini.GeminiService(max_concurrency=1)
+        blocker = asyncio.ensure_future(service.update_whole_config({"blocker": 1}, CONFIG, "10.0.0.1"))
+        await asyncio.sleep(0.01)
+        calls = [asyncio.ensure_future(service.update_whole_config({"x": i}, CONFIG, "10.0.0.1")) for i in range(3)]
+        results = await asyncio.gather(blocker, *calls, return_exceptions=True)
+        assert not any(isinstance(result, Exception) for result in results)
+        assert service.scheduler.superseded == 0
+        assert_idle(service.scheduler)
+
+    asyncio.run(run())
+
+
+def test_superseded_stream_raises_after_its_chunks(fake_model):
+    async def run():
+        service = gemini.GeminiService(max_concurrency=2)
+        config = {"p": CONFIG["p"], "div": CONFIG["p"]}
+
+        async def consume(user_info):
+            return [result async for result in service.update_config_tags(
+                user_info, config, list(config), chunk_size=1, user="alice", supersede=True)]
+
+        older = asyncio.ensure_future(consume({"x": 1}))
+        await asyncio.sleep(0.01)  # both chunks are running
+        newer = asyncio.ensure_future(consume({"x": 2}))
+        older_result, newer_result = await asyncio.gather(older, newer, return_exceptions=True)
+        assert isinstance(older_result, Superseded)
+        assert len(newer_result) == 2
+        assert_idle(service.scheduler)
+
+    asyncio.run(run())
+
+
+def test_single_flight_cancels_shared_call_with_its_last_waiter(fake_model):
+    async def run():
+        service = gemini.GeminiService(max_concurrency=1)
+        callers = [asyncio.ensure_future(service.update_whole_config({"x": 1}, CONFIG)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        callers[0].cancel()
+        await asyncio.sleep(0)
+        assert service.single_flight.in_flight(gemini.make_key(
+            "update_whole_config", gemini.PROMPT_VERSION, {"x": 1}, CONFIG))
+        callers[1].cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0.01)  # the shared call unwinds
+        assert service.single_flight.stats()["in_flight"] == 0
+        assert_idle(service.scheduler)
+
+    asyncio.run(run())
+
+
+def test_single_flight_shares_one_result():
+    async def run():
+        flight, calls = SingleFlight(), []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(3)))
+        assert results == ["result"] * 3
+        assert len(calls) == 1
+        assert flight.stats() == {"in_flight": 0, "calls": 1, "collapsed": 2}
+
+    asyncio.run(run())
+
+
+def test_model_is_loaded_off_the_event_loop(monkeypatch):
+    def slow_get_model():
+        time.sleep(0.2)  # importing google.generativeai
+        return FakeModel()
+
+    monkeypatch.setattr(gemini, "model", None)
+    monkeypatch.setattr(gemini, "get_model", slow_get_model)
+
+    async def run():
+        service = gemini.GeminiService(max_concurrency=1)
+        call = asyncio.ensure_future(service.update_whole_config({"x": 1}, CONFIG))
+        start = time.monotonic()
+        await asyncio.sleep(0.01)
+        assert time.monotonic() - start < 0.1  # the loop kept running while the model loaded
+        assert (await call)["p"]["style"] == {"fontSize": 18}
+
+    asyncio.run(run())
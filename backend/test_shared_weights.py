@@ -0,0 +1,77 @@
+"""
+Tests for the weights the trainer shares with inference workers.
+
+Run with: python -m pytest test_shared_weights.py
+"""
+
+import threading
+import time
+
+import pytest
+import torch
+
+from shared_weights import SharedWeights
+
+NUMEL = 1_000_000  # large enough that a copy regularly overlaps a publish
+
+
+def test_reads_never_mix_two_versions(tmp_path):
+    path = str(tmp_path / "shared_weights.bin")
+    writer = SharedWeights.create(path, NUMEL, min_publish_interval=0.0)
+    readers = [SharedWeights.open(path) for _ in range(2)]
+    stop, errors = threading.Event(), []
+
+    def publish():
+        value = 0
+        while not stop.is_set():
+            value += 1
+            writer.publish(torch.full((NUMEL,), float(value)))
+
+    def read(shared):
+        for _ in range(200):
+            try:
+                version, weights = shared.read()
+            except RuntimeError:
+                continue  # every attempt overlapped a publish
+            if weights.min() != weights.max():
+                errors.append(version)
+
+    publisher = threading.Thread(target=publish)
+    publisher.start()
+    threads = [threading.Thread(target=read, args=(shared,)) for shared in readers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stop.set()
+    publisher.join()
+
+    assert errors == []
+    assert sum(shared.read_retries for shared in readers) > 0  # the publisher really did overlap reads
+
+
+def test_read_returns_a_private_copy(tmp_path):
+    path = str(tmp_path / "shared_weights.bin")
+    writer = SharedWeights.create(path, 4, min_publish_interval=0.0)
+    writer.publish(torch.ones(4))
+    version, weights = SharedWeights.open(path).read()
+    writer.publish(torch.zeros(4))
+    writer.publish(torch.full((4,), 2.0))  # rewrites the slot the first read came from
+    assert version == 1
+    assert weights.tolist() == [1.0] * 4
+
+
+def test_publishes_are_rate_limited(tmp_path):
+    writer = SharedWeights.create(str(tmp_path / "shared_weights.bin"), 4, min_publish_interval=0.1)
+    start = time.monotonic()
+    for _ in range(3):
+        writer.publish(torch.zeros(4))
+    assert time.monotonic() - start >= 0.2
+    assert writer.version() == 3
+
+
+def test_readers_cannot_publish(tmp_path):
+    path = str(tmp_path / "shared_weights.bin")
+    SharedWeights.create(path, 4)
+    with pytest.raises(RuntimeError):
+        SharedWeights.open(path).publish(torch.zeros(4))
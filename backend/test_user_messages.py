@@ -0,0 +1,105 @@
+"""
+Tests for /users/{user_id}/message against a local stand-in for Gemini.
+
+Run with: python -m pytest test_user_messages.py
+"""
+
+import asyncio
+import json
+import os
+import re
+import tempfile
+
+os.environ.setdefault("GEMINI_TRACE", "0")
+os.environ.setdefault("CONFIG_INDEX", "0")
+os.environ["PROFILE_STORE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="websight-test-"), "profiles.sqlite")
+
+import httpx
+import pytest
+
+import gemini
+import main
+
+CONFIG = {"p": {"activationTime": 1.0, "style": {"fontSize": 16}}, "div": {"activationTime": 1.0, "style": {}}}
+USER_INFO = {"accessibility_needs": {"visual": []}, "preferences": {"font_size": "normal"}, "feedback_history": []}
+
+
+class FakeModel:
+    """Appends each message to feedback_history and asks for large text; configs get fontSize 24"""
+
+    async def generate_content_async(self, prompt, **kwargs):
+        await asyncio.sleep(0.02)
+        message = re.search(r"New User Message/Feedback: (.*)\n", prompt)
+        if message:
+            user_info = json.loads(re.search(r"Current User Information: (.*)\n", prompt).group(1))
+            history = user_info.get("feedback_history", []) + [{"feedback": message.group(1)}]
+            text = json.dumps({**user_info, "preferences": {"font_size": "large"}, "feedback_history": history})
+        else:
+            config = json.loads(re.search(r"Current Configuration: (.*)\n", prompt).group(1))
+            text = json.dumps({tag: {"activationTime": 0.5, "style": {"fontSize": 24}} for tag in config})
+        return type("Response", (), {"text": text})
+
+
+@pytest.fixture(autouse=True)
+def fake_model(monkeypatch):
+    monkeypatch.setattr(gemini, "model", FakeModel())
+
+
+def run(coroutine):
+    async def with_client():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await coroutine(client)
+
+    return asyncio.run(with_client())
+
+
+def seed(user_id):
+    saved = main.profile_store.put(user_id, USER_INFO, CONFIG)
+    return saved.etag
+
+
+def test_concurrent_messages_without_if_match_are_both_applied():
+    seed("alice")
+
+    async def send(client):
+        return await asyncio.gather(*(
+            client.post("/users/alice/message", json={"message": f"message {i}"}) for i in range(2)
+        ))
+
+    responses = run(send)
+    assert [response.status_code for response in responses] == [200, 200]
+    stored = main.profile_store.get("alice")
+    assert [entry["feedback"] for entry in stored.user_info["feedback_history"]] == ["message 0", "message 1"]
+    assert stored.config["p"]["style"] == {"fontSize": 24}
+    assert stored.etag in {response.headers["ETag"] for response in responses}
+
+
+def test_if_match_on_an_old_version_is_a_conflict():
+    etag = seed("bob")
+
+    async def send(client):
+        return await asyncio.gather(*(
+            client.post("/users/bob/message", json={"message": f"message {i}"}, headers={"If-Match": etag})
+            for i in range(2)
+        ))
+
+    first, second = run(send)
+    assert first.status_code == 200
+    assert second.status_code == 412
+    assert second.headers["ETag"] != etag  # the version the first message stored its profile update as
+    assert len(main.profile_store.get("bob").user_info["feedback_history"]) == 1
+
+
+def test_response_is_the_delta_from_the_version_the_message_was_applied_to():
+    etag = seed("carol")
+
+    async def send(client):
+        return await client.post("/users/carol/message", json={"message": "bigger text"}, headers={"If-Match": etag})
+
+    result = run(send).json()
+    stored = main.profile_store.get("carol")
+    assert result["userInfo"] == {"preferences": {"font_size": "large"},
+                                  "feedback_history": [{"feedback": "bigger text"}]}
+    assert result["config"] == stored.config  # font_size affects every tag
+    assert result["version"] == stored.version
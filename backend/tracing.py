@@ -0,0 +1,91 @@
+import glob
+import gzip
+import json
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+
+
+class TraceSink:
+    """
+    Sampled, bounded sink for prompt/response traces.
+
+    record() only samples and enqueues, so it never blocks the caller; a background
+    thread writes events as gzip-compressed JSONL segments under `directory`.
+    A segment is closed after max_segment_bytes of (uncompressed) JSON and only the
+    newest max_segments segments are kept. Events that arrive while the queue is
+    full are dropped and counted.
+    """
+
+    def __init__(self, directory="./debug", enabled=True, sample_rate=1.0,
+                 max_segment_bytes=8 * 1024 * 1024, max_segments=10, queue_size=1000):
+        self.directory = directory
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segments = max_segments
+        self.recorded = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        if enabled:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def record(self, kind, **fields):
+        """Queue one trace event, subject to sampling"""
+        if not self.enabled or (self.sample_rate < 1.0 and random.random() >= self.sample_rate):
+            return
+        event = {"ts": time.time(), "kind": kind, **fields}
+        try:
+            self._queue.put_nowait(event)
+            self.recorded += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        segment = None
+        segment_bytes = 0
+        while True:
+            try:
+                event = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                if segment is not None:
+                    segment.flush()  # push buffered events to disk while idle
+                continue
+
+            try:
+                line = (json.dumps(event, default=str) + "\n").encode("utf-8")
+                if segment is None or segment_bytes + len(line) > self.max_segment_bytes:
+                    if segment is not None:
+                        segment.close()
+                    segment = self._open_segment()
+                    segment_bytes = 0
+                segment.write(line)
+                segment_bytes += len(line)
+            except Exception as e:
+                print(f"Failed to write trace: {e}")
+                segment = None
+
+    def _open_segment(self):
+        os.makedirs(self.directory, exist_ok=True)
+        existing = sorted(glob.glob(os.path.join(self.directory, "trace-*.jsonl.gz")))
+        for old_path in existing[:max(0, len(existing) - self.max_segments + 1)]:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+        name = f"trace-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.jsonl.gz"
+        return gzip.open(os.path.join(self.directory, name), "ab")
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "queued": self._queue.qsize(),
+        }
@@ -0,0 +1,111 @@
+"""
+Train the RL policy offline from the persistent feedback log.
+
+Every decision and reward the API serves is appended to model/feedback/ (see
+experience.FeedbackLog). This joins rewards to their decisions and trains
+PolicyNetwork on them in large batches, either fine-tuning the current
+checkpoint or from scratch, then writes a checkpoint RLAgent.load_model reads:
+
+    python train_offline.py                              # fine-tune model/agent_model.pt
+    python train_offline.py --from-scratch --epochs 50
+    python train_offline.py --output model/offline.pt    # leave the serving checkpoint alone
+
+A running API overwrites model/agent_model.pt on its next periodic save, so stop it
+first (or write to --output and swap the file in while it is stopped).
+"""
+
+import argparse
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import torch
+
+from agent import PolicyNetwork, reinforce_step
+from checkpoint import CheckpointWriter
+from experience import rewarded_decisions
+
+# Must match RLAgent
+STATE_DIM = 10
+ACTION_DIM = 3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log-dir", default="model/feedback", help="feedback log directory")
+    parser.add_argument("--model-path", default="model/agent_model.pt", help="checkpoint to fine-tune")
+    parser.add_argument("--output", help="where to write the checkpoint (default: --model-path)")
+    parser.add_argument("--from-scratch", action="store_true", help="start from a freshly initialized policy")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=4096)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--max-importance-weight", type=float, default=2.0)
+    parser.add_argument("--threads", type=int, default=os.cpu_count(), help="torch intra-op threads")
+    parser.add_argument("--keep-checkpoints", type=int, default=3)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    if args.seed is not None:
+        torch.manual_seed(args.seed)
+
+    start = time.perf_counter()
+    states, actions, rewards, log_probs = rewarded_decisions(args.log_dir, STATE_DIM)
+    print(f"Loaded {len(rewards)} rewarded decisions from {args.log_dir} in {time.perf_counter() - start:.2f}s")
+    if len(rewards) == 0:
+        print("Nothing to train on")
+        return
+
+    policy = PolicyNetwork(STATE_DIM, ACTION_DIM)
+    optimizer = torch.optim.Adam(policy.parameters(), lr=args.lr)
+    train_steps = 0
+    if not args.from_scratch and os.path.exists(args.model_path):
+        checkpoint = torch.load(args.model_path, map_location="cpu")
+        policy.load_state_dict(checkpoint["model_state_dict"])
+        optimizer.load_state_dict(checkpoint["optimizer_state_dict"])
+        for group in optimizer.param_groups:
+            group["lr"] = args.lr
+        train_steps = checkpoint.get("train_steps", 0)
+        print(f"Fine-tuning {args.model_path} ({train_steps} steps)")
+    else:
+        print("Training from scratch")
+
+    states = torch.from_numpy(states)
+    actions = torch.from_numpy(actions)
+    old_log_probs = torch.from_numpy(log_probs)
+    # Whole-log baseline instead of the online agent's running one
+    advantages = torch.from_numpy(rewards)
+    advantages = advantages - advantages.mean()
+    if len(advantages) > 1:
+        advantages = advantages / (advantages.std() + 1e-8)
+
+    start = time.perf_counter()
+    for epoch in range(args.epochs):
+        order = torch.randperm(len(advantages))
+        losses = []
+        for i in range(0, len(order), args.batch_size):
+            batch = order[i:i + args.batch_size]
+            losses.append(reinforce_step(policy, optimizer, states[batch], actions[batch], advantages[batch],
+                                         old_log_probs[batch], args.max_importance_weight))
+            train_steps += 1
+        print(f"Epoch {epoch + 1}/{args.epochs}: loss {np.mean(losses):.4f}")
+    elapsed = time.perf_counter() - start
+    print(f"Trained {args.epochs} epochs in {elapsed:.2f}s "
+          f"({args.epochs * len(advantages) / max(elapsed, 1e-9):.0f} samples/s)")
+
+    output = args.output or args.model_path
+    writer = CheckpointWriter(output, keep=args.keep_checkpoints)
+    writer.submit({
+        'model_state_dict': policy.state_dict(),
+        'optimizer_state_dict': optimizer.state_dict(),
+        'timestamp': datetime.now().isoformat(),
+        'train_steps': train_steps,
+        'state_dim': STATE_DIM,
+        'action_dim': ACTION_DIM,
+    })
+    writer.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Trainer process for multi-worker deployments.
+
+Run the API with inference-only workers and one trainer next to them:
+
+    RL_ROLE=worker RL_TORCH_THREADS=1 uvicorn main:app --workers 4
+    python trainer.py
+
+Workers log decisions and feedback to model/experience.log; the trainer owns the
+optimizer and checkpoints, and publishes new weights to model/shared_weights.bin,
+which the workers map and pick up without restarting.
+"""
+
+import os
+import signal
+import sys
+import time
+from agent import RLAgent
+
+
+def main():
+    rl_agent = RLAgent(
+        role="trainer",
+        torch_threads=int(os.getenv("RL_TORCH_THREADS", "0")) or None,
+        watch_path=os.getenv("RL_MODEL_WATCH_PATH") or None,
+    )
+
+    def signal_handler(sig, frame):
+        print("\nGracefully shutting down...")
+        rl_agent.save_model(wait=True)
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    print(f"Trainer running, publishing weights to {rl_agent.shared_weights_path}")
+    while True:
+        time.sleep(60)
+        print(f"Trainer: {rl_agent.train_steps} steps, weights version {rl_agent.weights_version}, "
+              f"{len(rl_agent.replay)} samples buffered, {rl_agent.dropped_feedback} rewards dropped")
+
+
+if __name__ == "__main__":
+    main()
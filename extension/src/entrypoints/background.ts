@@ -2,6 +2,125 @@ import { storage } from '#imports';
 
 const backendUrl = "http://localhost:8000";
 
+// Gaze samples are buffered and sent to the backend in batches
+const GAZE_FLUSH_INTERVAL = 2000;
+const sessionId = crypto.randomUUID();
+let gazeBuffer = { t: [] as number[], x: [] as number[], y: [] as number[] };
+
+const flushGazeData = () => {
+  if (gazeBuffer.t.length === 0) {
+    return;
+  }
+  const batch = gazeBuffer;
+  gazeBuffer = { t: [], x: [], y: [] };
+  fetch(`${backendUrl}/gaze_events`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json'
+    },
+    body: JSON.stringify({ session_id: sessionId, ...batch })
+  }).catch(() => {});
+}
+
+// JSON merge patch (RFC 7396), as returned by the backend for profile updates
+const mergePatch = (target: any, patch: any): any => {
+  if (patch === null || typeof patch !== 'object' || Array.isArray(patch)) {
+    return patch;
+  }
+  const result = (target !== null && typeof target === 'object' && !Array.isArray(target)) ? { ...target } : {};
+  for (const [key, value] of Object.entries(patch)) {
+    if (value === null) {
+      delete result[key];
+    } else {
+      result[key] = mergePatch(result[key], value);
+    }
+  }
+  return result;
+}
+
+// The backend keeps a copy of the profile and config under a per-install user id,
+// so chat messages only send the message and get back what changed
+const userProfileUrl = async () => {
+  let userId = await storage.getItem<string>('local:userId');
+  if (!userId) {
+    userId = crypto.randomUUID();
+    await storage.setItem('local:userId', userId);
+  }
+  return `${backendUrl}/users/${userId}`;
+}
+
+// Upload the local profile and config, replacing whatever the backend has
+const uploadProfile = async (url: string) => {
+  const response = await fetch(url, {
+    method: 'PUT',
+    headers: {
+      'Content-Type': 'application/json'
+    },
+    body: JSON.stringify({
+      userInfo: await storage.getItem('local:userInfo'),
+      config: await storage.getItem('local:appConfig')
+    })
+  });
+  if (!response.ok) {
+    throw new Error('Network response was not ok');
+  }
+  await storage.setItem('local:profileEtag', response.headers.get('ETag'));
+}
+
+// Replace the local profile and config with the backend's, which is ahead of ours
+const downloadProfile = async (url: string) => {
+  const response = await fetch(url);
+  if (!response.ok) {
+    throw new Error('Network response was not ok');
+  }
+  const result = await response.json();
+  await storage.setItem('local:userInfo', result.userInfo);
+  await storage.setItem('local:appConfig', result.config);
+  await storage.setItem('local:profileEtag', response.headers.get('ETag'));
+}
+
+const sendUserMessage = async (userMessage: unknown, retry = true): Promise<void> => {
+  const url = await userProfileUrl();
+  const etag = await storage.getItem<string>('local:profileEtag');
+  if (!etag) {
+    await uploadProfile(url);
+    return sendUserMessage(userMessage, false);
+  }
+  const response = await fetch(`${url}/message`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      'If-Match': etag
+    },
+    body: JSON.stringify({ message: userMessage })
+  });
+  if (response.status === 404 && retry) {
+    // The backend lost the profile
+    await uploadProfile(url);
+    return sendUserMessage(userMessage, false);
+  }
+  if (response.status === 412 && retry) {
+    // The backend stored something newer, e.g. an earlier message of ours: catch up, don't overwrite it
+    await downloadProfile(url);
+    return sendUserMessage(userMessage, false);
+  }
+  if (!response.ok) {
+    throw new Error('Network response was not ok');
+  }
+  const result = await response.json();
+  if (result.status === 'failed') {
+    throw new Error(result.error);
+  }
+  // Only the changes come back: a merge patch for the profile and the regenerated tags
+  const userInfo = await storage.getItem('local:userInfo');
+  await storage.setItem('local:userInfo', mergePatch(userInfo, result.userInfo));
+  if (Object.keys(result.config).length > 0) {
+    const prevConfig = await storage.getItem('local:appConfig') as ExtensionConfig;
+    await storage.setItem('local:appConfig', { ...prevConfig, ...result.config });
+  }
+  await storage.setItem('local:profileEtag', response.headers.get('ETag'));
+}
+
 const initStorage = async () => {
   const config: ExtensionConfig = {
     "div": {
@@ -51,9 +170,13 @@ const initStorage = async () => {
   });
   storage.setItem('local:appConfig', config);
   storage.setItem('local:userInfo', userInfo);
+  // Re-upload the fresh profile with the next message
+  storage.removeItem('local:profileEtag');
 }
 
 export default defineBackground(() => {
+  setInterval(flushGazeData, GAZE_FLUSH_INTERVAL);
+
   storage.getItem('local:appConfig').then((appConfig) => {
     if (appConfig === null) {
       initStorage();
@@ -61,7 +184,12 @@ export default defineBackground(() => {
   });
 
   browser.runtime.onMessage.addListener(async (message: { type: string, data: object }) => {
-    if (message.type === 'updateConfig') {
+    if (message.type === 'gazeData') {
+      const sample = message.data as { t: number, x: number, y: number };
+      gazeBuffer.t.push(sample.t);
+      gazeBuffer.x.push(sample.x);
+      gazeBuffer.y.push(sample.y);
+    } else if (message.type === 'updateConfig') {
       const tag = (message.data as { tag: string }).tag;
       const userInfo = await storage.getItem('local:userInfo')
       fetch(`${backendUrl}/create_config`, {
@@ -79,42 +207,11 @@ export default defineBackground(() => {
         }
         const prevConfig = await storage.getItem('local:appConfig') as ExtensionConfig;
         storage.setItem('local:appConfig', { ...prevConfig, [tag]: await response.json() });
+        // The backend's copy of the config is out of date now
+        storage.removeItem('local:profileEtag');
       });
     } else if (message.type === 'updateUserInfo') {
-      const userMessage = message.data;
-      const userInfo = await storage.getItem('local:userInfo');
-      fetch(`${backendUrl}/update_user_info`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({
-          message: userMessage,
-          userInfo: userInfo
-        })
-      }).then(async (response) => {
-        if (!response.ok) {
-          throw new Error('Network response was not ok');
-        }
-        storage.setItem('local:userInfo', await response.json());
-        const config = await storage.getItem('local:appConfig');
-        fetch(`${backendUrl}/update_whole_config`, {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/json'
-          },
-          body: JSON.stringify({
-            userInfo: userInfo,
-            config: config
-          })
-        }).then(async (response) => {
-          if (!response.ok) {
-            throw new Error('Network response was not ok');
-          }
-          const updatedConfig = await response.json();
-          storage.setItem('local:appConfig', updatedConfig);
-        });
-      });
+      sendUserMessage(message.data);
     }
   })
 });
\ No newline at end of file
@@ -134,6 +134,7 @@ export default defineContentScript({
       const ratio = (eyeGazeData.left.width+eyeGazeData.right.width) / (eyeGazeData.left.height + eyeGazeData.right.height);
       
       const deviation = Math.abs(ratio - currentAverageEyeRatio);
+      const currentTime = Date.now();
       // Update the eye ratio average
       eyeRatioSum += ratio;
       eyeRatioCount++;
@@ -144,13 +145,13 @@ export default defineContentScript({
         data: {
           x: stableGazeX / window.innerWidth,
           y: stableGazeY / window.innerHeight,
+          t: currentTime,
           blink: (deviation > 0.3),
         }
       }).catch(() => {});
 
       const elementAtGaze = document.elementFromPoint(stableGazeX, stableGazeY);
       //console.log('Element at gaze coordinates:', elementAtGaze);
-      const currentTime = Date.now();
 
 
       for (let i = elements.length - 1; i >= 0; i--) {